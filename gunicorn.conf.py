@@ -0,0 +1,54 @@
+"""Gunicorn settings for the tour booking app.
+
+Run from this directory with ``gunicorn`` (this file is picked up
+automatically). Each setting can be overridden with the environment
+variable next to it.
+
+preload_app imports the app once in the master, so forked workers start
+almost instantly and share the imported code's memory. That is safe here:
+the SQLite pool, background threads and process pools are all created
+lazily per worker process (they check os.getpid()).
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'tour_booking_system_v2:create_app()'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# 'gthread': each worker serves `threads` requests at once; keep threads <= DB_POOL_SIZE.
+# Payment status streams are capped below `threads` (see PAYMENT_STREAM_MAX_WAITERS below).
+# 'gevent': many more idle connections per worker (e.g. payment status streams); needs gevent installed.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000)) # gevent only
+
+# Each payment status stream (SSE) holds a thread while the browser waits.
+# Under gthread those are the worker's `threads`, so cap the streams below
+# that and leave at least half the threads for pages; greenlets are cheap.
+if worker_class != 'gevent':
+    stream_waiters = int(os.getenv('PAYMENT_STREAM_MAX_WAITERS', threads // 2))
+    os.environ['PAYMENT_STREAM_MAX_WAITERS'] = str(max(min(stream_waiters, threads - 1), 0))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Recycle workers to cap slow leaks; the jitter stops them all restarting at once
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30)) # Seconds a worker may go silent before it is restarted
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Heartbeat files on a tmpfs, so a slow disk cannot stall workers (Docker's /tmp is often overlayfs)
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+
+if worker_class == 'gevent' and preload_app:
+    # With preload_app the app's modules (and their locks) are imported in the
+    # master, before gevent's worker would patch them, so patch here first.
+    from gevent import monkey
+    monkey.patch_all()
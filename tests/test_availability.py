@@ -0,0 +1,42 @@
+from tour_booking_system_v2.database import get_db
+from tour_booking_system_v2.inventory import hold_seats
+
+AUGUST = '/api/availability?from=2025-08-01&to=2025-08-31'
+
+
+def test_calendar_lists_seats_per_date(client):
+    response = client.get(AUGUST)
+    assert response.status_code == 200
+    assert response.json['fields'] == ['tour_id', 'seats_left', 'seats_total', 'status']
+    assert response.json['days'] == {
+        '2025-08-10': [[1, 20, 20, 'available']],
+        '2025-08-15': [[2, 15, 15, 'available']],
+        '2025-08-20': [[3, 10, 10, 'available']],
+        '2025-08-25': [[4, 12, 12, 'available']],
+    }
+
+def test_unchanged_range_is_not_modified(client):
+    etag = client.get(AUGUST).headers['ETag']
+    response = client.get(AUGUST, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+def test_hold_in_range_changes_etag(app, client):
+    etag = client.get(AUGUST).headers['ETag']
+    september = client.get('/api/availability?from=2025-09-01&to=2025-09-30').headers['ETag']
+    with app.app_context():
+        hold_seats(get_db(), 2, None, 'Test Customer', 'customer@example.com', 3)
+
+    response = client.get(AUGUST, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json['days']['2025-08-15'] == [[2, 12, 15, 'available']]
+    # Other ranges keep their ETag
+    assert client.get('/api/availability?from=2025-09-01&to=2025-09-30', headers={'If-None-Match': september}).status_code == 304
+
+def test_bad_ranges_are_rejected(client):
+    for query in ('from=2025-08-31&to=2025-08-01', 'from=August', 'from=2025-01-01&to=2027-01-01'):
+        response = client.get(f'/api/availability?{query}')
+        assert response.status_code == 400
+        assert response.json['error']
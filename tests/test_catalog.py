@@ -0,0 +1,30 @@
+import pytest
+
+from tour_booking_system_v2 import catalog
+
+
+@pytest.fixture
+def fragment_cache(monkeypatch):
+    """A fresh in-memory catalog cache for this test, in place of the suite's null backend."""
+    backend = catalog.MemoryBackend(64, 3600)
+    monkeypatch.setattr(catalog, 'get_backend', lambda app=None: backend)
+    return backend
+
+
+def fragment_keys(backend):
+    return sorted(key for key in backend._cache._data if key.startswith('fragment:memories:'))
+
+
+def test_junk_query_strings_share_one_fragment(client, fragment_cache):
+    for query in ('', '?x=1', '?x=2&utm_source=mail', '?tour_id=0', '?tour_id=abc', '?after=not-a-cursor'):
+        assert client.get(f'/memories{query}').status_code == 200
+    assert len(fragment_keys(fragment_cache)) == 1
+
+def test_filters_and_pages_are_cached_separately(client, fragment_cache):
+    first = client.get('/memories?per_page=1&x=1').get_data(as_text=True)
+    assert 'x=1' not in first # Pager links are built from the parsed arguments only
+    assert 'Delicious Street Food' in first and 'Cycling by the Sea' not in first
+
+    client.get('/memories?tour_id=2')
+    client.get('/memories?tour_id=2&per_page=25') # The default page size
+    assert len(fragment_keys(fragment_cache)) == 2
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from tour_booking_system_v2.images import EXIF_ORIENTATION, render_variants
+
+Image = pytest.importorskip('PIL.Image')
+GPS_INFO = 0x8825
+MAKE = 0x010F
+
+
+def exif(**tags):
+    data = Image.Exif()
+    for tag, value in tags.items():
+        data[{'orientation': EXIF_ORIENTATION, 'make': MAKE, 'gps': GPS_INFO}[tag]] = value
+    return data.tobytes()
+
+
+def test_jpeg_original_loses_exif_but_not_quality(tmp_path):
+    source = tmp_path / 'photo.jpg'
+    Image.new('RGB', (400, 200), (200, 50, 50)).save(
+        source, quality=92, subsampling=0, exif=exif(orientation=6, make='Camera', gps={1: 'N'})
+    )
+    os.chmod(source, 0o644)
+    with Image.open(source) as before:
+        tables = before.quantization
+
+    variants = render_variants(str(source), str(tmp_path / 'variants'), [100], 80)
+
+    with Image.open(source) as after:
+        assert dict(after.getexif()) == {EXIF_ORIENTATION: 6} # Still displays upright
+        assert after.quantization == tables
+        assert after.layer[0][1:3] == (1, 1) # 4:4:4 chroma, as uploaded
+    assert os.stat(source).st_mode & 0o777 == 0o644
+    assert sorted(os.listdir(tmp_path)) == ['photo.jpg', 'variants'] # No temp file left behind
+    assert ('jpeg', 100, 200, 'photo_100w.jpg') in variants # Rotated before resizing
+
+def test_png_original_loses_exif(tmp_path):
+    source = tmp_path / 'map.png'
+    Image.new('RGBA', (50, 30)).save(source, exif=exif(make='Camera'))
+
+    render_variants(str(source), str(tmp_path / 'variants'), [20], 80)
+
+    with Image.open(source) as after:
+        assert not after.getexif()
+        assert after.size == (50, 30)
@@ -0,0 +1,84 @@
+import io
+import json
+
+from tour_booking_system_v2.imports import import_tours
+from tour_booking_system_v2.inventory import hold_seats
+
+from conftest import add_tour
+
+CSV_HEADER = 'name,description,price,date,max_participants,status\n'
+
+
+def run_import(db, text, fmt='csv', dry_run=False):
+    return import_tours(db, io.BytesIO(text.encode('utf-8')), fmt, dry_run=dry_run)
+
+def tours_named(db, name):
+    return db.execute(
+        'SELECT date, price, max_participants, status FROM tours WHERE name = ? ORDER BY date', (name,)
+    ).fetchall()
+
+
+def test_import_inserts_then_updates_by_name_and_date(db):
+    result = run_import(db, CSV_HEADER +
+        'Lake Trip,Boats.,20,2030-03-01,10,available\n'
+        'Lake Trip,Boats.,20,2030-03-08,10,available\n')
+    assert (result.inserted, result.updated, result.error_count) == (2, 0, 0)
+
+    result = run_import(db, CSV_HEADER +
+        'Lake Trip,Bigger boats.,25,2030-03-01,12,available\n'
+        'Lake Trip,Boats.,20,2030-03-15,10,coming_soon\n')
+    assert (result.inserted, result.updated, result.error_count) == (1, 1, 0)
+
+    rows = tours_named(db, 'Lake Trip')
+    assert [(row['date'], float(row['price']), row['max_participants']) for row in rows] == [
+        ('2030-03-01', 25.0, 12), ('2030-03-08', 20.0, 10), ('2030-03-15', 20.0, 10),
+    ]
+    assert rows[2]['status'] == 'coming_soon'
+
+def test_import_keeps_booked_seats(db):
+    tour_id = add_tour(db, 'Lake Trip', seats=10, date='2030-03-01')
+    hold_seats(db, tour_id, None, 'Test Customer', 'customer@example.com', 6)
+
+    result = run_import(db, json.dumps([
+        {'name': 'Lake Trip', 'price': 20, 'date': '2030-03-01', 'max_participants': 5},
+    ]), fmt='json')
+    assert (result.inserted, result.updated, result.error_count) == (0, 0, 1)
+    assert 'below the 6 seats' in result.errors[0][1]
+    row = db.execute('SELECT max_participants, held_participants FROM tours WHERE id = ?', (tour_id,)).fetchone()
+    assert (row['max_participants'], row['held_participants']) == (10, 6)
+
+def test_import_rejects_bad_and_duplicate_rows(db):
+    result = run_import(db, '\n'.join(json.dumps(record) for record in [
+        {'name': 'Lake Trip', 'price': 20, 'date': '2030-03-01', 'max_participants': 10},
+        {'name': 'Lake Trip', 'price': 22, 'date': '2030-03-01', 'max_participants': 10},
+        {'name': 'Lake Trip', 'price': 'free', 'date': '2030-03-02', 'max_participants': 10},
+        {'name': 'Lake Trip', 'price': 20, 'date': '1 March', 'max_participants': 10},
+    ]), fmt='ndjson')
+    assert (result.rows, result.inserted, result.error_count) == (4, 1, 3)
+    assert [number for number, _ in result.errors] == [2, 3, 4]
+    assert float(tours_named(db, 'Lake Trip')[0]['price']) == 20.0
+
+def test_dry_run_writes_nothing(db):
+    result = run_import(db, CSV_HEADER + 'Lake Trip,Boats.,20,2030-03-01,10,available\n', dry_run=True)
+    assert result.inserted == 1
+    assert tours_named(db, 'Lake Trip') == []
+
+def test_non_utf8_file_is_rejected_whole(db):
+    text = (CSV_HEADER + 'Lake Trip,Boats.,20,2030-03-01,10,available\n').encode('utf-8')
+    text += 'Café Safari,Dunes.,30,2030-03-02,8,available\n'.encode('cp1252')
+    result = import_tours(db, io.BytesIO(text), 'csv')
+    assert result.file_error
+    assert (result.inserted, result.updated, result.error_count) == (0, 0, 1)
+    assert 'UTF-8' in result.errors[0][1]
+    assert 'Nothing was imported' in result.summary()
+    assert tours_named(db, 'Lake Trip') == []
+
+    result = import_tours(db, io.BytesIO(b'{"name": "\xff\xfeabc", "price": 1}\n'), 'ndjson')
+    assert result.file_error and result.errors[0][0] == 1
+
+def test_non_finite_prices_are_rejected(db):
+    result = run_import(db, CSV_HEADER +
+        'Lake Trip,Boats.,nan,2030-03-01,10,available\n'
+        'Lake Trip,Boats.,inf,2030-03-08,10,available\n')
+    assert (result.inserted, result.error_count) == (0, 2)
+    assert all('is not a number' in message for _, message in result.errors)
@@ -0,0 +1,97 @@
+import pytest
+
+from tour_booking_system_v2.callbacks import apply_mpesa_callback
+from tour_booking_system_v2.inventory import (
+    SeatsUnavailable, convert_hold, hold_seats, release_expired_holds, release_hold, renew_hold,
+)
+
+from conftest import add_tour, booking_status, stk_callback, stk_push, tour_seats
+
+
+def hold(db, tour_id, seats, ttl=None):
+    return hold_seats(db, tour_id, None, 'Test Customer', 'customer@example.com', seats, ttl=ttl)
+
+def pay(db, booking_id, result_code=0):
+    paid = apply_mpesa_callback(db, stk_callback(stk_push(db, booking_id), result_code))
+    db.commit()
+    return paid
+
+
+def test_hold_reserves_seats_and_refuses_oversell(db):
+    tour_id = add_tour(db, seats=3)
+    booking_id = hold(db, tour_id, 2)
+    assert tour_seats(db, tour_id) == (0, 2)
+    assert booking_status(db, booking_id) == 'pending'
+
+    with pytest.raises(SeatsUnavailable) as excinfo:
+        hold(db, tour_id, 2)
+    assert excinfo.value.remaining == 1
+    assert not db.in_transaction
+    assert db.execute('SELECT COUNT(*) FROM bookings WHERE tour_id = ?', (tour_id,)).fetchone()[0] == 1
+
+def test_convert_moves_held_seats_to_sold(db):
+    tour_id = add_tour(db, seats=3)
+    booking_id = hold(db, tour_id, 2)
+    assert convert_hold(db, booking_id, tour_id, 2)
+    db.commit()
+    assert tour_seats(db, tour_id) == (2, 0)
+    assert db.execute('SELECT status FROM seat_holds WHERE booking_id = ?', (booking_id,)).fetchone()[0] == 'converted'
+
+def test_release_gives_seats_back_once(db):
+    tour_id = add_tour(db, seats=3)
+    booking_id = hold(db, tour_id, 2)
+    assert release_hold(db, booking_id)
+    assert not release_hold(db, booking_id)
+    db.commit()
+    assert tour_seats(db, tour_id) == (0, 0)
+
+def test_expired_holds_are_released(db):
+    lapsed = add_tour(db, 'Lapsed Tour', seats=3)
+    active = add_tour(db, 'Active Tour', seats=3)
+    hold(db, lapsed, 2, ttl=-1)
+    hold(db, active, 1)
+    assert release_expired_holds(db) == 1
+    assert tour_seats(db, lapsed) == (0, 0)
+    assert tour_seats(db, active) == (0, 1)
+
+def test_new_hold_takes_seats_of_expired_hold(db):
+    tour_id = add_tour(db, seats=3)
+    hold(db, tour_id, 3, ttl=-1)
+    hold(db, tour_id, 3)
+    assert tour_seats(db, tour_id) == (0, 3)
+
+def test_paid_callback_converts_hold_once(db):
+    tour_id = add_tour(db, seats=3)
+    booking_id = hold(db, tour_id, 2)
+    callback = stk_callback(stk_push(db, booking_id))
+    assert apply_mpesa_callback(db, callback) == booking_id
+    db.commit()
+    assert apply_mpesa_callback(db, callback) is None # Daraja retried the callback
+    db.commit()
+    assert booking_status(db, booking_id) == 'paid'
+    assert tour_seats(db, tour_id) == (2, 0)
+
+def test_failed_callback_releases_hold_and_renew_reclaims_it(db):
+    tour_id = add_tour(db, seats=3)
+    booking_id = hold(db, tour_id, 2)
+    assert pay(db, booking_id, result_code=1032) is None
+    assert booking_status(db, booking_id) == 'failed'
+    assert tour_seats(db, tour_id) == (0, 0)
+
+    renew_hold(db, booking_id)
+    assert booking_status(db, booking_id) == 'pending'
+    assert tour_seats(db, tour_id) == (0, 2)
+    assert pay(db, booking_id) == booking_id
+    assert tour_seats(db, tour_id) == (2, 0)
+
+def test_late_payment_for_resold_seats_is_marked_refund_due(db):
+    tour_id = add_tour(db, seats=2)
+    late = hold(db, tour_id, 2, ttl=-1)
+    prompt = hold(db, tour_id, 2) # Takes the seats of the lapsed hold
+
+    with pytest.raises(SeatsUnavailable):
+        renew_hold(db, late)
+    assert pay(db, prompt) == prompt
+    assert pay(db, late) is None
+    assert booking_status(db, late) == 'refund_due'
+    assert tour_seats(db, tour_id) == (2, 0)
@@ -0,0 +1,18 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from tour_booking_system_v2 import passwords
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'scrypt:16384:8:1', 'pbkdf2', 'pbkdf2:sha512', 'pbkdf2:sha256:1000'])
+def test_method_prefix_matches_what_werkzeug_writes(method):
+    assert passwords._method_prefix(method) == generate_password_hash('secret', method).split('$', 1)[0]
+
+def test_needs_rehash_does_not_hash(app, monkeypatch):
+    stored = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+    monkeypatch.setattr(passwords, 'generate_password_hash', None) # Any call would raise
+    with app.app_context():
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        assert not passwords.needs_rehash(stored)
+        app.config['PASSWORD_HASH_METHOD'] = 'scrypt'
+        assert passwords.needs_rehash(stored)
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import Counter
+
+from tour_booking_system_v2 import callbacks, emails
+from tour_booking_system_v2.database import get_db
+from tour_booking_system_v2.inventory import hold_seats
+
+from conftest import add_tour, booking_status, stk_callback, stk_push
+
+WORKERS = 4
+
+
+def claim_concurrently(app, claim):
+    """Runs ``claim(db)`` on WORKERS threads until it returns nothing; returns every id claimed."""
+    claimed, errors = [], []
+    start = threading.Barrier(WORKERS)
+
+    def worker():
+        with app.app_context():
+            db = get_db()
+            start.wait()
+            try:
+                while True:
+                    ids = claim(db)
+                    if not ids:
+                        break
+                    claimed.extend(ids)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return claimed
+
+
+def test_inbound_events_are_claimed_once(app, db):
+    event_ids = [callbacks.enqueue_event(db, 'mpesa_stk', {'n': n}) for n in range(40)]
+
+    def claim(db):
+        event = callbacks._claim_next(db, time.time())
+        return [event['id']] if event else []
+
+    claimed = claim_concurrently(app, claim)
+    assert not [id for id, count in Counter(claimed).items() if count > 1]
+    assert sorted(claimed) == event_ids
+    assert db.execute("SELECT COUNT(*) FROM inbound_events WHERE status = 'processing' AND attempts = 1").fetchone()[0] == 40
+
+def test_outbox_messages_are_claimed_once(app, db):
+    app.config['OUTBOX_BATCH_SIZE'] = 3
+    for n in range(30):
+        emails.queue_email(db, f'customer{n}@example.com', 'Subject', '<p>Body</p>')
+    db.commit()
+
+    claimed = claim_concurrently(app, lambda db: [row['id'] for row in emails._claim_batch(db, time.time())])
+    assert len(claimed) == len(set(claimed)) == 30
+    assert db.execute("SELECT COUNT(*) FROM email_outbox WHERE status = 'sending'").fetchone()[0] == 30
+
+def test_stale_claims_are_handed_out_again(app, db):
+    event_id = callbacks.enqueue_event(db, 'mpesa_stk', {})
+    assert callbacks._claim_next(db, time.time())['id'] == event_id
+    assert callbacks._claim_next(db, time.time()) is None
+    later = time.time() + app.config.get('CALLBACK_CLAIM_TIMEOUT', 300) + 1
+    assert callbacks._claim_next(db, later)['id'] == event_id
+
+def test_processed_event_pays_booking_and_queues_email(app, db):
+    tour_id = add_tour(db, seats=3)
+    booking_id = hold_seats(db, tour_id, None, 'Test Customer', 'customer@example.com', 2)
+    event_id = callbacks.enqueue_event(db, 'mpesa_stk', stk_callback(stk_push(db, booking_id)))
+
+    assert callbacks.process_next_event(app)
+    assert not callbacks.process_next_event(app)
+    assert db.execute('SELECT status FROM inbound_events WHERE id = ?', (event_id,)).fetchone()[0] == 'done'
+    assert booking_status(db, booking_id) == 'paid'
+    outbox = db.execute('SELECT recipient, subject FROM email_outbox').fetchall()
+    assert [row['recipient'] for row in outbox] == ['customer@example.com']
+
+def test_callback_for_unknown_checkout_is_retried(app, db):
+    event_id = callbacks.enqueue_event(db, 'mpesa_stk', stk_callback('ws_CO_unknown'))
+
+    assert callbacks.process_next_event(app)
+    event = db.execute('SELECT status, attempts, available_at, last_error FROM inbound_events WHERE id = ?', (event_id,)).fetchone()
+    assert event['status'] == 'queued'
+    assert event['attempts'] == 1
+    assert event['available_at'] > time.time()
+    assert 'ws_CO_unknown' in event['last_error']
+
+def test_callback_for_checkout_never_recorded_is_failed_after_grace(app, db):
+    event_id = callbacks.enqueue_event(db, 'mpesa_stk', stk_callback('ws_CO_unknown'))
+    grace = app.config['CALLBACK_UNKNOWN_CHECKOUT_GRACE']
+    db.execute('UPDATE inbound_events SET received_at = received_at - ? WHERE id = ?', (grace, event_id))
+    db.commit()
+
+    assert callbacks.process_next_event(app)
+    event = db.execute('SELECT status, attempts, last_error FROM inbound_events WHERE id = ?', (event_id,)).fetchone()
+    assert (event['status'], event['attempts']) == ('failed', 1)
+    assert 'ws_CO_unknown' in event['last_error']
@@ -0,0 +1,57 @@
+from werkzeug.datastructures import MultiDict
+
+from tour_booking_system_v2.search import search
+
+from conftest import add_tour
+
+
+def names(rows):
+    return [row['name'] for row in rows]
+
+
+def test_tours_match_word_prefixes_with_highlights(db):
+    rows, has_more, filters = search(db, 'tours', 'hik', MultiDict())
+    assert names(rows) == ['Mountain Hiking Adventure']
+    assert '<mark>Hiking</mark>' in rows[0]['name_html']
+    assert not has_more
+    assert filters == {}
+
+def test_every_word_must_match(db):
+    assert names(search(db, 'tours', 'coastal views', MultiDict())[0]) == ['Coastal Cycling Tour']
+    assert search(db, 'tours', 'coastal desert', MultiDict())[0] == []
+
+def test_search_input_is_not_query_syntax(db):
+    assert search(db, 'tours', '" OR * %', MultiDict()) == ([], False, {})
+    assert search(db, 'tours', 'city"', MultiDict())[0][0]['name'] == 'City Historical Walk'
+
+def test_highlights_escape_html(db):
+    add_tour(db, '<b>Bold</b> Treks')
+    rows = search(db, 'tours', 'bold', MultiDict())[0]
+    assert rows[0]['name_html'] == '&lt;b&gt;<mark>Bold</mark>&lt;/b&gt; Treks'
+
+def test_filters_and_paging(db):
+    for n in range(5):
+        add_tour(db, f'River Rafting {n}', date=f'2030-06-0{n + 1}', status='available' if n % 2 else 'coming_soon')
+
+    rows, has_more, filters = search(db, 'tours', 'rafting', MultiDict({'status': 'available'}))
+    assert sorted(names(rows)) == ['River Rafting 1', 'River Rafting 3']
+    assert filters == {'status': 'available'}
+
+    args = MultiDict({'date_from': '2030-06-02', 'date_to': '2030-06-04'})
+    assert sorted(names(search(db, 'tours', 'rafting', args)[0])) == ['River Rafting 1', 'River Rafting 2', 'River Rafting 3']
+
+    first, has_more, _ = search(db, 'tours', 'rafting', MultiDict(), page=1, per_page=3)
+    second, no_more, _ = search(db, 'tours', 'rafting', MultiDict(), page=2, per_page=3)
+    assert (len(first), has_more, len(second), no_more) == (3, True, 2, False)
+    assert not set(names(first)) & set(names(second))
+
+def test_memories(db):
+    rows = search(db, 'memories', 'street', MultiDict())[0]
+    assert [row['title'] for row in rows] == ['Delicious Street Food']
+    assert search(db, 'memories', 'street', MultiDict({'tour_id': '2'}))[0] == []
+
+def test_search_api(client):
+    response = client.get('/api/search?q=city&kind=tours')
+    assert response.status_code == 200
+    assert [row['name'] for row in response.json['tours']['results']] == ['City Historical Walk']
+    assert response.json['tours']['results'][0]['name_html'] == '<mark>City</mark> Historical Walk'
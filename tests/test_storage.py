@@ -0,0 +1,47 @@
+"""The SQL rewriting the MySQL backend relies on; runs without a MySQL server."""
+import os
+
+from tour_booking_system_v2.storage import split_script, translate
+
+SCHEMA_MYSQL = os.path.join(os.path.dirname(__file__), '..', 'tour_booking_system_v2', 'schema_mysql.sql')
+
+
+def test_placeholders_become_format_style_outside_strings():
+    sql = "SELECT id FROM tours WHERE name = ? AND description != '?' AND status = ?"
+    assert translate(sql, 'mysql', 'format', 'format') == (
+        "SELECT id FROM tours WHERE name = %s AND description != '?' AND status = %s"
+    )
+    assert translate(sql, 'sqlite', 'qmark', None) == sql
+
+def test_percent_signs_are_escaped_for_the_driver():
+    sql = "SELECT id FROM tours WHERE name LIKE '%s%' AND id = ?"
+    assert translate(sql, 'mysql', 'format', 'format') == "SELECT id FROM tours WHERE name LIKE '%%s%' AND id = %s"
+    assert translate(sql, 'mysql', 'format', 'all') == "SELECT id FROM tours WHERE name LIKE '%%s%%' AND id = %s"
+
+def test_begin_immediate_starts_an_innodb_transaction():
+    assert translate('BEGIN IMMEDIATE', 'mysql', 'format', 'format') == 'START TRANSACTION'
+    assert translate('BEGIN IMMEDIATE', 'sqlite', 'qmark', None) == 'BEGIN IMMEDIATE'
+
+def test_split_script_honours_delimiter_lines():
+    statements = split_script(
+        '-- comment\n'
+        'CREATE TABLE a (id INT);\n'
+        'DELIMITER //\n'
+        'CREATE TRIGGER t AFTER INSERT ON a FOR EACH ROW BEGIN\n'
+        '    UPDATE b SET n = n + 1;\n'
+        'END//\n'
+        'DELIMITER ;\n'
+        'INSERT INTO a VALUES (1);\n'
+    )
+    assert statements == [
+        'CREATE TABLE a (id INT)',
+        'CREATE TRIGGER t AFTER INSERT ON a FOR EACH ROW BEGIN\n    UPDATE b SET n = n + 1;\nEND',
+        'INSERT INTO a VALUES (1)',
+    ]
+
+def test_mysql_schema_splits_into_whole_statements():
+    with open(SCHEMA_MYSQL, encoding='utf8') as f:
+        statements = split_script(f.read())
+    assert statements
+    assert not [s for s in statements if s.upper().startswith('DELIMITER') or s.endswith(';')]
+    assert any(s.startswith('CREATE TABLE stk_pushes') for s in statements)
@@ -0,0 +1,54 @@
+from tour_booking_system_v2.inventory import convert_hold, hold_seats, release_hold
+from tour_booking_system_v2.sweeper import sweep
+
+from conftest import add_tour, booking_status, stk_push, tour_seats
+
+LONG_AGO = '2000-01-01 00:00:00'
+
+
+def booking(db, tour_id, seats=1, status=None, booked_at=None):
+    booking_id = hold_seats(db, tour_id, None, 'Test Customer', 'customer@example.com', seats)
+    if status is not None:
+        if status == 'paid':
+            convert_hold(db, booking_id, tour_id, seats)
+        else:
+            release_hold(db, booking_id)
+        db.execute('UPDATE bookings SET payment_status = ? WHERE id = ?', (status, booking_id))
+    if booked_at is not None:
+        db.execute('UPDATE bookings SET booking_date = ? WHERE id = ?', (booked_at, booking_id))
+    db.commit()
+    return booking_id
+
+def archived_ids(db):
+    return [row['id'] for row in db.execute('SELECT id FROM bookings_archive ORDER BY id')]
+
+
+def test_sweep_expires_stale_pending_bookings_and_frees_their_seats(db):
+    tour_id = add_tour(db, seats=5)
+    stale = booking(db, tour_id, seats=2, booked_at=LONG_AGO)
+    fresh = booking(db, tour_id, seats=1)
+
+    result = sweep(db, pending_ttl=3600, archive_after_days=0, batch_size=1)
+    assert result == {'holds_released': 0, 'expired': 1, 'archived': 0}
+    assert booking_status(db, stale) == 'expired'
+    assert booking_status(db, fresh) == 'pending'
+    assert tour_seats(db, tour_id) == (0, 1)
+
+def test_sweep_archives_old_failed_and_expired_bookings(db):
+    tour_id = add_tour(db, seats=10)
+    expired = booking(db, tour_id, booked_at=LONG_AGO)
+    failed = booking(db, tour_id, status='failed', booked_at=LONG_AGO)
+    stk_push(db, failed)
+    paid = booking(db, tour_id, status='paid', booked_at=LONG_AGO)
+    recent_failure = booking(db, tour_id, status='failed')
+
+    result = sweep(db, pending_ttl=3600, archive_after_days=30, batch_size=1)
+    assert result['expired'] == 1
+    assert result['archived'] == 2
+    assert archived_ids(db) == sorted([expired, failed])
+    remaining = [row['id'] for row in db.execute('SELECT id FROM bookings ORDER BY id')]
+    assert remaining == [paid, recent_failure]
+    assert db.execute('SELECT COUNT(*) FROM stk_pushes WHERE booking_id = ?', (failed,)).fetchone()[0] == 0
+
+def test_sweep_with_nothing_to_do(db):
+    assert sweep(db) == {'holds_released': 0, 'expired': 0, 'archived': 0}
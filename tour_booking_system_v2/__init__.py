@@ -0,0 +1,3 @@
+"""Ravine Adventures tour booking app. ``create_app`` is the application factory."""
+
+from .app import create_app
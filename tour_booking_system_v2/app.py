@@ -1,40 +1,38 @@
 import os
-import sqlite3
 import functools
+import time
 from datetime import datetime
-import requests # New: For M-Pesa API calls
-import json     # New: For M-Pesa API calls
 import base64   # New: For M-Pesa API calls
-from PIL import Image # For image processing (good to keep)
-import uuid # For unique filenames
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, g, jsonify # jsonify is new
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, jsonify, Response, send_file, stream_with_context
+from jinja2 import FileSystemBytecodeCache
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-from tour_booking_system_v2 import create_app
 
 
-# Flask-Mail (Keep this as you're using it for emails)
-from flask_mail import Mail, Message
-
 # Import database functions (assuming database.py handles get_db, close_db, init_app)
-from .database import get_db, close_db, init_app
-
-
-# Load environment variables from .env file (must be at the top)
-load_dotenv()
-
-# --- M-PESA API Global Configuration ---
-# These are loaded once when the app starts.
-MPESA_CONSUMER_KEY = os.getenv('MPESA_CONSUMER_KEY')
-MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET')
-MPESA_SHORTCODE = os.getenv('MPESA_SHORTCODE')
-MPESA_PASSKEY = os.getenv('MPESA_PASSKEY')
-MPESA_CALLBACK_URL = os.getenv('MPESA_CALLBACK_URL') # From .env, updated by ngrok
-
-def create_app():
-    app = Flask(__name__, instance_relative_config=True)
+from .database import get_db, close_db, init_app, pool_stats
+from . import availability, benchmark, callbacks, daraja_sim, emails, exports, identity, imports, images, inventory, metrics, mpesa, payment_events, query_plans, receipts, repository, search, slow_queries, sweeper
+from .callbacks import enqueue_event, queue_stats, validate_mpesa_callback
+from .catalog import cached_fragment, cached_query, catalog_state, catalog_stats
+from .emails import outbox_stats, queue_contact_email
+from .http_cache import conditional
+from .identity import identity_stats, invalidate_user
+from .inventory import SeatsUnavailable, hold_seats, renew_hold
+from .passwords import HashingBusy, check_password, hash_password, hashing_stats
+from .pagination import PAYMENT_STATUSES, booking_filters, page_args, page_size
+from .storage import DatabaseError
+
+
+def create_app(test_config=None):
+    # Load environment variables from .env before reading any configuration.
+    # Done here rather than at import time so importing the package (e.g. a
+    # gunicorn master with preload_app) has no side effects.
+    load_dotenv()
+
+    # The instance folder (database, caches) stays inside the package, where it has always been
+    instance_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+    app = Flask(__name__, instance_path=instance_path, instance_relative_config=True)
 
     # Configure Flask app
     app.config.from_mapping(
@@ -49,10 +47,126 @@ def create_app():
         MAIL_USERNAME=os.getenv('EMAIL_USER'),
         MAIL_PASSWORD=os.getenv('EMAIL_PASS'),
         MAIL_DEFAULT_SENDER=os.getenv('SENDGRID_SENDER_EMAIL', os.getenv('EMAIL_USER')),
+
+        # --- Connection Pool (per gunicorn worker) & SQLite PRAGMAs ---
+        DB_POOL_SIZE=int(os.getenv('DB_POOL_SIZE', 8)),
+        DB_POOL_TIMEOUT=float(os.getenv('DB_POOL_TIMEOUT', 10)), # Seconds to wait for a free connection
+        DB_JOURNAL_MODE=os.getenv('DB_JOURNAL_MODE', 'WAL'),
+        DB_SYNCHRONOUS=os.getenv('DB_SYNCHRONOUS', 'NORMAL'),
+        DB_BUSY_TIMEOUT=int(os.getenv('DB_BUSY_TIMEOUT', 5000)), # Milliseconds
+        DB_MMAP_SIZE=int(os.getenv('DB_MMAP_SIZE', 268435456)), # Bytes (256 MB)
+        DB_CACHE_SIZE=int(os.getenv('DB_CACHE_SIZE', -16000)), # Negative values are KiB (16 MB)
+
+        # --- Storage Backend (SQLAlchemy pool when DATABASE_URL is set) ---
+        DATABASE_URL=os.getenv('DATABASE_URL', ''), # e.g. mysql+mysqlconnector://tours:secret@db/tours; empty = the SQLite DATABASE file
+        DB_MAX_OVERFLOW=int(os.getenv('DB_MAX_OVERFLOW', 4)), # Connections opened beyond DB_POOL_SIZE during bursts, closed when returned
+        DB_POOL_RECYCLE=int(os.getenv('DB_POOL_RECYCLE', 1800)), # Seconds; keep below the server's wait_timeout and any proxy idle timeout
+        DB_POOL_PRE_PING=os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true', # Check connections on checkout; survives server restarts
+        DB_ISOLATION_LEVEL=os.getenv('DB_ISOLATION_LEVEL'), # Default: READ COMMITTED on MySQL
+
+        # How long a pending booking keeps its seats while the customer pays
+        SEAT_HOLD_TTL=int(os.getenv('SEAT_HOLD_TTL', 900)), # Seconds
+
+        # --- Booking Sweeper (`flask sweep-bookings` from cron, or in-process) ---
+        BOOKING_PENDING_TTL=int(os.getenv('BOOKING_PENDING_TTL', 86400)), # Seconds before an unpaid booking is marked 'expired'
+        BOOKING_ARCHIVE_AFTER_DAYS=int(os.getenv('BOOKING_ARCHIVE_AFTER_DAYS', 30)), # Failed/expired bookings then move to bookings_archive; 0 = never
+        SWEEP_BATCH_SIZE=int(os.getenv('SWEEP_BATCH_SIZE', 500)), # Rows per transaction
+        SWEEP_INTERVAL=float(os.getenv('SWEEP_INTERVAL', 0)), # Seconds between in-process sweeps; 0 = cron only
+
+        # --- M-Pesa Callback Queue ---
+        CALLBACK_WORKERS=int(os.getenv('CALLBACK_WORKERS', 2)), # In-process worker threads; 0 = use `flask process-callbacks`
+        CALLBACK_POLL_INTERVAL=float(os.getenv('CALLBACK_POLL_INTERVAL', 1.0)), # Seconds
+        CALLBACK_MAX_ATTEMPTS=int(os.getenv('CALLBACK_MAX_ATTEMPTS', 5)),
+        CALLBACK_CLAIM_TIMEOUT=int(os.getenv('CALLBACK_CLAIM_TIMEOUT', 300)), # Seconds before a stuck event is retried
+        CALLBACK_UNKNOWN_CHECKOUT_GRACE=float(os.getenv('CALLBACK_UNKNOWN_CHECKOUT_GRACE', 15)), # Seconds a callback for an unrecorded CheckoutRequestID is retried before it is failed
+
+        # --- Email Outbox Sender ---
+        OUTBOX_WORKERS=int(os.getenv('OUTBOX_WORKERS', 1)), # In-process sender threads; 0 = use `flask send-outbox`
+        OUTBOX_POLL_INTERVAL=float(os.getenv('OUTBOX_POLL_INTERVAL', 5.0)), # Seconds
+        OUTBOX_BATCH_SIZE=int(os.getenv('OUTBOX_BATCH_SIZE', 50)), # Messages sent per SMTP connection
+        OUTBOX_MAX_ATTEMPTS=int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8)),
+        OUTBOX_RETRY_BASE=int(os.getenv('OUTBOX_RETRY_BASE', 30)), # Seconds; doubles with each attempt
+        OUTBOX_CLAIM_TIMEOUT=int(os.getenv('OUTBOX_CLAIM_TIMEOUT', 300)),
+
+        # --- Memories Image Pipeline (Pillow) ---
+        IMAGE_WORKERS=int(os.getenv('IMAGE_WORKERS', 2)), # Processes rendering derivatives
+        IMAGE_VARIANT_WIDTHS=tuple(int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '320,640,1024').split(',')),
+        IMAGE_QUALITY=int(os.getenv('IMAGE_QUALITY', 80)),
+
+        # --- PDF Receipts (WeasyPrint if installed, else a plain text PDF) ---
+        RECEIPT_WORKERS=int(os.getenv('RECEIPT_WORKERS', 2)), # Processes rendering receipts
+        RECEIPT_DIR=os.getenv('RECEIPT_DIR', os.path.join(app.instance_path, 'receipts')), # Cache, one file per booking and M-Pesa receipt
+        RECEIPT_RENDER_TIMEOUT=float(os.getenv('RECEIPT_RENDER_TIMEOUT', 30)), # Seconds a download waits for a missing receipt
+
+        # --- Listing Pagination ---
+        PAGE_SIZE=int(os.getenv('PAGE_SIZE', 25)),
+        PAGE_SIZE_MAX=int(os.getenv('PAGE_SIZE_MAX', 100)), # Cap on ?per_page=
+        EXPORT_CHUNK_SIZE=int(os.getenv('EXPORT_CHUNK_SIZE', 1000)), # Rows fetched per chunk by the bookings export
+        IMPORT_MAX_ERRORS=int(os.getenv('IMPORT_MAX_ERRORS', 100)), # Row errors listed after a tour import
+
+        # --- Logged-in User Cache (per process) ---
+        IDENTITY_CACHE_SIZE=int(os.getenv('IDENTITY_CACHE_SIZE', 1024)), # Users kept; 0 disables caching
+        IDENTITY_CACHE_TTL=float(os.getenv('IDENTITY_CACHE_TTL', 30)), # Seconds; bounds staleness across workers
+
+        # --- Catalog Page Cache (/tours, /coming_soon, /done_tours, /memories) ---
+        CATALOG_CACHE_BACKEND=os.getenv('CATALOG_CACHE_BACKEND', 'memory'), # 'memory' (per worker), 'sqlite' (shared file) or 'none'
+        CATALOG_CACHE_SIZE=int(os.getenv('CATALOG_CACHE_SIZE', 256)), # Entries; least recently used are evicted first
+        CATALOG_CACHE_TTL=float(os.getenv('CATALOG_CACHE_TTL', 3600)), # Seconds; entries are also replaced on every catalog change
+        CATALOG_CACHE_PATH=os.getenv('CATALOG_CACHE_PATH', os.path.join(app.instance_path, 'catalog_cache.db')), # For the 'sqlite' backend
+
+        # --- HTTP Caching (ETag / Last-Modified) ---
+        HTTP_CACHE_MAX_AGE=int(os.getenv('HTTP_CACHE_MAX_AGE', 0)), # Seconds anonymous catalog pages may be reused unchecked; 0 = always revalidate
+
+        # --- M-Pesa Daraja Credentials ---
+        MPESA_CONSUMER_KEY=os.getenv('MPESA_CONSUMER_KEY'),
+        MPESA_CONSUMER_SECRET=os.getenv('MPESA_CONSUMER_SECRET'),
+        MPESA_SHORTCODE=os.getenv('MPESA_SHORTCODE'),
+        MPESA_PASSKEY=os.getenv('MPESA_PASSKEY'),
+        MPESA_CALLBACK_URL=os.getenv('MPESA_CALLBACK_URL'), # From .env, updated by ngrok
+
+        # --- M-Pesa OAuth Token Cache ---
+        MPESA_TOKEN_REFRESH_MARGIN=int(os.getenv('MPESA_TOKEN_REFRESH_MARGIN', 300)), # Refresh this many seconds before expiry
+        MPESA_TOKEN_CACHE_FILE=os.getenv('MPESA_TOKEN_CACHE_FILE', os.path.join(app.instance_path, 'mpesa_token.json')), # '' = per-process only
+        MPESA_HTTP_TIMEOUT=float(os.getenv('MPESA_HTTP_TIMEOUT', 10)), # Seconds
+        MPESA_BASE_URL=os.getenv('MPESA_BASE_URL', mpesa.SANDBOX_BASE_URL), # e.g. http://127.0.0.1:8089 for `flask daraja-sim`
+
+        # --- Password Hashing (off the request thread) ---
+        PASSWORD_HASH_METHOD=os.getenv('PASSWORD_HASH_METHOD', 'scrypt'), # Werkzeug method, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'
+        PASSWORD_HASH_WORKERS=int(os.getenv('PASSWORD_HASH_WORKERS', 2)), # Hashes computed at once per process
+        PASSWORD_HASH_QUEUE=int(os.getenv('PASSWORD_HASH_QUEUE', 32)), # Extra logins allowed to wait for a worker
+        PASSWORD_HASH_TIMEOUT=float(os.getenv('PASSWORD_HASH_TIMEOUT', 10)), # Seconds to wait before answering 503
+
+        # --- Request Metrics (/metrics, Prometheus text format) ---
+        METRICS_ENABLED=os.getenv('METRICS_ENABLED', 'True').lower() == 'true', # Per-route latency, SQL and Daraja timings
+        METRICS_TOKEN=os.getenv('METRICS_TOKEN'), # Bearer token for scrapers; admins can always view /metrics
+        SLOW_QUERY_THRESHOLD_MS=float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 100)), # Log statements slower than this with their plan; 0 = off
+        SLOW_QUERY_LOG_SIZE=int(os.getenv('SLOW_QUERY_LOG_SIZE', 200)), # Entries kept for /admin/slow-queries
+
+        # --- Live Payment Status (/booking_details/<id>/events, Server-Sent Events) ---
+        PAYMENT_STREAM_MAX_WAITERS=int(os.getenv('PAYMENT_STREAM_MAX_WAITERS', 500)), # Browsers held per process; each holds a thread, so gunicorn.conf.py caps it below `threads` under gthread; 0 = off
+        PAYMENT_STREAM_WINDOW=float(os.getenv('PAYMENT_STREAM_WINDOW', 300)), # Seconds after an STK push during which booking_details listens for its callback
+        PAYMENT_STREAM_TIMEOUT=float(os.getenv('PAYMENT_STREAM_TIMEOUT', 120)), # Seconds before a stream closes and the browser reconnects
+        PAYMENT_STREAM_KEEPALIVE=float(os.getenv('PAYMENT_STREAM_KEEPALIVE', 15)), # Seconds between comment lines on an idle stream
+        PAYMENT_STREAM_RETRY=float(os.getenv('PAYMENT_STREAM_RETRY', 3)), # Seconds the browser waits before reconnecting
+        PAYMENT_STREAM_POLL_INTERVAL=float(os.getenv('PAYMENT_STREAM_POLL_INTERVAL', 2)), # Catches callbacks applied by other processes
+
+        # --- Catalog Search (SQLite FTS5) ---
+        SEARCH_RANK_WINDOW=int(os.getenv('SEARCH_RANK_WINDOW', 1000)), # Newest matches ranked per query; bounds the cost of very common words
+
+        # --- Availability API ---
+        AVAILABILITY_DEFAULT_DAYS=int(os.getenv('AVAILABILITY_DEFAULT_DAYS', 30)), # Range returned when ?to= is left out
+        AVAILABILITY_MAX_DAYS=int(os.getenv('AVAILABILITY_MAX_DAYS', 366)), # Longest range one request may ask for
+
+        # --- Templates ---
+        JINJA_BYTECODE_CACHE_DIR=os.getenv('JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache')), # Compiled templates shared by workers; '' = off
     )
 
-    # Initialize Flask-Mail
-    mail = Mail(app)
+    if test_config is not None:
+        # Overrides for benchmarks and tests (e.g. a throwaway DATABASE)
+        app.config.from_mapping(test_config)
+
+    # Email outbox (Flask-Mail itself is loaded on the first send)
+    emails.init_app(app)
 
     # Ensure the instance folder exists
     try:
@@ -60,19 +174,29 @@ def create_app():
     except OSError:
         pass
 
+    # New workers load compiled templates instead of re-parsing every one on first render
+    if app.config['JINJA_BYTECODE_CACHE_DIR']:
+        os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
+    metrics.init_app(app) # First, so later before_request hooks are timed too
     init_app(app) # Initialize database commands for Flask CLI
+    inventory.init_app(app)
+    sweeper.init_app(app)
+    callbacks.init_app(app)
+    payment_events.init_app(app)
+    images.init_app(app)
+    receipts.init_app(app)
+    exports.init_app(app)
+    imports.init_app(app)
+    daraja_sim.init_app(app)
+    benchmark.init_app(app)
+    query_plans.init_app(app)
+    search.init_app(app)
+    availability.init_app(app)
+    identity.init_app(app) # Loads g.user before each request
 
     # --- Authentication Helper Functions ---
-    @app.before_request
-    def load_logged_in_user():
-        user_id = session.get('user_id')
-        if user_id is None:
-            g.user = None
-        else:
-            g.user = get_db().execute(
-                'SELECT * FROM users WHERE id = ?', (user_id,)
-            ).fetchone()
-
     def login_required(view):
         @functools.wraps(view)
         def wrapped_view(**kwargs):
@@ -94,79 +218,10 @@ def create_app():
             return view(**kwargs)
         return wrapped_view
 
-    # --- Email Sending Functions (Flask-Mail) ---
-    def send_confirmation_email(recipient_email, recipient_name, tour_name, num_participants, booking_id):
-        sender_email = app.config.get('MAIL_DEFAULT_SENDER')
-
-        if not sender_email or not app.config.get('MAIL_USERNAME') or not app.config.get('MAIL_PASSWORD'):
-            app.logger.warning("Flask-Mail configuration incomplete. Confirmation email not sent.")
-            return False
-
-        try:
-            msg = Message(
-                subject=f'Tour Booking Confirmation: {tour_name}',
-                sender=sender_email,
-                recipients=[recipient_email],
-                html=f'''
-                <p>Hello {recipient_name},</p>
-                <p>Your booking for the <strong>{tour_name}</strong> tour has been confirmed!</p>
-                <p><strong>Booking ID:</strong> {booking_id}</p>
-                <p><strong>Number of Participants:</strong> {num_participants}</p>
-                <p>Thank you for choosing our tour booking system.</p>
-                <p>Best regards,<br>The Tour Booking Team</p>
-                '''
-            )
-            mail.send(msg)
-            app.logger.info(f"Confirmation email sent to {recipient_email}.")
-            return True
-        except Exception as e:
-            app.logger.error(f"Error sending confirmation email to {recipient_email}: {e}")
-            return False
-
-    def send_contact_email(name, email, subject, message_body):
-        admin_email_recipient = os.getenv('ADMIN_EMAIL_FOR_CONTACT', 'your_admin_inbox@example.com')
-        sender_email = app.config.get('MAIL_DEFAULT_SENDER')
-
-        if not sender_email or not app.config.get('MAIL_USERNAME') or not app.config.get('MAIL_PASSWORD'):
-            app.logger.warning("Flask-Mail configuration incomplete. Contact email not sent.")
-            return False
-
-        try:
-            msg = Message(
-                subject=f"New Contact Form: {subject} (from {name} - {email})",
-                sender=sender_email,
-                recipients=[admin_email_recipient],
-                html=f'''
-                <p>You have received a new message from your website's contact form:</p>
-                <p><strong>Name:</strong> {name}</p>
-                <p><strong>Email:</strong> {email}</p>
-                <p><strong>Subject:</strong> {subject}</p>
-                <p><strong>Message:</strong></p>
-                <p style="white-space: pre-wrap;">{message_body}</p>
-                '''
-            )
-            mail.send(msg)
-            app.logger.info(f"Contact email sent from {email} to {admin_email_recipient}.")
-            return True
-        except Exception as e:
-            app.logger.error(f"Error sending contact email from {email}: {e}")
-            return False
-
     # --- M-Pesa Specific Helper Function ---
     def get_mpesa_access_token():
-        try:
-            consumer_key = MPESA_CONSUMER_KEY
-            consumer_secret = MPESA_CONSUMER_SECRET
-            # Use sandbox URL for development
-            api_url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-            # For production: "https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-
-            response = requests.get(api_url, auth=(consumer_key, consumer_secret))
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            return response.json()['access_token']
-        except requests.exceptions.RequestException as e:
-            app.logger.error(f"Error getting M-Pesa access token: {e}")
-            return None
+        # Cached until shortly before expiry; see mpesa.TokenCache
+        return mpesa.get_access_token(app.config['MPESA_CONSUMER_KEY'], app.config['MPESA_CONSUMER_SECRET'])
 
     # --- Core Routes ---
     @app.route('/')
@@ -193,25 +248,23 @@ def create_app():
                 error = 'Password is required.'
             elif password != confirm_password:
                 error = 'Passwords do not match.'
-            elif db.execute(
-                'SELECT id FROM users WHERE username = ?', (username,)
-            ).fetchone() is not None:
+            elif repository.username_taken(db, username):
                 error = f"User {username} is already registered."
-            elif db.execute(
-                'SELECT id FROM users WHERE email = ?', (email,)
-            ).fetchone() is not None:
+            elif repository.email_taken(db, email):
                 error = f"An account with email {email} already exists."
 
             if error is None:
                 try:
-                    db.execute(
-                        'INSERT INTO users (username, email, password, is_admin) VALUES (?, ?, ?, ?)',
-                        (username, email, generate_password_hash(password), 0)
-                    )
+                    password_hash = hash_password(password)
+                except HashingBusy:
+                    flash('We are handling a lot of sign-ups right now. Please try again in a moment.', 'warning')
+                    return render_template('register.html'), 503
+                try:
+                    repository.create_user(db, username, email, password_hash)
                     db.commit()
                     flash('Registration successful! Please log in.', 'success')
                     return redirect(url_for('login'))
-                except sqlite3.Error as e:
+                except DatabaseError as e:
                     db.rollback()
                     error = f"Database error: {e}"
             flash(error, 'error')
@@ -224,18 +277,27 @@ def create_app():
             password = request.form['password']
             db = get_db()
             error = None
-            user = db.execute(
-                'SELECT * FROM users WHERE username = ?', (username,)
-            ).fetchone()
+            user = repository.find_user_by_username(db, username)
 
             if user is None:
                 error = 'Incorrect username.'
-            elif not check_password_hash(user['password'], password):
-                error = 'Incorrect password.'
+            else:
+                try:
+                    ok, new_hash = check_password(user['password'], password)
+                except HashingBusy:
+                    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+                    return render_template('login.html'), 503
+                if not ok:
+                    error = 'Incorrect password.'
+                elif new_hash is not None:
+                    # Upgrade a legacy or weaker hash now that we know the password
+                    repository.set_password_hash(db, user['id'], new_hash)
+                    db.commit()
 
             if error is None:
                 session.clear()
                 session['user_id'] = user['id']
+                invalidate_user(user['id']) # Start the session from the current row
                 flash(f'Welcome back, {user["username"]}!', 'success')
                 return redirect(url_for('index'))
             flash(error, 'error')
@@ -249,18 +311,24 @@ def create_app():
 
     @app.route('/tours')
     def tours():
-        db = get_db()
-        available_tours = db.execute(
-            "SELECT * FROM tours WHERE status = 'available' ORDER BY date ASC"
-        ).fetchall()
-        return render_template('tours.html', tours=available_tours)
+        version, updated_at = catalog_state(get_db())
+
+        def render():
+            fragment = cached_fragment('tours', 'catalog/tours.html', lambda version: {
+                'tours': cached_query(
+                    'available_tours', "SELECT * FROM tours WHERE status = 'available' ORDER BY date ASC", version=version
+                )
+            }, version=version)
+            return render_template('tours.html', fragment=fragment)
+
+        return conditional(render, version, last_modified=updated_at)
 
     # --- MODIFIED: Booking flow to initiate M-Pesa payment ---
     @app.route('/book/<int:tour_id>', methods=('GET', 'POST'))
     @login_required
     def book_tour(tour_id):
         db = get_db()
-        tour = db.execute('SELECT * FROM tours WHERE id = ?', (tour_id,)).fetchone()
+        tour = repository.get_tour(db, tour_id)
 
         if tour is None or tour['status'] != 'available':
             flash('Tour not found or not available for booking.', 'error')
@@ -275,23 +343,19 @@ def create_app():
                 flash('Please ensure participants are greater than 0.', 'error')
                 return render_template('book_tour.html', tour=tour)
 
-            if tour['current_participants'] + num_participants > tour['max_participants']:
-                flash(f'Sorry, there are only {tour["max_participants"] - tour["current_participants"]} spots left for this tour.', 'error')
-                return render_template('book_tour.html', tour=tour)
-
             try:
-                # Insert booking as 'pending' before M-Pesa payment
-                cursor = db.execute(
-                    'INSERT INTO bookings (tour_id, user_id, customer_name, customer_email, num_participants, payment_status) VALUES (?, ?, ?, ?, ?, ?)',
-                    (tour_id, g.user['id'], customer_name, customer_email, num_participants, 'pending')
+                # Atomically hold the seats and insert the booking as 'pending' before M-Pesa payment
+                booking_id = hold_seats(
+                    db, tour_id, g.user['id'], customer_name, customer_email, num_participants
                 )
-                booking_id = cursor.lastrowid # Get the ID of the newly inserted booking
-                db.commit()
                 flash('Booking placed successfully! Proceed to payment.', 'success')
                 # Redirect to a new booking_details page to initiate M-Pesa
                 return redirect(url_for('booking_details', booking_id=booking_id))
-            except sqlite3.Error as e:
-                db.rollback()
+            except SeatsUnavailable as e:
+                flash(f'Sorry, there are only {e.remaining} spots left for this tour.', 'error')
+                tour = repository.get_tour(db, tour_id)
+                return render_template('book_tour.html', tour=tour)
+            except DatabaseError as e:
                 flash(f'Database error during booking: {e}', 'danger')
                 app.logger.error(f"Error creating booking: {e}")
             finally:
@@ -303,22 +367,86 @@ def create_app():
     @app.route('/booking_details/<int:booking_id>')
     @login_required
     def booking_details(booking_id):
-        db = get_db()
-        booking = db.execute(
-            'SELECT b.id, b.num_participants, b.payment_status, b.booking_date, '
-            'b.customer_name, b.customer_email, '
-            'b.mpesa_receipt, b.amount_paid, b.phone_number_paid, ' # Include M-Pesa specific fields
-            't.name AS tour_name, t.description, t.price, t.date AS tour_date '
-            'FROM bookings b JOIN tours t ON b.tour_id = t.id '
-            'WHERE b.id = ? AND b.user_id = ?',
-            (booking_id, session['user_id'])
-        ).fetchone()
+        booking = repository.user_booking(get_db(), booking_id, session['user_id'])
 
         if not booking:
             flash('Booking not found or you do not have permission.', 'danger')
             return redirect(url_for('my_bookings')) # Assuming you have a my_bookings route
 
-        return render_template('booking_details.html', booking=booking)
+        # Listen for the callback only after an STK push, while one could still arrive
+        awaiting_payment = app.config['PAYMENT_STREAM_MAX_WAITERS'] > 0 and payment_events.awaiting_callback(
+            booking['payment_status'], repository.last_stk_push_at(get_db(), booking_id), app.config['PAYMENT_STREAM_WINDOW']
+        )
+
+        # The row holds everything the page shows, payment status included
+        return conditional(
+            lambda: render_template('booking_details.html', booking=booking, awaiting_payment=awaiting_payment),
+            tuple(booking), awaiting_payment
+        )
+
+    @app.route('/booking_details/<int:booking_id>/events')
+    @login_required
+    def booking_status_events(booking_id):
+        # Server-Sent Events: the page waits here for the M-Pesa callback instead of being refreshed
+        retry_ms = int(app.config['PAYMENT_STREAM_RETRY'] * 1000)
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'} # No proxy buffering of the stream
+        waiter = payment_events.subscribe(booking_id, app.config['PAYMENT_STREAM_MAX_WAITERS'])
+        if waiter is None:
+            # Full: the page reconnects after the retry delay, a few times at most
+            return Response(payment_events.busy_event(retry_ms), mimetype='text/event-stream', headers=headers)
+
+        try:
+            # Subscribed before reading, so a callback landing in between is not missed
+            db = get_db()
+            booking = repository.user_booking_status(db, booking_id, session['user_id'])
+            if booking is None or booking['payment_status'] != 'pending':
+                payment_events.unsubscribe(waiter)
+                if booking is None:
+                    return Response('Booking not found.', status=404, mimetype='text/plain')
+                body = payment_events.status_event(booking_id, booking['payment_status'], retry_ms)
+                return Response(body, mimetype='text/event-stream', headers=headers)
+            if not payment_events.awaiting_callback(
+                booking['payment_status'], repository.last_stk_push_at(db, booking_id), app.config['PAYMENT_STREAM_WINDOW']
+            ):
+                # No recent STK push, so no callback to wait for; 204 tells EventSource not to reconnect
+                payment_events.unsubscribe(waiter)
+                return Response(status=204)
+        except BaseException:
+            payment_events.unsubscribe(waiter) # E.g. a PoolTimeout; the slot must not leak
+            raise
+
+        payment_events.status_poller.ensure_started(app)
+        # Not wrapped in stream_with_context: the pooled connection goes back at teardown, before the wait
+        return Response(
+            payment_events.stream(waiter, app.config['PAYMENT_STREAM_TIMEOUT'], app.config['PAYMENT_STREAM_KEEPALIVE'], retry_ms),
+            mimetype='text/event-stream', headers=headers
+        )
+
+    @app.route('/booking_details/<int:booking_id>/receipt.pdf')
+    @login_required
+    def generate_pdf_receipt(booking_id):
+        booking = get_db().execute(receipts.RECEIPT_QUERY, (booking_id,)).fetchone()
+        if booking is None or (booking['user_id'] != g.user['id'] and g.user['is_admin'] != 1):
+            flash('Booking not found or you do not have permission.', 'danger')
+            return redirect(url_for('my_bookings'))
+        if booking['payment_status'] != 'paid':
+            flash('A receipt is available once the booking is paid.', 'info')
+            return redirect(url_for('booking_details', booking_id=booking_id))
+
+        try:
+            path = receipts.receipt_file(booking)
+        except Exception as e:
+            app.logger.error(f"Error rendering receipt for booking {booking_id}: {e}", exc_info=True)
+            flash('Your receipt could not be generated right now. Please try again shortly.', 'danger')
+            return redirect(url_for('booking_details', booking_id=booking_id))
+        # The cached file's mtime and size give a stable ETag for conditional GETs
+        response = send_file(
+            path, mimetype='application/pdf', download_name=f'receipt-{booking_id}.pdf', conditional=True, etag=True, max_age=0
+        )
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
 
     # --- NEW: M-Pesa Payment Initiation Route (STK Push) ---
     @app.route('/initiate-mpesa-payment/<int:booking_id>', methods=['POST'])
@@ -331,12 +459,7 @@ def create_app():
             flash('Please enter a valid M-Pesa phone number (e.g., 07XXXXXXXX or 2547XXXXXXXX).', 'danger')
             return redirect(url_for('booking_details', booking_id=booking_id))
 
-        db = get_db()
-        booking = db.execute(
-            'SELECT b.id, b.num_participants, b.payment_status, t.price, t.name AS tour_name '
-            'FROM bookings b JOIN tours t ON b.tour_id = t.id WHERE b.id = ? AND b.user_id = ?',
-            (booking_id, session['user_id'])
-        ).fetchone()
+        booking = repository.booking_for_payment(get_db(), booking_id, session['user_id'])
 
         if not booking:
             flash('Booking not found or you do not have permission.', 'danger')
@@ -345,7 +468,15 @@ def create_app():
         if booking['payment_status'] == 'paid':
             flash('This booking has already been paid for.', 'info')
             return redirect(url_for('booking_details', booking_id=booking_id))
+        if booking['payment_status'] == 'expired':
+            # Its seats went back on sale when it expired
+            flash('This booking has expired. Please book the tour again.', 'warning')
+            return redirect(url_for('book_tour', tour_id=booking['tour_id']))
+        if booking['payment_status'] == 'refund_due':
+            flash('A payment for this booking is already being refunded.', 'info')
+            return redirect(url_for('booking_details', booking_id=booking_id))
 
+        import requests # Deferred until the first payment; it is the slowest import at worker boot
         try:
             # Calculate total amount (M-Pesa expects whole numbers in KES)
             amount = int(booking['price'] * booking['num_participants'])
@@ -359,13 +490,22 @@ def create_app():
                 flash('Phone number must start with 07, 01, or 254.', 'danger')
                 return redirect(url_for('booking_details', booking_id=booking_id))
 
+            # The hold may have lapsed (or gone with a failed payment); only
+            # ask for money while the seats are still ours
+            try:
+                renew_hold(get_db(), booking_id)
+            except SeatsUnavailable as e:
+                flash(f'Sorry, the seats for this booking are no longer available ({e.remaining} left). Please book again.', 'warning')
+                return redirect(url_for('book_tour', tour_id=booking['tour_id']))
+
             access_token = get_mpesa_access_token()
             if not access_token:
                 flash('Could not get M-Pesa access token. Please try again later.', 'danger')
                 return redirect(url_for('booking_details', booking_id=booking_id))
 
             timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode('utf-8')
+            shortcode = app.config['MPESA_SHORTCODE']
+            password = base64.b64encode(f"{shortcode}{app.config['MPESA_PASSKEY']}{timestamp}".encode()).decode('utf-8')
 
             headers = {
                 'Authorization': f'Bearer {access_token}',
@@ -375,26 +515,27 @@ def create_app():
             transaction_desc = f"Payment for {booking['tour_name']} booking {booking['id']}"
             
             payload = {
-                "BusinessShortCode": MPESA_SHORTCODE,
+                "BusinessShortCode": shortcode,
                 "Password": password,
                 "Timestamp": timestamp,
                 "TransactionType": "CustomerPayBillOnline", # Use "CustomerPayBillOnline" for Paybill, "CustomerBuyGoodsOnline" for Till Number
                 "Amount": amount,
                 "PartyA": phone_number,
-                "PartyB": MPESA_SHORTCODE,
+                "PartyB": shortcode,
                 "PhoneNumber": phone_number,
-                "CallBackURL": MPESA_CALLBACK_URL,
+                "CallBackURL": app.config['MPESA_CALLBACK_URL'],
                 "AccountReference": str(booking_id), # Unique reference for your transaction
                 "TransactionDesc": transaction_desc
             }
 
-            api_url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-
-            response = requests.post(api_url, headers=headers, json=payload)
+            response = mpesa.call('POST', mpesa.STK_PUSH_PATH, 'stk_push', headers=headers, json=payload)
             response.raise_for_status()
             response_data = response.json()
 
             if response_data.get('ResponseCode') == '0':
+                db = get_db()
+                repository.record_stk_push(db, response_data['CheckoutRequestID'], booking_id, int(time.time()))
+                db.commit()
                 flash(f'M-Pesa STK Push initiated to {phone_number}. Please enter your M-Pesa PIN to complete payment.', 'info')
                 return redirect(url_for('booking_details', booking_id=booking_id))
             else:
@@ -403,6 +544,8 @@ def create_app():
                 return redirect(url_for('booking_details', booking_id=booking_id))
 
         except requests.exceptions.RequestException as e:
+            if e.response is not None and e.response.status_code == 401:
+                mpesa.token_cache.invalidate() # Token revoked early; fetch a new one next time
             app.logger.error(f"HTTP Request error during M-Pesa STK Push: {e}", exc_info=True)
             flash(f'An error occurred while initiating M-Pesa payment (network issue). Please try again.', 'danger')
             return redirect(url_for('booking_details', booking_id=booking_id))
@@ -414,121 +557,30 @@ def create_app():
     # --- NEW: M-Pesa Callback (Webhook) Endpoint ---
     @app.route('/mpesa-callback', methods=['POST'])
     def mpesa_callback():
-        data = request.json
-        app.logger.info(f"M-Pesa Callback Received: {json.dumps(data, indent=2)}")
+        data = request.get_json(silent=True)
 
-        # Acknowledge receipt immediately as per Daraja API best practices
-        response_to_daraja = {"ResultCode": 0, "ResultDesc": "C2B Recieved."}
+        # Only validate and persist here; a callback worker applies the payment,
+        # so Daraja gets its acknowledgement without waiting on the DB or SMTP.
+        error = validate_mpesa_callback(data)
+        if error:
+            app.logger.warning(f"Rejected M-Pesa callback: {error}")
+            return jsonify({"ResultCode": 1, "ResultDesc": error}), 400
 
         try:
-            body = data.get('Body', {})
-            stk_callback = body.get('stkCallback', {})
-            
-            result_code = stk_callback.get('ResultCode')
-            result_desc = stk_callback.get('ResultDesc')
+            event_id = enqueue_event(get_db(), 'mpesa_stk', data)
+        except DatabaseError as e:
+            # Not acknowledged, so Daraja will retry the callback
+            app.logger.error(f"DB Error queueing M-Pesa callback: {e}")
+            return jsonify({"ResultCode": 1, "ResultDesc": "Internal Server Error"}), 500
 
-            callback_metadata = stk_callback.get('CallbackMetadata', {})
-            item_list = callback_metadata.get('Item', [])
-            
-            booking_id_str = None # Received as string
-            mpesa_receipt_number = None
-            amount_paid = None
-            phone_number = None
-
-            # Parse the CallbackMetadata to get transaction details
-            for item in item_list:
-                if item.get('Name') == 'Amount':
-                    amount_paid = item.get('Value')
-                elif item.get('Name') == 'MpesaReceiptNumber':
-                    mpesa_receipt_number = item.get('Value')
-                elif item.get('Name') == 'PhoneNumber':
-                    phone_number = item.get('Value')
-                elif item.get('Name') == 'BillAccountRef': # This is where AccountReference (your booking_id) is usually found
-                    booking_id_str = item.get('Value')
-
-            conn = get_db() # Use get_db()
-            booking_id = None
-            if booking_id_str:
-                try:
-                    booking_id = int(booking_id_str) # Convert to int
-                except ValueError:
-                    app.logger.error(f"Invalid booking_id_str received: {booking_id_str}")
-                    return jsonify({"ResultCode": 1, "ResultDesc": "Invalid Booking ID in callback."}), 200
-
-            if result_code == 0: # Payment successful
-                if booking_id:
-                    try:
-                        # Update booking status, mpesa_receipt, amount_paid, phone_number_paid
-                        conn.execute('UPDATE bookings SET payment_status = ?, mpesa_receipt = ?, amount_paid = ?, phone_number_paid = ? WHERE id = ?',
-                                    ('paid', mpesa_receipt_number, amount_paid, phone_number, booking_id))
-
-                        # Also update tour's current_participants
-                        booking_data = conn.execute('SELECT tour_id, num_participants FROM bookings WHERE id = ?', (booking_id,)).fetchone()
-                        if booking_data:
-                            conn.execute('UPDATE tours SET current_participants = current_participants + ? WHERE id = ?',
-                                        (booking_data['num_participants'], booking_data['tour_id']))
-                        
-                        conn.commit()
-                        app.logger.info(f"Booking {booking_id} updated to 'paid' via M-Pesa webhook. Receipt: {mpesa_receipt_number}")
-
-                        # Optionally, send confirmation email here for paid bookings
-                        booking_full_data = conn.execute(
-                            'SELECT b.customer_email, b.customer_name, b.num_participants, t.name AS tour_name '
-                            'FROM bookings b JOIN tours t ON b.tour_id = t.id WHERE b.id = ?',
-                            (booking_id,)
-                        ).fetchone()
-                        if booking_full_data:
-                            send_confirmation_email(
-                                booking_full_data['customer_email'],
-                                booking_full_data['customer_name'],
-                                booking_full_data['tour_name'],
-                                booking_full_data['num_participants'],
-                                booking_id
-                            )
-
-                    except sqlite3.Error as e:
-                        app.logger.error(f"DB Error updating booking {booking_id} via M-Pesa webhook: {e}")
-                        conn.rollback()
-                        response_to_daraja = {"ResultCode": 1, "ResultDesc": f"DB Error: {e}"}
-                else:
-                    app.logger.warning(f"Successful M-Pesa callback but booking_id not found in metadata: {data}")
-                    response_to_daraja = {"ResultCode": 1, "ResultDesc": "Booking ID missing from callback metadata."}
-            else: # Payment failed or cancelled by user
-                if booking_id:
-                    try:
-                        # Update only payment_status for failed transactions
-                        conn.execute('UPDATE bookings SET payment_status = ? WHERE id = ?', ('failed', booking_id))
-                        conn.commit()
-                        app.logger.warning(f"Booking {booking_id} M-Pesa payment failed. ResultCode: {result_code}, Desc: {result_desc}")
-                    except sqlite3.Error as e:
-                        app.logger.error(f"DB Error updating failed M-Pesa booking {booking_id}: {e}")
-                        conn.rollback()
-                        response_to_daraja = {"ResultCode": 1, "ResultDesc": f"DB Error on failed payment: {e}"}
-                else:
-                    app.logger.warning(f"Failed M-Pesa callback but booking_id not found: {data}")
-                    response_to_daraja = {"ResultCode": 1, "ResultDesc": "Booking ID missing from failed callback."}
-
-            return jsonify(response_to_daraja), 200
-
-        except Exception as e:
-            app.logger.error(f"Error processing M-Pesa callback: {e}", exc_info=True)
-            response_to_daraja = {"ResultCode": 1, "ResultDesc": f"Internal Server Error: {e}"}
-            return jsonify(response_to_daraja), 500
+        app.logger.info(f"M-Pesa Callback Received and queued as event {event_id}.")
+        return jsonify({"ResultCode": 0, "ResultDesc": "C2B Recieved."}), 200
 
     # --- MODIFIED: Renamed from booking_success to booking_confirmed ---
     @app.route('/booking-confirmed/<int:booking_id>')
     @login_required
     def booking_confirmed(booking_id):
-        db = get_db()
-        booking = db.execute(
-            'SELECT b.id, b.num_participants, b.payment_status, b.booking_date, '
-            'b.customer_name, b.customer_email, '
-            'b.mpesa_receipt, b.amount_paid, b.phone_number_paid, ' # Include M-Pesa specific fields
-            't.name AS tour_name, t.description, t.price, t.date AS tour_date '
-            'FROM bookings b JOIN tours t ON b.tour_id = t.id '
-            'WHERE b.id = ? AND b.user_id = ?',
-            (booking_id, session['user_id'])
-        ).fetchone()
+        booking = repository.user_booking(get_db(), booking_id, session['user_id'])
 
         if not booking:
             flash('Booking not found or you do not have permission.', 'danger')
@@ -550,40 +602,107 @@ def create_app():
     @app.route('/my_bookings')
     @login_required
     def my_bookings():
-        db = get_db()
-        user_bookings = db.execute(
-            'SELECT b.id, b.num_participants, b.booking_date, b.payment_status, '
-            't.name AS tour_name, t.price AS tour_price, t.date AS tour_date '
-            'FROM bookings b JOIN tours t ON b.tour_id = t.id '
-            'WHERE b.user_id = ? ORDER BY b.booking_date DESC',
-            (g.user['id'],)
-        ).fetchall()
+        payment_status = request.args.get('payment_status')
+        user_bookings = repository.user_bookings_page(
+            get_db(), g.user['id'], payment_status if payment_status in PAYMENT_STATUSES else None
+        )
         return render_template('my_bookings.html', bookings=user_bookings)
 
     # --- Content Pages ---
     @app.route('/coming_soon')
     def coming_soon():
-        db = get_db()
-        upcoming_tours = db.execute(
-            "SELECT * FROM tours WHERE status = 'coming_soon' ORDER BY date ASC"
-        ).fetchall()
-        return render_template('coming_soon.html', tours=upcoming_tours)
+        version, updated_at = catalog_state(get_db())
+
+        def render():
+            fragment = cached_fragment('coming_soon', 'catalog/coming_soon.html', lambda version: {
+                'tours': cached_query(
+                    'upcoming_tours', "SELECT * FROM tours WHERE status = 'coming_soon' ORDER BY date ASC", version=version
+                )
+            }, version=version)
+            return render_template('coming_soon.html', fragment=fragment)
+
+        return conditional(render, version, last_modified=updated_at)
 
     @app.route('/done_tours')
     def done_tours():
-        db = get_db()
-        past_tours = db.execute(
-            "SELECT * FROM tours WHERE status = 'done' ORDER BY date DESC"
-        ).fetchall()
-        return render_template('done_tours.html', tours=past_tours)
+        version, updated_at = catalog_state(get_db())
+
+        def render():
+            fragment = cached_fragment('done_tours', 'catalog/done_tours.html', lambda version: {
+                'tours': cached_query(
+                    'past_tours', "SELECT * FROM tours WHERE status = 'done' ORDER BY date DESC", version=version
+                )
+            }, version=version)
+            return render_template('done_tours.html', fragment=fragment)
+
+        return conditional(render, version, last_modified=updated_at)
 
     @app.route('/memories')
     def memories():
+        tour_id = request.args.get('tour_id', type=int) or None
+        # Pages and the tour filter are cached separately, keyed only on what the fragment reads
+        args = page_args(len(repository.MEMORY_ORDER), tour_id=tour_id)
+
+        def build_context(version):
+            db = get_db()
+            all_memories = repository.memories_page(db, tour_id)
+            variants = images.variants_for(db, [m['id'] for m in all_memories])
+            return {'memories': all_memories, 'variants': variants, 'pager_args': args}
+
+        version, updated_at = catalog_state(get_db())
+
+        def render():
+            fragment = cached_fragment('memories', 'catalog/memories.html', build_context, vary_on=args, version=version)
+            return render_template('memories.html', fragment=fragment)
+
+        return conditional(render, version, last_modified=updated_at)
+
+    # --- Search ---
+    def run_search():
+        # ?q= plus ?kind=tours|memories (default both), ?page= and the filters in search.search_filters
+        text = request.args.get('q', '').strip()
+        kind = request.args.get('kind')
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = page_size()
+        results = {}
+        for name in ((kind,) if kind in search.SEARCH_KINDS else search.SEARCH_KINDS):
+            rows, has_more, filters = search.search(get_db(), name, text, request.args, page, per_page)
+            results[name] = {'results': rows, 'has_more': has_more, 'filters': filters}
+        return text, kind, page, results
+
+    @app.route('/search')
+    def search_page():
+        # Results only change with the catalog, so a repeated search is a 304
+        version, updated_at = catalog_state(get_db())
+
+        def render():
+            text, kind, page, results = run_search()
+            return render_template(
+                'search.html', q=text, kind=kind, page=page, results=results, statuses=search.TOUR_STATUSES
+            )
+
+        return conditional(render, version, last_modified=updated_at)
+
+    @app.route('/api/search')
+    def search_api():
+        version, updated_at = catalog_state(get_db())
+
+        def render():
+            text, kind, page, results = run_search()
+            return jsonify({'query': text, 'page': page, **results})
+
+        return conditional(render, version, last_modified=updated_at)
+
+    @app.route('/api/availability')
+    def availability_api():
+        # Remaining seats per date for calendar widgets, read from the trigger-maintained tour_availability table
+        try:
+            start, end = availability.date_range(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         db = get_db()
-        all_memories = db.execute(
-            "SELECT m.*, t.name AS tour_name FROM memories m LEFT JOIN tours t ON m.tour_id = t.id ORDER BY memory_date DESC"
-        ).fetchall()
-        return render_template('memories.html', memories=all_memories)
+        # Polling with If-None-Match gets a 304 until a tour in the range changes
+        return conditional(lambda: jsonify(availability.calendar(db, start, end)), *availability.range_state(db, start, end))
 
     @app.route('/about_us')
     def about_us():
@@ -610,11 +729,16 @@ def create_app():
                 error = 'A message body is required.'
 
             if error is None:
-                email_sent = send_contact_email(name, email, subject, message_body)
-                if email_sent:
+                db = get_db()
+                try:
+                    # Delivered by the outbox sender, so the request never waits on SMTP
+                    queue_contact_email(db, name, email, subject, message_body)
+                    db.commit()
                     flash('Your message has been sent successfully! We will get back to you soon.', 'success')
                     return redirect(url_for('contact'))
-                else:
+                except DatabaseError as e:
+                    db.rollback()
+                    app.logger.error(f"Error queueing contact email from {email}: {e}")
                     flash('Failed to send your message. Please try again later or contact us directly.', 'error')
             else:
                 flash(error, 'warning')
@@ -625,20 +749,45 @@ def create_app():
     @app.route('/admin')
     @admin_required
     def admin_dashboard():
-        db = get_db()
-        total_tours = db.execute("SELECT COUNT(id) FROM tours").fetchone()[0]
-        total_users = db.execute("SELECT COUNT(id) FROM users").fetchone()[0]
-        total_bookings = db.execute("SELECT COUNT(id) FROM bookings").fetchone()[0]
-        paid_bookings = db.execute("SELECT COUNT(id) FROM bookings WHERE payment_status = 'paid'").fetchone()[0]
-        pending_bookings = db.execute("SELECT COUNT(id) FROM bookings WHERE payment_status = 'pending'").fetchone()[0]
+        counts = repository.dashboard_counts(get_db())
+        return render_template('admin/admin_dashboard.html', **dict(counts))
 
+    @app.route('/admin/stats')
+    @admin_required
+    def admin_stats():
+        return jsonify({
+            'db_pool': pool_stats(),
+            'callback_queue': queue_stats(),
+            'mpesa_token': mpesa.token_stats(),
+            'email_outbox': outbox_stats(),
+            'identity_cache': identity_stats(),
+            'catalog_cache': catalog_stats(),
+            'password_hashing': hashing_stats(),
+            'booking_sweeper': sweeper.sweeper_stats(),
+            'payment_streams': payment_events.stream_stats(),
+        })
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        def render():
+            return Response(metrics.render_metrics(), content_type=metrics.CONTENT_TYPE)
+        # Scrapers cannot log in, so they present METRICS_TOKEN instead
+        if metrics.token_matches():
+            return render()
+        return admin_required(render)()
+
+    @app.route('/admin/slow-queries', methods=('GET', 'POST'))
+    @admin_required
+    def slow_query_log():
+        if request.method == 'POST':
+            slow_queries.clear()
+            flash('Slow query log cleared.', 'success')
+            return redirect(url_for('slow_query_log'))
         return render_template(
-            'admin/admin_dashboard.html',
-            total_tours=total_tours,
-            total_users=total_users,
-            total_bookings=total_bookings,
-            paid_bookings=paid_bookings,
-            pending_bookings=pending_bookings
+            'admin/slow_queries.html',
+            summary=slow_queries.summary(),
+            entries=slow_queries.entries(),
+            threshold_ms=app.config['SLOW_QUERY_THRESHOLD_MS']
         )
 
     @app.route('/admin/tours', methods=('GET', 'POST'))
@@ -666,58 +815,71 @@ def create_app():
                 if error is None:
                     try:
                         if action == 'add':
-                            db.execute(
-                                'INSERT INTO tours (name, description, price, date, max_participants, status, current_participants) VALUES (?, ?, ?, ?, ?, ?, 0)',
-                                (name, description, price, date, max_participants, status)
-                            )
+                            repository.create_tour(db, name, description, price, date, max_participants, status)
                             flash('Tour added successfully!', 'success')
                         elif action == 'edit' and tour_id:
-                            current_tour_data = db.execute('SELECT current_participants FROM tours WHERE id = ?', (tour_id,)).fetchone()
-                            if current_tour_data and current_tour_data['current_participants'] > max_participants:
-                                error = f'Max participants ({max_participants}) cannot be less than current participants ({current_tour_data["current_participants"]}).'
+                            booked = repository.booked_seats(db, tour_id)
+                            if booked is not None and booked > max_participants:
+                                error = f'Max participants ({max_participants}) cannot be less than booked and held participants ({booked}).'
                             else:
-                                db.execute(
-                                    'UPDATE tours SET name = ?, description = ?, price = ?, date = ?, max_participants = ?, status = ? WHERE id = ?',
-                                    (name, description, price, date, max_participants, status, tour_id)
-                                )
+                                repository.update_tour(db, tour_id, name, description, price, date, max_participants, status)
                                 flash('Tour updated successfully!', 'success')
                         db.commit()
                         if error is None:
                             return redirect(url_for('manage_tours'))
-                    except sqlite3.Error as e:
+                    except DatabaseError as e:
                         db.rollback()
                         error = f"Database error: {e}"
                 flash(error, 'error')
 
             elif action == 'delete' and tour_id:
                 try:
-                    db.execute('DELETE FROM tours WHERE id = ?', (tour_id,))
+                    repository.delete_tour(db, tour_id)
                     db.commit()
                     flash('Tour deleted successfully!', 'success')
                     return redirect(url_for('manage_tours'))
-                except sqlite3.Error as e:
+                except DatabaseError as e:
                     db.rollback()
                     flash(f'Error deleting tour: {e}', 'error')
 
-        tours_list = db.execute("SELECT * FROM tours ORDER BY date DESC").fetchall()
+        tours_list = repository.all_tours(db)
         return render_template('admin/manage_tours.html', tours=tours_list)
 
+    @app.route('/admin/tours/import', methods=('POST',))
+    @admin_required
+    def import_tours():
+        tours_file = request.files.get('tours_file')
+        fmt = imports.detect_format(tours_file.filename) if tours_file else None
+        if fmt is None:
+            flash('Please upload a .csv, .json or .ndjson file.', 'error')
+            return redirect(url_for('manage_tours'))
+
+        db = get_db()
+        dry_run = bool(request.form.get('dry_run'))
+        try:
+            result = imports.import_tours(db, tours_file.stream, fmt, dry_run=dry_run)
+        except DatabaseError as e:
+            flash(f'Database error during import: {e}', 'error')
+            return redirect(url_for('manage_tours'))
+        flash(('Checked only: ' if dry_run else '') + result.summary(),
+              'warning' if result.error_count else 'success')
+        tours_list = repository.all_tours(db)
+        return render_template('admin/manage_tours.html', tours=tours_list, import_result=result)
+
     @app.route('/admin/users')
     @admin_required
     def manage_users():
-        db = get_db()
-        users_list = db.execute("SELECT id, username, email, is_admin FROM users").fetchall()
+        users_list = repository.users_page(get_db())
         return render_template('admin/manage_users.html', users=users_list)
 
     @app.route('/admin/users/toggle_admin/<int:user_id>')
     @admin_required
     def toggle_admin_status(user_id):
         db = get_db()
-        user = db.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
-        if user:
-            new_status = 1 if user['is_admin'] == 0 else 0
-            db.execute('UPDATE users SET is_admin = ? WHERE id = ?', (new_status, user_id))
+        new_status = repository.toggle_admin(db, user_id)
+        if new_status is not None:
             db.commit()
+            invalidate_user(user_id)
             flash(f'User ID {user_id} admin status toggled to {new_status}.', 'success')
         else:
             flash(f'User ID {user_id} not found.', 'error')
@@ -731,10 +893,11 @@ def create_app():
             return redirect(url_for('manage_users'))
         db = get_db()
         try:
-            db.execute('DELETE FROM users WHERE id = ?', (user_id,))
+            repository.delete_user(db, user_id)
             db.commit()
+            invalidate_user(user_id)
             flash(f'User ID {user_id} deleted.', 'success')
-        except sqlite3.Error as e:
+        except DatabaseError as e:
             db.rollback()
             flash(f'Error deleting user: {e}', 'error')
         return redirect(url_for('manage_users'))
@@ -743,28 +906,41 @@ def create_app():
     @admin_required
     def view_bookings():
         db = get_db()
-        bookings_list = db.execute(
-            """
-            SELECT
-                b.id AS booking_id,
-                b.customer_name,
-                b.customer_email,
-                b.num_participants,
-                b.booking_date,
-                b.payment_status,
-                b.mpesa_receipt,       -- NEW: M-Pesa transaction ID
-                b.amount_paid,         -- NEW: Actual amount paid via M-Pesa
-                b.phone_number_paid,   -- NEW: Phone number that made the payment
-                t.name AS tour_name,
-                t.date AS tour_date,
-                u.username AS booked_by_username
-            FROM bookings b
-            JOIN tours t ON b.tour_id = t.id
-            LEFT JOIN users u ON b.user_id = u.id
-            ORDER BY b.booking_date DESC
-            """
-        ).fetchall()
-        return render_template('admin/view_bookings.html', bookings=bookings_list)
+        where, params, filters = booking_filters(request.args)
+        bookings_list = repository.bookings_page(db, where, params)
+        tours_list = repository.tour_choices(db)
+        return render_template(
+            'admin/view_bookings.html',
+            bookings=bookings_list,
+            filters=filters,
+            tours=tours_list,
+            payment_statuses=PAYMENT_STATUSES
+        )
+
+    @app.route('/admin/bookings/export')
+    @admin_required
+    def export_bookings():
+        fmt = request.args.get('format', 'csv')
+        if fmt not in exports.EXPORT_FORMATS:
+            flash(f'Unknown export format: {fmt}.', 'error')
+            return redirect(url_for('view_bookings'))
+        where, params, _ = booking_filters(request.args)
+
+        # Rows are streamed from the cursor while the response is being sent
+        chunks = exports.iter_export(get_db(), fmt, where, params)
+        headers = {
+            'Content-Disposition': f'attachment; filename=bookings-{datetime.now():%Y%m%d-%H%M%S}.{fmt}',
+            'Cache-Control': 'no-store',
+            'Vary': 'Accept-Encoding',
+        }
+        if 'gzip' in request.accept_encodings:
+            chunks = exports.gzip_stream(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        return Response(
+            stream_with_context(chunks),
+            mimetype=exports.EXPORT_FORMATS[fmt],
+            headers=headers
+        )
 
     @app.route('/admin/memories', methods=('GET', 'POST'))
     @admin_required
@@ -785,12 +961,14 @@ def create_app():
                 error = 'Title and Memory Date are required.'
 
             image_filename = request.form.get('existing_image_filename')
+            new_image_uploaded = False
             if image_file and image_file.filename:
                 new_image_filename = secure_filename(image_file.filename)
                 image_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{new_image_filename}"
                 image_path = os.path.join(app.root_path, 'static', 'images', image_filename)
                 try:
                     image_file.save(image_path)
+                    new_image_uploaded = True
                     if action == 'edit' and request.form.get('existing_image_filename') and request.form.get('existing_image_filename') != image_filename:
                         old_image_path = os.path.join(app.root_path, 'static', 'images', request.form.get('existing_image_filename'))
                         if os.path.exists(old_image_path):
@@ -804,27 +982,31 @@ def create_app():
             if error is None:
                 try:
                     if action == 'add':
-                        db.execute(
-                            'INSERT INTO memories (title, description, image_filename, tour_id, memory_date) VALUES (?, ?, ?, ?, ?)',
-                            (title, description, image_filename, tour_id if tour_id else None, memory_date)
+                        memory_id = repository.create_memory(
+                            db, title, description, image_filename, tour_id if tour_id else None, memory_date
                         )
                         flash('Memory added successfully!', 'success')
                     elif action == 'edit' and memory_id:
-                        db.execute(
-                            'UPDATE memories SET title = ?, description = ?, image_filename = ?, tour_id = ?, memory_date = ? WHERE id = ?',
-                            (title, description, image_filename, tour_id if tour_id else None, memory_date, memory_id)
+                        if new_image_uploaded:
+                            # Serve the new original until its derivatives are ready
+                            images.delete_variants(db, memory_id)
+                        repository.update_memory(
+                            db, memory_id, title, description, image_filename, tour_id if tour_id else None, memory_date
                         )
                         flash('Memory updated successfully!', 'success')
                     db.commit()
+                    if new_image_uploaded and memory_id:
+                        # Thumbnails and WebP/AVIF variants are rendered in the image process pool
+                        images.schedule_variants(memory_id, image_filename)
                     if error is None:
                         return redirect(url_for('manage_memories'))
-                except sqlite3.Error as e:
+                except DatabaseError as e:
                     db.rollback()
                     error = f"Database error: {e}"
             flash(error, 'error')
 
-        memories_list = db.execute("SELECT m.*, t.name AS tour_name FROM memories m LEFT JOIN tours t ON m.tour_id = t.id ORDER BY memory_date DESC").fetchall()
-        tours_list = db.execute("SELECT id, name FROM tours ORDER BY name ASC").fetchall()
+        memories_list = repository.memories_page(db)
+        tours_list = repository.tour_choices(db)
         return render_template('admin/edit_memory.html', memories=memories_list, tours=tours_list)
 
     @app.route('/admin/memories/delete/<int:memory_id>')
@@ -832,26 +1014,23 @@ def create_app():
     def delete_memory(memory_id):
         db = get_db()
         try:
-            memory = db.execute('SELECT image_filename FROM memories WHERE id = ?', (memory_id,)).fetchone()
-            if memory and memory['image_filename']:
-                image_path = os.path.join(app.root_path, 'static', 'images', memory['image_filename'])
+            image_filename = repository.memory_image(db, memory_id)
+            if image_filename:
+                image_path = os.path.join(app.root_path, 'static', 'images', image_filename)
                 if os.path.exists(image_path):
                     os.remove(image_path)
-                    flash(f'Associated image {memory["image_filename"]} deleted.', 'info')
+                    flash(f'Associated image {image_filename} deleted.', 'info')
 
-            db.execute('DELETE FROM memories WHERE id = ?', (memory_id,))
+            images.delete_variants(db, memory_id)
+            repository.delete_memory(db, memory_id)
             db.commit()
             flash('Memory deleted successfully!', 'success')
-        except sqlite3.Error as e:
+        except DatabaseError as e:
             db.rollback()
             flash(f'Error deleting memory: {e}', 'error')
         return redirect(url_for('manage_memories'))
 
     return app
 
-from tour_booking_system_v2 import create_app  # or tour_booking_system_v2.factory
-
-app = create_app()
-
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True) # python -m tour_booking_system_v2.app
@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+
+import click
+from flask import current_app
+
+from .database import get_db
+
+FIELDS = ('tour_id', 'seats_left', 'seats_total', 'status') # Order of the values in each /api/availability entry
+
+
+def date_range(args):
+    """Reads ?from=&to= (YYYY-MM-DD) into a (start, end) pair of ISO date strings.
+
+    ``from`` defaults to today and ``to`` to AVAILABILITY_DEFAULT_DAYS
+    later. Raises ValueError with a message for the client if a date is
+    malformed, the range is backwards or it spans more than
+    AVAILABILITY_MAX_DAYS.
+    """
+    try:
+        start = date.fromisoformat(args['from']) if args.get('from') else date.today()
+        end = (
+            date.fromisoformat(args['to']) if args.get('to')
+            else start + timedelta(days=current_app.config.get('AVAILABILITY_DEFAULT_DAYS', 30))
+        )
+    except ValueError:
+        raise ValueError('from and to must be dates in YYYY-MM-DD format.')
+    if end < start:
+        raise ValueError('to must not be before from.')
+    max_days = current_app.config.get('AVAILABILITY_MAX_DAYS', 366)
+    if (end - start).days >= max_days:
+        raise ValueError(f'The range may span at most {max_days} days.')
+    return start.isoformat(), end.isoformat()
+
+def range_state(db, start, end):
+    """Returns (row count, newest version) for the range; changes whenever any of its rows do.
+
+    A change stamps the row with a new, higher version and a removal
+    lowers the count, so the pair is an ETag that costs one read of the
+    range's keys and never needs the JSON to be built.
+    """
+    row = db.execute(
+        'SELECT COUNT(*) AS tours, MAX(version) AS version FROM tour_availability WHERE date BETWEEN ? AND ?',
+        (start, end)
+    ).fetchone()
+    return row['tours'], row['version']
+
+def calendar(db, start, end):
+    """Returns the remaining seats per date as a compact dict for jsonify.
+
+    ``days`` maps each date that has tours to a list of
+    [tour_id, seats_left, seats_total, status] entries (see FIELDS).
+    """
+    days = {}
+    for row in db.execute(
+        'SELECT date, tour_id, seats_left, seats_total, status FROM tour_availability '
+        'WHERE date BETWEEN ? AND ? ORDER BY date, tour_id',
+        (start, end)
+    ):
+        days.setdefault(row['date'], []).append([row['tour_id'], row['seats_left'], row['seats_total'], row['status']])
+    return {'from': start, 'to': end, 'fields': FIELDS, 'days': days}
+
+
+@click.command('rebuild-availability')
+def rebuild_availability_command():
+    """Recompute the availability table from the tours table."""
+    db = get_db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute('UPDATE availability_state SET version = version + 1 WHERE id = 1')
+        db.execute('DELETE FROM tour_availability')
+        db.execute(
+            'INSERT INTO tour_availability (date, tour_id, status, seats_total, seats_left, version) '
+            "SELECT /* full scan */ date, id, COALESCE(status, 'available'), max_participants, "
+            'CASE WHEN max_participants > COALESCE(current_participants, 0) + COALESCE(held_participants, 0) '
+            'THEN max_participants - COALESCE(current_participants, 0) - COALESCE(held_participants, 0) ELSE 0 END, '
+            '(SELECT version FROM availability_state WHERE id = 1) FROM tours'
+        )
+        db.commit()
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    click.echo('Rebuilt the tour availability table.')
+
+def init_app(app):
+    """Register the availability command with the Flask app."""
+    app.cli.add_command(rebuild_availability_command)
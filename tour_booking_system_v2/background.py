@@ -0,0 +1,51 @@
+import os
+import threading
+
+
+class BackgroundWorker:
+    """Runs ``task(app)`` on daemon threads inside this worker process.
+
+    ``task`` is called inside an app context and should return True while it
+    is still finding work. When it returns False the thread sleeps until
+    ``wake()`` is called or ``interval`` seconds pass. Threads are started
+    lazily and restarted after a fork, so this is safe with gunicorn's
+    preload_app.
+    """
+
+    def __init__(self, name, task, threads=1, interval=1.0):
+        self.name = name
+        self.task = task
+        self.threads = threads
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def ensure_started(self, app):
+        if self._pid == os.getpid() or self.threads <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._wake = threading.Event()
+            for i in range(self.threads):
+                thread = threading.Thread(
+                    target=self._run, args=(app,), name=f'{self.name}-{i}', daemon=True
+                )
+                thread.start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    did_work = self.task(app)
+            except Exception as e:
+                app.logger.error(f"Background worker {self.name} crashed: {e}", exc_info=True)
+                did_work = False
+            if not did_work:
+                self._wake.wait(self.interval)
+                self._wake.clear()
@@ -0,0 +1,349 @@
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from werkzeug.security import generate_password_hash
+
+from .database import add_connect_hook, get_db, init_db
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('tours', 'login', 'book', 'booking_details', 'my_bookings', 'admin_bookings', 'mpesa_callback')
+
+_request_state = threading.local()
+
+
+def _count_query(statement):
+    # sqlite3 calls this on the thread running the statement, which for the
+    # WSGI test client is the thread that sent the request
+    _request_state.queries = getattr(_request_state, 'queries', 0) + 1
+
+def _trace_queries(conn):
+    conn.set_trace_callback(_count_query)
+
+
+# --- Synthetic Data ---
+def seed_database(db, users, tours, bookings, rng):
+    """Fills a freshly initialised database. Returns ids the scenarios need."""
+    password = generate_password_hash(BENCHMARK_PASSWORD) # Hashed once; every user shares it
+    db.execute('DELETE FROM bookings')
+    db.execute('DELETE FROM seat_holds')
+    db.execute('DELETE FROM users')
+    db.executemany(
+        'INSERT INTO users (username, email, password, is_admin) VALUES (?, ?, ?, ?)',
+        [(f'bench{i}', f'bench{i}@example.com', password, 1 if i == 0 else 0) for i in range(users)]
+    )
+    usernames = dict(db.execute('SELECT id, username FROM users').fetchall())
+    user_ids = sorted(usernames)
+    db.executemany(
+        'INSERT INTO tours (name, description, price, date, max_participants, status) VALUES (?, ?, ?, ?, ?, ?)',
+        [(f'Bench Tour {i}', 'Synthetic tour for benchmarking.', rng.randint(1000, 20000),
+          f'2030-{1 + i % 12:02d}-{1 + i % 28:02d}', 10 ** 9, 'available') for i in range(tours)] # Never sells out
+    )
+    tour_ids = [row[0] for row in db.execute("SELECT /* full scan */ id FROM tours WHERE name LIKE 'Bench Tour %' ORDER BY id")]
+
+    def booking(i):
+        user_id = rng.choice(user_ids)
+        status = rng.choice(('pending', 'paid', 'failed'))
+        paid = status == 'paid'
+        return (rng.choice(tour_ids), user_id, usernames[user_id], f'{usernames[user_id]}@example.com', rng.randint(1, 4),
+                f'2029-{1 + i % 12:02d}-{1 + i % 28:02d} {i % 24:02d}:00:00', status,
+                rng.randint(1000, 80000) if paid else None, f'BENCH{i:07d}' if paid else None,
+                '254700000000' if paid else None)
+
+    db.executemany(
+        'INSERT INTO bookings (tour_id, user_id, customer_name, customer_email, num_participants, booking_date, payment_status, '
+        'amount_paid, mpesa_receipt, phone_number_paid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (booking(i) for i in range(bookings))
+    )
+    # Pending bookings get the STK push their callbacks (see _stk_callback) refer to
+    db.execute(
+        "INSERT INTO stk_pushes (checkout_request_id, booking_id, requested_at) "
+        "SELECT 'ws_CO_bench_' || id, id, ? FROM bookings WHERE payment_status = 'pending'",
+        (int(time.time()),)
+    )
+    db.commit()
+    return {
+        'admin': user_ids[0],
+        'users': user_ids,
+        'usernames': usernames,
+        'tours': tour_ids,
+        'bookings_by_user': {
+            user_id: [row[0] for row in db.execute('SELECT id FROM bookings WHERE user_id = ? LIMIT 50', (user_id,))]
+            for user_id in user_ids
+        },
+        'pending': [row[0] for row in db.execute("SELECT id FROM bookings WHERE payment_status = 'pending'")],
+    }
+
+
+def _stk_callback(booking_id, rng):
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': f'bench-{booking_id}',
+        'CheckoutRequestID': f'ws_CO_bench_{booking_id}',
+        'ResultCode': 0,
+        'ResultDesc': 'The service request is processed successfully.',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': 1},
+            {'Name': 'MpesaReceiptNumber', 'Value': f'BENCH{booking_id}{rng.randint(0, 999)}'},
+            {'Name': 'PhoneNumber', 'Value': 254700000000},
+        ]},
+    }}}
+
+
+# --- Load Generation ---
+class Worker:
+    """One simulated client: its own cookie jar, user and random stream."""
+
+    def __init__(self, app, ids, index, seed):
+        self.app = app
+        self.ids = ids
+        self.rng = random.Random(seed * 1000 + index)
+        users = ids['users'][1:] or ids['users']
+        self.user_id = users[index % len(users)]
+        self.client = app.test_client()
+        self.admin_client = app.test_client()
+        self._login(self.client, self.user_id)
+        self._login(self.admin_client, ids['admin'])
+
+    def _login(self, client, user_id):
+        response = client.post('/login', data={'username': self.ids['usernames'][user_id], 'password': BENCHMARK_PASSWORD})
+        if response.status_code != 302:
+            raise click.ClickException(f"Benchmark user {self.ids['usernames'][user_id]} could not log in.")
+
+    def request(self, scenario):
+        """Sends one request for ``scenario``. Returns (seconds, queries, ok)."""
+        rng = self.rng
+        if scenario == 'tours':
+            send = lambda: self.client.get('/tours')
+            expected = (200,)
+        elif scenario == 'login':
+            client = self.app.test_client() # A fresh visitor each time
+            username = self.ids['usernames'][self.user_id]
+            send = lambda: client.post('/login', data={'username': username, 'password': BENCHMARK_PASSWORD})
+            expected = (302,)
+        elif scenario == 'book':
+            tour_id = rng.choice(self.ids['tours'])
+            send = lambda: self.client.post(f'/book/{tour_id}', data={'num_participants': '1'})
+            expected = (302,)
+        elif scenario == 'booking_details':
+            booking_id = rng.choice(self.ids['bookings_by_user'][self.user_id] or [0])
+            send = lambda: self.client.get(f'/booking_details/{booking_id}')
+            expected = (200,)
+        elif scenario == 'my_bookings':
+            send = lambda: self.client.get('/my_bookings')
+            expected = (200,)
+        elif scenario == 'admin_bookings':
+            send = lambda: self.admin_client.get('/admin/bookings')
+            expected = (200,)
+        else:
+            payload = _stk_callback(rng.choice(self.ids['pending'] or [0]), rng)
+            send = lambda: self.client.post('/mpesa-callback', json=payload)
+            expected = (200,)
+
+        _request_state.queries = 0
+        started = time.perf_counter()
+        try:
+            response = send()
+            ok = response.status_code in expected
+            response.close()
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, _request_state.queries, ok
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100)) # ceil(n * pct / 100)
+    return sorted_values[int(rank) - 1]
+
+def run_scenario(workers, scenario, requests_per_scenario, warmup):
+    """Drives one scenario with every worker in parallel and summarises it."""
+    per_worker = max(1, requests_per_scenario // len(workers))
+
+    def drive(worker):
+        for _ in range(warmup):
+            worker.request(scenario)
+        return [worker.request(scenario) for _ in range(per_worker)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+        samples = [sample for result in pool.map(drive, workers) for sample in result]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds for seconds, _, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, _, ok in samples if not ok),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries_per_request': round(sum(queries for _, queries, _ in samples) / len(samples), 2),
+    }
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Returns a list of regression messages (empty when the run is acceptable)."""
+    regressions = []
+    for scenario, current in results.items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if previous is None:
+            continue
+        limit = previous['p95_ms'] * (1 + tolerance)
+        if current['p95_ms'] > limit:
+            regressions.append(f"{scenario}: p95 {current['p95_ms']}ms > {limit:.2f}ms (baseline {previous['p95_ms']}ms)")
+        if current['queries_per_request'] > previous['queries_per_request'] + 0.5:
+            regressions.append(f"{scenario}: {current['queries_per_request']} queries/request, baseline {previous['queries_per_request']}")
+        if current['errors'] > previous.get('errors', 0):
+            regressions.append(f"{scenario}: {current['errors']} errors, baseline {previous.get('errors', 0)}")
+    return regressions
+
+
+@click.command('benchmark')
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(SCENARIOS), help='Repeatable; default is all.')
+@click.option('--requests', 'requests_per_scenario', default=500, show_default=True, help='Measured requests per scenario.')
+@click.option('--concurrency', default=8, show_default=True, help='Simulated clients sending requests in parallel.')
+@click.option('--warmup', default=5, show_default=True, help='Unmeasured requests per client before each scenario.')
+@click.option('--users', default=200, show_default=True)
+@click.option('--tours', default=100, show_default=True)
+@click.option('--bookings', default=20000, show_default=True)
+@click.option('--seed', default=1, show_default=True, help='Seeds the synthetic data and request mix.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), help='Write the results as JSON (use as a baseline).')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Fail if this run regresses against a saved result.')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed p95 slowdown against the baseline (0.25 = 25%).')
+def benchmark_command(scenarios, requests_per_scenario, concurrency, warmup, users, tours, bookings,
+                      seed, output, baseline, tolerance):
+    """Benchmark the booking hot paths against a seeded throwaway database."""
+    from .app import create_app
+
+    workdir = tempfile.mkdtemp(prefix='tour-bench-')
+    try:
+        app = create_app({
+            'DATABASE': os.path.join(workdir, 'bench.db'),
+            'DATABASE_URL': '', # Always the throwaway SQLite file, never a configured server
+            'CALLBACK_WORKERS': 0, # Measure the webhook's ack path only
+            'OUTBOX_WORKERS': 0,
+            'MAIL_SUPPRESS_SEND': True,
+            'MPESA_TOKEN_CACHE_FILE': '',
+            'CATALOG_CACHE_PATH': os.path.join(workdir, 'catalog_cache.db'),
+        })
+        add_connect_hook(app, _trace_queries)
+        with app.app_context():
+            init_db()
+            ids = seed_database(get_db(), users, tours, bookings, random.Random(seed))
+        click.echo(f'Seeded {users} users, {tours} tours and {bookings} bookings; {concurrency} clients.', err=True)
+
+        workers = [Worker(app, ids, index, seed) for index in range(concurrency)]
+        results = {}
+        for scenario in scenarios or SCENARIOS:
+            results[scenario] = summary = run_scenario(workers, scenario, requests_per_scenario, warmup)
+            click.echo(
+                f"{scenario:<16} {summary['throughput_rps']:>8} req/s  p50 {summary['p50_ms']:>7}ms  "
+                f"p95 {summary['p95_ms']:>7}ms  p99 {summary['p99_ms']:>7}ms  "
+                f"{summary['queries_per_request']:>5} q/req  {summary['errors']} errors",
+                err=True
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'settings': {'requests': requests_per_scenario, 'concurrency': concurrency, 'warmup': warmup,
+                     'users': users, 'tours': tours, 'bookings': bookings, 'seed': seed},
+        'scenarios': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f'Wrote results to {output}.', err=True)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), tolerance)
+        for message in regressions:
+            click.echo(f'REGRESSION {message}', err=True)
+        if regressions:
+            raise click.exceptions.Exit(1)
+        click.echo('No regressions against the baseline.', err=True)
+
+# --- Worker Start-up ---
+# Runs in a fresh interpreter per sample, as a new gunicorn worker without preload_app would
+STARTUP_PROBE = """
+import sys, time
+started = time.perf_counter()
+from tour_booking_system_v2 import create_app
+imported = time.perf_counter()
+app = create_app({
+    'DATABASE': sys.argv[1], 'JINJA_BYTECODE_CACHE_DIR': sys.argv[2],
+    'CALLBACK_WORKERS': 0, 'OUTBOX_WORKERS': 0,
+})
+created = time.perf_counter()
+app.test_client().get('/')
+print(imported - started, created - imported, time.perf_counter() - created)
+"""
+
+def run_startup_probe(workdir, import_times=False):
+    """Times one cold start. Returns (seconds to import, to create_app, to serve '/') and importtime output."""
+    import subprocess # Only this command needs it; keeps it out of worker boot
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PACKAGE_PARENT, os.environ.get('PYTHONPATH')])))
+    command = [sys.executable] + (['-X', 'importtime'] if import_times else []) + [
+        '-c', STARTUP_PROBE, os.path.join(workdir, 'startup.db'), os.path.join(workdir, 'jinja_cache')
+    ]
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise click.ClickException(f'Start-up probe failed:\n{result.stderr[-2000:]}')
+    return tuple(float(value) for value in result.stdout.split()[-3:]), result.stderr
+
+def heaviest_imports(importtime_output, limit):
+    """Modules imported directly by this package, by cumulative import time (microseconds)."""
+    # -X importtime lists each module after its own imports, indented by nesting depth
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            rows.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative)))
+    heaviest = {}
+    for index, (depth, name, cumulative) in enumerate(rows):
+        parent = next((row[1] for row in rows[index + 1:] if row[0] < depth), '')
+        if parent.startswith(__package__) and not name.startswith(__package__):
+            heaviest[name] = max(cumulative, heaviest.get(name, 0))
+    return sorted(heaviest.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+@click.command('benchmark-startup')
+@click.option('--runs', default=5, show_default=True, help='Fresh interpreters started; the first has a cold template cache.')
+@click.option('--top', default=10, show_default=True, help='Heaviest imports to list; 0 = none.')
+def benchmark_startup_command(runs, top):
+    """Measure how long a new worker takes to import, build the app and serve its first page."""
+    import statistics
+    workdir = tempfile.mkdtemp(prefix='tour-startup-')
+    try:
+        samples = [run_startup_probe(workdir)[0] for _ in range(runs)]
+        importtime_output = run_startup_probe(workdir, import_times=True)[1] if top else ''
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    warm = samples[1:] or samples
+    for label, index in (('import', 0), ('create_app', 1), ('first request', 2)):
+        click.echo(f"{label:<14} median {statistics.median(s[index] for s in warm) * 1000:>8.1f}ms  "
+                   f"max {max(s[index] for s in warm) * 1000:>8.1f}ms")
+    click.echo(f"{'cold templates':<14} first request {samples[0][2] * 1000:.1f}ms (empty bytecode cache)")
+    if top:
+        click.echo(f'Heaviest imports made by {__package__}:')
+        for name, micros in heaviest_imports(importtime_output, top):
+            click.echo(f'  {micros / 1000:>8.1f}ms  {name}')
+
+def init_app(app):
+    """Register the benchmark commands with the Flask app."""
+    app.cli.add_command(benchmark_command)
+    app.cli.add_command(benchmark_startup_command)
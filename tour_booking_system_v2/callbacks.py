@@ -0,0 +1,306 @@
+import json
+import threading
+import time
+
+import click
+from flask import current_app
+
+from . import payment_events
+from .background import BackgroundWorker
+from .database import get_db
+from .emails import queue_confirmation_email
+from .inventory import convert_hold, release_hold
+from .receipts import schedule_receipt_for
+
+
+class InvalidCallback(Exception):
+    """A callback that can never be applied. It is marked failed without retrying."""
+
+class UnknownCheckout(Exception):
+    """No STK push with the callback's CheckoutRequestID is recorded (yet).
+
+    A fast callback can be queued before the push's response was stored,
+    so this is retried with backoff for CALLBACK_UNKNOWN_CHECKOUT_GRACE
+    seconds. After that the push is never coming (the ID is not ours, or
+    its booking was archived) and the callback is an InvalidCallback.
+    """
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    'processed': 0,
+    'failed': 0,
+    'retried': 0,
+    'lag_seconds_total': 0.0,
+    'last_lag_seconds': 0.0,
+}
+
+
+def _record(key, lag=None):
+    with _stats_lock:
+        _stats[key] += 1
+        if lag is not None:
+            _stats['lag_seconds_total'] += lag
+            _stats['last_lag_seconds'] = lag
+
+
+# --- Daraja STK Callback Handling ---
+def validate_mpesa_callback(data):
+    """Returns an error message if ``data`` is not a well-formed STK callback, else None."""
+    if not isinstance(data, dict):
+        return 'Callback body must be a JSON object.'
+    body = data.get('Body')
+    stk_callback = body.get('stkCallback') if isinstance(body, dict) else None
+    if not isinstance(stk_callback, dict):
+        return 'Body.stkCallback is missing.'
+    if not isinstance(stk_callback.get('ResultCode'), int):
+        return 'Body.stkCallback.ResultCode is missing.'
+    if not isinstance(stk_callback.get('CheckoutRequestID'), str) or not stk_callback['CheckoutRequestID']:
+        return 'Body.stkCallback.CheckoutRequestID is missing.'
+    metadata = stk_callback.get('CallbackMetadata', {})
+    if not isinstance(metadata, dict) or not isinstance(metadata.get('Item', []), list):
+        return 'Body.stkCallback.CallbackMetadata is malformed.'
+    return None
+
+def apply_mpesa_callback(db, data):
+    """Applies an STK callback to its booking and seats. Does not commit.
+
+    Returns the booking id when this callback moved the booking to 'paid'.
+    The confirmation email is queued in the same transaction. Daraja
+    identifies the payment only by the CheckoutRequestID its STK push
+    response returned, which initiate_mpesa_payment stored in stk_pushes.
+    """
+    stk_callback = data['Body']['stkCallback']
+    result_code = stk_callback.get('ResultCode')
+    result_desc = stk_callback.get('ResultDesc')
+    checkout_request_id = stk_callback.get('CheckoutRequestID')
+    # Failed payments come without CallbackMetadata at all
+    item_list = stk_callback.get('CallbackMetadata', {}).get('Item', [])
+
+    push = db.execute(
+        'SELECT booking_id FROM stk_pushes WHERE checkout_request_id = ?', (checkout_request_id,)
+    ).fetchone()
+    if push is None:
+        raise UnknownCheckout(f'No STK push recorded for CheckoutRequestID {checkout_request_id}.')
+    booking_id = push['booking_id']
+
+    mpesa_receipt_number = None
+    amount_paid = None
+    phone_number = None
+
+    # Parse the CallbackMetadata to get transaction details
+    for item in item_list:
+        if item.get('Name') == 'Amount':
+            amount_paid = item.get('Value')
+        elif item.get('Name') == 'MpesaReceiptNumber':
+            mpesa_receipt_number = item.get('Value')
+        elif item.get('Name') == 'PhoneNumber':
+            phone_number = item.get('Value')
+
+    if result_code == 0: # Payment successful
+        # Daraja retries callbacks, so only the first 'paid' transition moves seats.
+        newly_paid = db.execute(
+            'UPDATE bookings SET payment_status = ?, mpesa_receipt = ?, amount_paid = ?, phone_number_paid = ? '
+            "WHERE id = ? AND payment_status NOT IN ('paid', 'refund_due')",
+            ('paid', mpesa_receipt_number, amount_paid, phone_number, booking_id)
+        ).rowcount
+        if not newly_paid:
+            current_app.logger.info(f"Booking {booking_id} already paid or missing; duplicate callback ignored.")
+            return None
+
+        # Convert the booking's seat hold into sold seats on the tour
+        booking_data = db.execute('SELECT tour_id, num_participants FROM bookings WHERE id = ?', (booking_id,)).fetchone()
+        if not convert_hold(db, booking_id, booking_data['tour_id'], booking_data['num_participants']):
+            # The hold lapsed and the seats were sold to someone else: keep the
+            # receipt, but flag the money for a refund rather than oversell
+            db.execute("UPDATE bookings SET payment_status = 'refund_due' WHERE id = ?", (booking_id,))
+            current_app.logger.error(f"Booking {booking_id} paid (receipt {mpesa_receipt_number}) after its seats were sold; marked refund_due.")
+            return None
+        queue_booking_confirmation(db, booking_id)
+        current_app.logger.info(f"Booking {booking_id} updated to 'paid' via M-Pesa webhook. Receipt: {mpesa_receipt_number}")
+        return booking_id
+
+    # Payment failed or cancelled by user: update only payment_status and free the held seats
+    failed = db.execute(
+        "UPDATE bookings SET payment_status = ? WHERE id = ? AND payment_status NOT IN ('paid', 'refund_due')",
+        ('failed', booking_id)
+    ).rowcount
+    if failed:
+        release_hold(db, booking_id)
+    current_app.logger.warning(f"Booking {booking_id} M-Pesa payment failed. ResultCode: {result_code}, Desc: {result_desc}")
+    return None
+
+def queue_booking_confirmation(db, booking_id):
+    """Queues the paid-booking confirmation email in the caller's transaction."""
+    booking_full_data = db.execute(
+        'SELECT b.customer_email, b.customer_name, b.num_participants, t.name AS tour_name '
+        'FROM bookings b JOIN tours t ON b.tour_id = t.id WHERE b.id = ?',
+        (booking_id,)
+    ).fetchone()
+    if booking_full_data:
+        queue_confirmation_email(
+            db,
+            booking_full_data['customer_email'],
+            booking_full_data['customer_name'],
+            booking_full_data['tour_name'],
+            booking_full_data['num_participants'],
+            booking_id
+        )
+
+
+HANDLERS = {
+    'mpesa_stk': apply_mpesa_callback,
+}
+
+
+# --- Inbound Event Queue ---
+def enqueue_event(db, source, payload):
+    """Durably stores an inbound webhook payload and wakes a worker. Returns the event id."""
+    now = time.time()
+    cursor = db.execute(
+        'INSERT INTO inbound_events (source, payload, received_at, available_at) VALUES (?, ?, ?, ?)',
+        (source, json.dumps(payload), now, now)
+    )
+    db.commit()
+    callback_worker.ensure_started(current_app._get_current_object())
+    callback_worker.wake()
+    return cursor.lastrowid
+
+def _claim_next(db, now):
+    claim_timeout = current_app.config.get('CALLBACK_CLAIM_TIMEOUT', 300)
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Events left 'processing' by a worker that died are handed out again
+        db.execute(
+            "UPDATE inbound_events SET status = 'queued' WHERE status = 'processing' AND claimed_at < ?",
+            (now - claim_timeout,)
+        )
+        event = db.execute(
+            "SELECT id, source, payload, attempts, received_at FROM inbound_events "
+            "WHERE status = 'queued' AND available_at <= ? ORDER BY available_at LIMIT 1",
+            (now,)
+        ).fetchone()
+        # The status check makes the claim safe without SQLite's write lock:
+        # on MySQL two workers can read the same row, but only one update wins
+        if event is not None and not db.execute(
+            "UPDATE inbound_events SET status = 'processing', attempts = attempts + 1, claimed_at = ? WHERE id = ? AND status = 'queued'",
+            (now, event['id'])
+        ).rowcount:
+            event = None
+        db.commit()
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return event
+
+def process_next_event(app=None):
+    """Claims and applies one queued event. Returns False when the queue is empty."""
+    app = app or current_app
+    db = get_db()
+    event = _claim_next(db, time.time())
+    if event is None:
+        return False
+
+    apply = HANDLERS[event['source']]
+    try:
+        try:
+            paid_booking_id = apply(db, json.loads(event['payload']))
+        except UnknownCheckout as e:
+            if time.time() - event['received_at'] >= app.config.get('CALLBACK_UNKNOWN_CHECKOUT_GRACE', 15):
+                raise InvalidCallback(str(e)) from e
+            raise
+        db.execute(
+            "UPDATE inbound_events SET status = 'done', processed_at = ?, last_error = NULL WHERE id = ?",
+            (time.time(), event['id'])
+        )
+        db.commit()
+    except InvalidCallback as e:
+        db.rollback()
+        db.execute(
+            "UPDATE inbound_events SET status = 'failed', processed_at = ?, last_error = ? WHERE id = ?",
+            (time.time(), str(e), event['id'])
+        )
+        db.commit()
+        app.logger.warning(f"Inbound event {event['id']} rejected: {e}")
+        _record('failed')
+        return True
+    except Exception as e:
+        db.rollback()
+        attempts = event['attempts'] + 1
+        if attempts >= app.config.get('CALLBACK_MAX_ATTEMPTS', 5):
+            db.execute(
+                "UPDATE inbound_events SET status = 'failed', processed_at = ?, last_error = ? WHERE id = ?",
+                (time.time(), str(e), event['id'])
+            )
+            _record('failed')
+        else:
+            # Exponential backoff, capped at five minutes
+            db.execute(
+                "UPDATE inbound_events SET status = 'queued', available_at = ?, last_error = ? WHERE id = ?",
+                (time.time() + min(2 ** attempts, 300), str(e), event['id'])
+            )
+            _record('retried')
+        db.commit()
+        app.logger.error(f"Error processing inbound event {event['id']} (attempt {attempts}): {e}", exc_info=True)
+        return True
+
+    _record('processed', lag=time.time() - event['received_at'])
+    payment_events.check_now() # Browsers waiting on this booking's status hear about it now
+    if paid_booking_id is not None:
+        try:
+            schedule_receipt_for(paid_booking_id) # After commit, so the receipt shows the paid row
+        except Exception as e:
+            app.logger.error(f"Could not queue the receipt for booking {paid_booking_id}: {e}", exc_info=True)
+    return True
+
+def queue_stats():
+    """Returns queue depth, processing lag and this process's worker counters."""
+    db = get_db()
+    counts = dict(db.execute(
+        "SELECT status, COUNT(*) FROM inbound_events WHERE status IN ('queued', 'processing') GROUP BY status"
+    ).fetchall())
+    oldest = db.execute(
+        "SELECT MIN(received_at) FROM inbound_events WHERE status = 'queued'"
+    ).fetchone()[0]
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update(
+        depth=counts.get('queued', 0),
+        in_flight=counts.get('processing', 0),
+        oldest_queued_age_seconds=round(time.time() - oldest, 3) if oldest else 0.0,
+        avg_lag_seconds=round(stats['lag_seconds_total'] / stats['processed'], 3) if stats['processed'] else 0.0,
+    )
+    return stats
+
+
+callback_worker = BackgroundWorker('callback-worker', process_next_event)
+
+
+@click.command('process-callbacks')
+@click.option('--once', is_flag=True, help='Drain the queue and exit instead of polling.')
+def process_callbacks_command(once):
+    """Apply queued M-Pesa callbacks in the foreground."""
+    interval = current_app.config.get('CALLBACK_POLL_INTERVAL', 1.0)
+    processed = 0
+    while True:
+        with current_app.app_context():
+            did_work = process_next_event()
+        if did_work:
+            processed += 1
+        elif once:
+            break
+        else:
+            time.sleep(interval)
+    click.echo(f'Processed {processed} inbound events.')
+
+def init_app(app):
+    """Configure the in-process callback workers and register the worker command."""
+    callback_worker.threads = app.config.get('CALLBACK_WORKERS', 2)
+    callback_worker.interval = app.config.get('CALLBACK_POLL_INTERVAL', 1.0)
+
+    @app.before_request
+    def start_callback_worker():
+        callback_worker.ensure_started(app)
+
+    app.cli.add_command(process_callbacks_command)
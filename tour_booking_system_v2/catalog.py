@@ -0,0 +1,207 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from urllib.parse import urlencode
+
+from flask import current_app, render_template
+from markupsafe import Markup
+
+from .cache import MISSING, TTLCache
+from .database import get_db
+
+
+# --- Cache Backends ---
+class MemoryBackend:
+    """Per-process LRU; each gunicorn worker warms its own copy."""
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class SQLiteBackend:
+    """LRU shared by every worker on the host through a separate SQLite file.
+
+    Values are stored as JSON, so only plain rows (dicts) and rendered
+    strings can be cached. Kept apart from the main database so cache churn
+    never competes with booking writes for its lock.
+    """
+
+    def __init__(self, path, maxsize, ttl):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None) # Autocommit; every statement stands alone
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF') # Losing a cache entry on power loss is harmless
+            conn.execute('PRAGMA busy_timeout = 1000')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                '    key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _count(self, key, count=1):
+        with self._stats_lock:
+            self._stats[key] += count
+
+    def get(self, key):
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute('SELECT value, accessed_at FROM cache WHERE key = ? AND expires_at > ?', (key, now)).fetchone()
+            if row is not None and now - row[1] > 1:
+                # Recency is tracked to the second to keep hot keys from writing on every hit
+                conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Catalog cache read failed: {e}")
+            row = None
+        if row is None:
+            self._count('misses')
+            return MISSING
+        self._count('hits')
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now + self.ttl, now)
+            )
+            excess = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.maxsize
+            if excess > 0:
+                evicted = conn.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at <= ? DESC, accessed_at LIMIT ?)',
+                    (now, excess)
+                ).rowcount
+                self._count('evictions', evicted)
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Catalog cache write failed: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        try:
+            stats['size'] = self._conn().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        except sqlite3.Error:
+            stats['size'] = None
+        stats.update(maxsize=self.maxsize, ttl=self.ttl)
+        return stats
+
+
+class NullBackend:
+    """Caching disabled: every read is a miss."""
+
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value):
+        pass
+
+    def stats(self):
+        return {}
+
+
+BACKENDS = {'memory': MemoryBackend, 'sqlite': SQLiteBackend, 'none': NullBackend}
+
+_backend = None
+_backend_pid = None
+_backend_lock = threading.Lock()
+
+
+def get_backend(app=None):
+    """Returns this worker's catalog cache backend, chosen by CATALOG_CACHE_BACKEND."""
+    global _backend, _backend_pid
+    app = app or current_app
+    with _backend_lock:
+        if _backend is None or _backend_pid != os.getpid():
+            config = app.config
+            name = config.get('CATALOG_CACHE_BACKEND', 'memory')
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown CATALOG_CACHE_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}.")
+            size = config.get('CATALOG_CACHE_SIZE', 256)
+            ttl = config.get('CATALOG_CACHE_TTL', 3600)
+            if name == 'sqlite':
+                path = config.get('CATALOG_CACHE_PATH') or os.path.join(app.instance_path, 'catalog_cache.db')
+                _backend = SQLiteBackend(path, size, ttl)
+            elif name == 'memory':
+                _backend = MemoryBackend(size, ttl)
+            else:
+                _backend = NullBackend()
+            _backend_pid = os.getpid()
+        return _backend
+
+
+# --- Read-through Helpers ---
+def catalog_version(db):
+    """Returns the counter the catalog triggers bump on every visible change."""
+    return db.execute('SELECT version FROM catalog_state WHERE id = 1').fetchone()[0]
+
+def catalog_state(db):
+    """Returns (version, updated_at) where updated_at is the Unix time of the last change."""
+    row = db.execute('SELECT version, updated_at FROM catalog_state WHERE id = 1').fetchone()
+    return row['version'], row['updated_at']
+
+def cached_query(name, sql, params=(), version=None):
+    """Returns the rows of a catalog query as dicts, cached until the catalog changes."""
+    db = get_db()
+    if version is None:
+        version = catalog_version(db)
+    key = f'query:{name}:{version}'
+    backend = get_backend()
+    rows = backend.get(key)
+    if rows is MISSING:
+        rows = [dict(row) for row in db.execute(sql, params).fetchall()]
+        backend.set(key, rows)
+    return rows
+
+def cached_fragment(name, template, build_context, vary_on=None, version=None):
+    """Renders a page body fragment once per catalog version.
+
+    ``build_context(version)`` is only called on a miss. Fragments must not
+    depend on the user or session. ``vary_on`` is a dict of the (parsed)
+    request arguments a paginated or filtered fragment is built from, e.g.
+    pagination.page_args(); the raw query string is never part of the key,
+    so visitors cannot fill the cache with made-up URLs.
+    """
+    if version is None:
+        version = catalog_version(get_db())
+    key = f'fragment:{name}:{version}'
+    if vary_on:
+        key += '?' + urlencode(sorted(vary_on.items()))
+    backend = get_backend()
+    html = backend.get(key)
+    if html is MISSING:
+        html = render_template(template, **build_context(version))
+        backend.set(key, html)
+    return Markup(html)
+
+def catalog_stats():
+    stats = get_backend().stats()
+    stats['backend'] = current_app.config.get('CATALOG_CACHE_BACKEND', 'memory')
+    stats['version'] = catalog_version(get_db())
+    return stats
@@ -0,0 +1,222 @@
+import base64
+import heapq
+import itertools
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from flask import Flask, jsonify, request
+
+STK_REQUIRED_FIELDS = (
+    'BusinessShortCode', 'Password', 'Timestamp', 'TransactionType', 'Amount',
+    'PartyA', 'PartyB', 'PhoneNumber', 'CallBackURL', 'AccountReference',
+)
+
+
+class CallbackScheduler:
+    """Delivers callbacks at their due time from one timer thread and a small POST pool."""
+
+    def __init__(self, senders, retries):
+        self.retries = retries
+        self._heap = []
+        self._sequence = itertools.count() # Tie-breaker so payloads are never compared
+        self._condition = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=senders, thread_name_prefix='daraja-sim-callback')
+        self._stats_lock = threading.Lock()
+        self.stats = {'scheduled': 0, 'delivered': 0, 'rejected': 0, 'unreachable': 0}
+        threading.Thread(target=self._run, name='daraja-sim-scheduler', daemon=True).start()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def schedule(self, delay, url, payload):
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), url, payload))
+            self._condition.notify()
+        self._count('scheduled')
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, url, payload = heapq.heappop(self._heap)
+            self._pool.submit(self._deliver, url, payload)
+
+    def _deliver(self, url, payload):
+        import requests # Only the simulator needs it, not the app it is imported into
+        # Like Daraja, retry a callback the app did not acknowledge
+        for attempt in range(self.retries + 1):
+            try:
+                response = requests.post(url, json=payload, timeout=10)
+            except requests.exceptions.RequestException:
+                outcome = 'unreachable'
+            else:
+                outcome = 'delivered' if response.status_code == 200 else 'rejected'
+            if outcome == 'delivered' or attempt == self.retries:
+                break
+            time.sleep(min(2 ** attempt, 30))
+        self._count(outcome)
+
+
+def _callback_payload(stk, checkout_id, merchant_id, result):
+    """Builds the stkCallback body for one outcome ('success' or 'failure'), shaped like Daraja's.
+
+    Only the CheckoutRequestID ties it to the push: the AccountReference is
+    not echoed back, and a failure carries no CallbackMetadata at all.
+    """
+    callback = {
+        'MerchantRequestID': merchant_id,
+        'CheckoutRequestID': checkout_id,
+    }
+    if result == 'success':
+        callback.update(ResultCode=0, ResultDesc='The service request is processed successfully.')
+        items = [
+            {'Name': 'Amount', 'Value': stk['Amount']},
+            {'Name': 'MpesaReceiptNumber', 'Value': 'SIM' + uuid.uuid4().hex[:7].upper()},
+            {'Name': 'Balance'},
+            {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+            {'Name': 'PhoneNumber', 'Value': int(stk['PhoneNumber'])},
+        ]
+        callback['CallbackMetadata'] = {'Item': items}
+    else:
+        callback.update(ResultCode=1032, ResultDesc='Request cancelled by user')
+    return {'Body': {'stkCallback': callback}}
+
+
+def create_simulator(latency=1.0, jitter=0.5, success_ratio=0.9, failure_ratio=0.1,
+                     duplicate_ratio=0.0, callback_url=None, token_ttl=3599,
+                     senders=8, retries=3, seed=None):
+    """Returns a Flask app that stands in for Daraja's sandbox in offline load tests.
+
+    It serves the two endpoints the app calls (OAuth token generation and
+    STK push) and POSTs an stkCallback to the request's CallBackURL, like
+    Safaricom does. Each accepted STK push gets a callback after ``latency`` ± ``jitter``
+    seconds. Outcomes are drawn with ``success_ratio`` / ``failure_ratio``
+    (any remainder is left without a callback, like a customer who never
+    answers the prompt). ``duplicate_ratio`` of callbacks are delivered twice.
+    """
+    sim = Flask(__name__)
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    tokens = {}
+    tokens_lock = threading.Lock()
+    scheduler = CallbackScheduler(senders, retries)
+    stats_lock = threading.Lock()
+    stats = {'tokens_issued': 0, 'stk_requests': 0, 'stk_rejected': 0,
+             'success': 0, 'failure': 0, 'no_callback': 0, 'duplicates': 0}
+
+    def count(key):
+        with stats_lock:
+            stats[key] += 1
+
+    @sim.route('/oauth/v1/generate', methods=['GET'])
+    def generate_token():
+        if request.args.get('grant_type') != 'client_credentials' or request.authorization is None:
+            return jsonify({'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'}), 400
+        token = base64.b64encode(uuid.uuid4().bytes).decode().rstrip('=')
+        with tokens_lock:
+            now = time.time()
+            for expired in [t for t, expires in tokens.items() if expires <= now]:
+                del tokens[expired]
+            tokens[token] = now + token_ttl
+        count('tokens_issued')
+        return jsonify({'access_token': token, 'expires_in': str(token_ttl)})
+
+    @sim.route('/mpesa/stkpush/v1/processrequest', methods=['POST'])
+    def stk_push():
+        count('stk_requests')
+        header = request.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else None
+        with tokens_lock:
+            valid = token is not None and tokens.get(token, 0) > time.time()
+        if not valid:
+            count('stk_rejected')
+            return jsonify({'requestId': uuid.uuid4().hex, 'errorCode': '404.001.03',
+                            'errorMessage': 'Invalid Access Token'}), 401
+
+        stk = request.get_json(silent=True) or {}
+        missing = [field for field in STK_REQUIRED_FIELDS if not stk.get(field)]
+        if missing:
+            count('stk_rejected')
+            return jsonify({'requestId': uuid.uuid4().hex, 'errorCode': '400.002.02',
+                            'errorMessage': f"Bad Request - Invalid {missing[0]}"}), 400
+
+        checkout_id = f"ws_CO_{datetime.now():%d%m%Y%H%M%S}{uuid.uuid4().hex[:10]}"
+        with rng_lock:
+            merchant_id = f'{rng.randint(10000, 99999)}-{rng.randint(1000000, 9999999)}-1'
+            draw = rng.random()
+            delay = max(0.0, latency + rng.uniform(-jitter, jitter))
+            duplicate = rng.random() < duplicate_ratio
+        if draw < success_ratio:
+            result = 'success'
+        elif draw < success_ratio + failure_ratio:
+            result = 'failure'
+        else:
+            result = None
+        count(result or 'no_callback')
+
+        if result:
+            url = callback_url or stk['CallBackURL']
+            payload = _callback_payload(stk, checkout_id, merchant_id, result)
+            scheduler.schedule(delay, url, payload)
+            if duplicate:
+                count('duplicates')
+                scheduler.schedule(delay + 0.2, url, payload)
+
+        return jsonify({
+            'MerchantRequestID': merchant_id,
+            'CheckoutRequestID': checkout_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        })
+
+    @sim.route('/stats', methods=['GET'])
+    def sim_stats():
+        with stats_lock:
+            result = dict(stats)
+        result['callbacks'] = scheduler.snapshot()
+        return jsonify(result)
+
+    return sim
+
+
+@click.command('daraja-sim')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8089, show_default=True)
+@click.option('--latency', default=1.0, show_default=True, help='Seconds between an STK push and its callback.')
+@click.option('--jitter', default=0.5, show_default=True, help='Random +/- seconds added to the latency.')
+@click.option('--success-ratio', default=0.9, show_default=True, type=click.FloatRange(0, 1))
+@click.option('--failure-ratio', default=0.1, show_default=True, type=click.FloatRange(0, 1))
+@click.option('--duplicate-ratio', default=0.0, show_default=True, type=click.FloatRange(0, 1),
+              help='Share of callbacks delivered twice, as Daraja sometimes does.')
+@click.option('--callback-url', default=None, help="Send callbacks here instead of the request's CallBackURL.")
+@click.option('--token-ttl', default=3599, show_default=True, help='Lifetime of issued access tokens in seconds.')
+@click.option('--senders', default=8, show_default=True, help='Concurrent callback POSTs.')
+@click.option('--seed', type=int, default=None, help='Seed the outcome draws for repeatable runs.')
+def daraja_sim_command(host, port, latency, jitter, success_ratio, failure_ratio, duplicate_ratio,
+                       callback_url, token_ttl, senders, seed):
+    """Run a local Daraja stand-in that issues tokens, accepts STK pushes and fires callbacks."""
+    if success_ratio + failure_ratio > 1:
+        raise click.BadParameter('--success-ratio plus --failure-ratio cannot exceed 1.')
+    sim = create_simulator(
+        latency=latency, jitter=jitter, success_ratio=success_ratio, failure_ratio=failure_ratio,
+        duplicate_ratio=duplicate_ratio, callback_url=callback_url, token_ttl=token_ttl,
+        senders=senders, seed=seed
+    )
+    click.echo(f'Set MPESA_BASE_URL=http://{host}:{port} to send payments here; counters at /stats.')
+    sim.run(host=host, port=port, threaded=True, use_reloader=False)
+
+def init_app(app):
+    """Register the Daraja simulator command with the Flask app."""
+    app.cli.add_command(daraja_sim_command)
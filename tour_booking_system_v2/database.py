@@ -1,35 +1,228 @@
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+
 import click
 from flask import current_app, g
 
+from .storage import EnginePool, PoolTimeout, dialect_of, split_script
+
+
+class ConnectionPool:
+    """A per-process pool of SQLite connections.
+
+    Connections are opened lazily up to ``size`` and handed out LIFO, so the
+    most recently used connection (with a warm page cache) is reused first.
+    """
+
+    def __init__(self, database, size, timeout, pragmas, journal_mode, on_connect=(), factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.journal_mode = journal_mode
+        self.on_connect = on_connect
+        self.factory = factory
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False, # Connections move between request threads
+            factory=self.factory
+        )
+        conn.row_factory = sqlite3.Row # Returns rows that behave like dicts
+        if self.journal_mode:
+            # journal_mode is persistent in the file, so this only does real work once
+            conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+            self.journal_mode = None
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        for hook in self.on_connect:
+            hook(conn)
+        return conn
+
+    def acquire(self):
+        """Checks out a connection, opening a new one or waiting if the pool is exhausted."""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+
+        if conn is None:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._waits += 1
+                        self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.timeout}s "
+                        f"(pool size {self.size})."
+                    )
+                waited = time.perf_counter() - started
+                with self._lock:
+                    self._waits += 1
+                    self._wait_seconds += waited
+
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, discarding any uncommitted work."""
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is closed and replaced lazily on the next checkout
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'opened': self._opened,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_seconds': round(self._wait_seconds, 6),
+                'timeouts': self._timeouts,
+            }
+
+
+def get_pool(app=None):
+    """Returns this worker's connection pool, creating it on first use.
+
+    That is a SQLAlchemy pool when DATABASE_URL is set (e.g. MySQL) and the
+    SQLite pool otherwise. The pool is keyed on the process id so a gunicorn
+    worker forked from a preloaded master never shares handles with its parent.
+    """
+    app = app or current_app._get_current_object()
+    pool = app.extensions.get('db_pool')
+    config = app.config
+    url = config.get('DATABASE_URL')
+    if url and (pool is None or pool.pid != os.getpid() or pool.database != url):
+        if isinstance(pool, EnginePool) and pool.pid != os.getpid():
+            pool.detach()
+        pool = EnginePool(
+            url,
+            size=int(config.get('DB_POOL_SIZE', 8)),
+            max_overflow=int(config.get('DB_MAX_OVERFLOW', 4)),
+            timeout=float(config.get('DB_POOL_TIMEOUT', 10)),
+            recycle=int(config.get('DB_POOL_RECYCLE', 1800)),
+            pre_ping=config.get('DB_POOL_PRE_PING', True),
+            isolation_level=config.get('DB_ISOLATION_LEVEL'),
+        )
+        app.extensions['db_pool'] = pool
+    elif not url and (pool is None or pool.pid != os.getpid() or pool.database != config['DATABASE']):
+        pragmas = [
+            ('busy_timeout', int(config.get('DB_BUSY_TIMEOUT', 5000))),
+            ('synchronous', config.get('DB_SYNCHRONOUS', 'NORMAL')),
+            ('cache_size', int(config.get('DB_CACHE_SIZE', -16000))),
+            ('mmap_size', int(config.get('DB_MMAP_SIZE', 268435456))),
+        ]
+        pool = ConnectionPool(
+            config['DATABASE'],
+            size=int(config.get('DB_POOL_SIZE', 8)),
+            timeout=float(config.get('DB_POOL_TIMEOUT', 10)),
+            pragmas=pragmas,
+            journal_mode=config.get('DB_JOURNAL_MODE', 'WAL'),
+            on_connect=app.extensions.setdefault('sqlite_connect_hooks', []),
+            factory=app.extensions.get('sqlite_connection_factory', sqlite3.Connection),
+        )
+        app.extensions['db_pool'] = pool
+    return pool
+
+def add_connect_hook(app, hook):
+    """Calls ``hook(conn)`` on every new pooled SQLite connection (tracing, metrics...).
+
+    Register hooks before the first request; connections that are already
+    open are not revisited.
+    """
+    app.extensions.setdefault('sqlite_connect_hooks', []).append(hook)
+
+def set_connection_factory(app, factory):
+    """Opens pooled connections as ``factory`` (a sqlite3.Connection subclass).
+
+    Like connect hooks, set it before the first request.
+    """
+    app.extensions['sqlite_connection_factory'] = factory
+
+def pool_stats():
+    """Returns checkout/wait counters for this worker's connection pool."""
+    return get_pool().stats()
+
 def get_db():
     """Connects to the application's configured database.
-    The connection is unique per request and will be reused if called again.
+    The connection is checked out of the worker's pool once per request and
+    will be reused if called again.
     """
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row # Returns rows that behave like dicts
+        g.db = get_pool().acquire()
 
     return g.db
 
 def close_db(e=None):
-    """Closes the database connection at the end of the request."""
+    """Returns the database connection to the pool at the end of the request."""
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        get_pool().release(db)
 
 def init_db():
     """Clear existing data and create new tables."""
     db = get_db()
+    dialect = dialect_of(db)
+
+    if dialect != 'sqlite':
+        # schema_<dialect>.sql is the same schema in that database's SQL
+        with current_app.open_resource(f'schema_{dialect}.sql') as f:
+            for statement in split_script(f.read().decode('utf8')):
+                db.execute(statement)
+        db.commit()
+        return
 
     with current_app.open_resource('schema.sql') as f:
         # Decode the bytes to a string and execute the SQL
         db.executescript(f.read().decode('utf8'))
 
+    # schema.sql is always the latest schema, so no migration needs to run on it
+    db.execute(f'PRAGMA user_version = {latest_version()}')
+
     # Optional: Add an admin user immediately after creating tables
     # if you want a default admin account for easy testing
     # try:
@@ -46,6 +239,119 @@ def init_db():
     #     print(f"Error creating default admin user: {e}")
 
 
+# --- Schema Migrations ---
+# Numbered SQL files in migrations/ evolve a live database in place. The
+# applied version is kept in SQLite's PRAGMA user_version; schema.sql must
+# always equal the result of applying every migration. They are SQLite-only:
+# other backends are created from schema_<dialect>.sql, kept in step by hand.
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.sql$')
+
+def list_migrations():
+    """Returns [(version, name, path)] for every migration file, oldest first."""
+    directory = os.path.join(current_app.root_path, 'migrations')
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    return migrations
+
+def latest_version():
+    migrations = list_migrations()
+    return migrations[-1][0] if migrations else 0
+
+def require_sqlite(db):
+    if dialect_of(db) != 'sqlite':
+        raise click.ClickException(
+            f'Migrations only run on SQLite; recreate the {dialect_of(db)} schema from schema_{dialect_of(db)}.sql.'
+        )
+
+def current_version(db):
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    if version == 0 and db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'"
+    ).fetchone() is not None:
+        # Created from schema.sql before migrations existed: that is the baseline
+        version = 1
+    return version
+
+class MigrationBlocked(Exception):
+    """A pending migration cannot run until the data it would reject is fixed."""
+
+    def __init__(self, number, name, problems, applied):
+        super().__init__(
+            f'Migration {number:04d}_{name} cannot run:\n' + '\n'.join(f'  {problem}' for problem in problems)
+        )
+        self.applied = applied # The migrations that did run before it
+
+def duplicate_departures(db):
+    """Tours sharing a name and date, which idx_tours_name_date (0010) forbids."""
+    return [
+        f"{row['name']!r} on {row['date']}: tour ids {row['ids']} (rename, re-date or merge all but one)"
+        for row in db.execute(
+            "SELECT /* full scan */ name, date, GROUP_CONCAT(id, ', ') AS ids FROM tours "
+            'GROUP BY name, date HAVING COUNT(*) > 1 ORDER BY name, date'
+        )
+    ]
+
+# Checks run before a migration whose DDL would fail on existing rows; each
+# returns a list of problems for the admin to resolve (nothing is changed).
+PRECHECKS = {10: duplicate_departures}
+
+def migrate_db(target=None):
+    """Applies pending migrations in order, each in its own transaction.
+
+    Returns the list of (version, name) applied. Raises MigrationBlocked
+    if a migration's precheck finds rows it would reject.
+    """
+    db = get_db()
+    version = current_version(db)
+    applied = []
+    for number, name, path in list_migrations():
+        if number <= version or (target is not None and number > target):
+            continue
+        problems = PRECHECKS[number](db) if number in PRECHECKS else []
+        if problems:
+            raise MigrationBlocked(number, name, problems, applied)
+        with open(path, encoding='utf8') as f:
+            script = f.read()
+        try:
+            # executescript runs outside Python's implicit transactions, so the
+            # migration and its version stamp are wrapped explicitly.
+            db.executescript(f'BEGIN IMMEDIATE;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;')
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        applied.append((number, name))
+    return applied
+
+
+@click.command('migrate-db')
+@click.option('--target', type=int, default=None, help='Stop after this migration version.')
+def migrate_db_command(target):
+    """Apply pending schema migrations to the live database."""
+    require_sqlite(get_db())
+    try:
+        applied = migrate_db(target)
+    except MigrationBlocked as e:
+        for number, name in e.applied:
+            click.echo(f'Applied migration {number:04d}_{name}.')
+        raise click.ClickException(str(e))
+    for number, name in applied:
+        click.echo(f'Applied migration {number:04d}_{name}.')
+    click.echo(f'Database is at version {current_version(get_db())} (latest {latest_version()}).')
+
+@click.command('db-version')
+def db_version_command():
+    """Show the applied and pending schema migrations."""
+    require_sqlite(get_db())
+    version = current_version(get_db())
+    for number, name, _ in list_migrations():
+        state = 'applied' if number <= version else 'pending'
+        click.echo(f'{number:04d}_{name}: {state}')
+
+
 @click.command('init-db')
 def init_db_command():
     """Clear existing data and create new tables."""
@@ -55,4 +361,6 @@ def init_db_command():
 def init_app(app):
     """Register database functions with the Flask app."""
     app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
\ No newline at end of file
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(db_version_command)
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+
+import click
+from flask import current_app, g
+
+from .background import BackgroundWorker
+from .database import get_db
+
+_stats_lock = threading.Lock()
+_stats = {'sent': 0, 'retried': 0, 'failed': 0, 'batches': 0}
+_config_warning_logged = False
+
+
+def _mail(app):
+    """Returns the app's Flask-Mail state, set up on the first send.
+
+    flask_mail pulls in smtplib and the email package, which most worker
+    processes never need, so it is not imported at boot.
+    """
+    state = app.extensions.get('mail')
+    if state is None:
+        from flask_mail import Mail
+        state = Mail().init_app(app)
+    return state
+
+def _record(key, count=1):
+    with _stats_lock:
+        _stats[key] += count
+
+
+# --- Email Outbox ---
+def queue_email(db, recipient, subject, html):
+    """Adds a message to the outbox without committing.
+
+    The caller commits it together with the business change it belongs to;
+    the outbox sender is woken when the app context ends.
+    """
+    now = time.time()
+    db.execute(
+        'INSERT INTO email_outbox (recipient, subject, html, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)',
+        (recipient, subject, html, now, now)
+    )
+    g.outbox_pending = True
+
+def queue_confirmation_email(db, recipient_email, recipient_name, tour_name, num_participants, booking_id):
+    queue_email(
+        db,
+        recipient_email,
+        f'Tour Booking Confirmation: {tour_name}',
+        f'''
+        <p>Hello {recipient_name},</p>
+        <p>Your booking for the <strong>{tour_name}</strong> tour has been confirmed!</p>
+        <p><strong>Booking ID:</strong> {booking_id}</p>
+        <p><strong>Number of Participants:</strong> {num_participants}</p>
+        <p>Thank you for choosing our tour booking system.</p>
+        <p>Best regards,<br>The Tour Booking Team</p>
+        '''
+    )
+
+def queue_contact_email(db, name, email, subject, message_body):
+    admin_email_recipient = os.getenv('ADMIN_EMAIL_FOR_CONTACT', 'your_admin_inbox@example.com')
+    queue_email(
+        db,
+        admin_email_recipient,
+        f"New Contact Form: {subject} (from {name} - {email})",
+        f'''
+        <p>You have received a new message from your website's contact form:</p>
+        <p><strong>Name:</strong> {name}</p>
+        <p><strong>Email:</strong> {email}</p>
+        <p><strong>Subject:</strong> {subject}</p>
+        <p><strong>Message:</strong></p>
+        <p style="white-space: pre-wrap;">{message_body}</p>
+        '''
+    )
+
+
+# --- Outbox Sender ---
+def _claim_batch(db, now):
+    config = current_app.config
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Messages left 'sending' by a sender that died are picked up again
+        db.execute(
+            "UPDATE email_outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+            (now - config.get('OUTBOX_CLAIM_TIMEOUT', 300),)
+        )
+        batch = db.execute(
+            "SELECT id, recipient, subject, html, attempts FROM email_outbox "
+            "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (now, config.get('OUTBOX_BATCH_SIZE', 50))
+        ).fetchall()
+        # Claimed one by one with a status check, so on backends without
+        # SQLite's write lock two senders never both take a message
+        batch = [row for row in batch if db.execute(
+            "UPDATE email_outbox SET status = 'sending', claimed_at = ? WHERE id = ? AND status = 'pending'",
+            (now, row['id'])
+        ).rowcount]
+        db.commit()
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return batch
+
+def _retry_or_fail(row, error, now):
+    config = current_app.config
+    attempts = row['attempts'] + 1
+    if attempts >= config.get('OUTBOX_MAX_ATTEMPTS', 8):
+        _record('failed')
+        return ("UPDATE email_outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, row['id']))
+    _record('retried')
+    delay = min(config.get('OUTBOX_RETRY_BASE', 30) * 2 ** row['attempts'], 3600)
+    return ("UPDATE email_outbox SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+            (attempts, error, now + delay, row['id']))
+
+def drain_outbox(app=None):
+    """Sends one batch of due messages over a single SMTP connection.
+
+    Returns True if a batch was claimed, so callers keep draining.
+    """
+    global _config_warning_logged
+    app = app or current_app
+    if not app.config.get('MAIL_DEFAULT_SENDER') or not app.config.get('MAIL_USERNAME') or not app.config.get('MAIL_PASSWORD'):
+        if not _config_warning_logged:
+            app.logger.warning("Flask-Mail configuration incomplete. Outbox emails will not be sent.")
+            _config_warning_logged = True
+        return False
+
+    db = get_db()
+    batch = _claim_batch(db, time.time())
+    if not batch:
+        return False
+
+    from flask_mail import Message
+    updates = []
+    try:
+        with _mail(app).connect() as connection:
+            for row in batch:
+                try:
+                    connection.send(Message(
+                        subject=row['subject'],
+                        sender=app.config.get('MAIL_DEFAULT_SENDER'),
+                        recipients=[row['recipient']],
+                        html=row['html']
+                    ))
+                    updates.append(("UPDATE email_outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL WHERE id = ?",
+                                    (time.time(), row['id'])))
+                    _record('sent')
+                except Exception as e:
+                    app.logger.error(f"Error sending outbox email {row['id']} to {row['recipient']}: {e}")
+                    updates.append(_retry_or_fail(row, str(e), time.time()))
+    except Exception as e:
+        # Could not open (or lost) the SMTP connection: everything not yet sent is retried
+        app.logger.error(f"SMTP connection error while draining outbox: {e}")
+        done = {params[-1] for _, params in updates}
+        updates.extend(_retry_or_fail(row, str(e), time.time()) for row in batch if row['id'] not in done)
+
+    for sql, params in updates:
+        db.execute(sql, params)
+    db.commit()
+    _record('batches')
+    return True
+
+def outbox_stats():
+    """Returns outbox depth and this process's sender counters."""
+    db = get_db()
+    counts = dict(db.execute(
+        "SELECT status, COUNT(*) FROM email_outbox WHERE status IN ('pending', 'sending') GROUP BY status"
+    ).fetchall())
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update(pending=counts.get('pending', 0), sending=counts.get('sending', 0))
+    return stats
+
+
+outbox_worker = BackgroundWorker('outbox-sender', drain_outbox)
+
+
+def wake_outbox_sender(e=None):
+    """Wakes the sender once the app context that queued mail has ended (and committed)."""
+    if g.pop('outbox_pending', False):
+        outbox_worker.ensure_started(current_app._get_current_object())
+        outbox_worker.wake()
+
+
+@click.command('send-outbox')
+@click.option('--once', is_flag=True, help='Drain the outbox and exit instead of polling.')
+def send_outbox_command(once):
+    """Deliver queued emails in the foreground."""
+    interval = current_app.config.get('OUTBOX_POLL_INTERVAL', 5.0)
+    batches = 0
+    while True:
+        with current_app.app_context():
+            did_work = drain_outbox()
+        if did_work:
+            batches += 1
+        elif once:
+            break
+        else:
+            time.sleep(interval)
+    click.echo(f'Processed {batches} outbox batches.')
+
+def init_app(app):
+    """Configure the outbox sender for the app (Flask-Mail is set up on first send)."""
+    outbox_worker.threads = app.config.get('OUTBOX_WORKERS', 1)
+    outbox_worker.interval = app.config.get('OUTBOX_POLL_INTERVAL', 5.0)
+    app.teardown_appcontext(wake_outbox_sender)
+
+    @app.before_request
+    def start_outbox_sender():
+        outbox_worker.ensure_started(app)
+
+    app.cli.add_command(send_outbox_command)
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import sys
+import zlib
+
+import click
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+
+from .database import get_db
+from .pagination import PAYMENT_STATUSES, booking_filters
+
+EXPORT_COLUMNS = (
+    'booking_id', 'booking_date', 'payment_status', 'num_participants',
+    'customer_name', 'customer_email', 'booked_by_username',
+    'tour_id', 'tour_name', 'tour_date', 'price',
+    'amount_paid', 'mpesa_receipt', 'phone_number_paid',
+)
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r') # Spreadsheets evaluate cells starting with these
+
+
+def export_rows(db, where, params, chunk_size=None):
+    """Yields lists of up to ``chunk_size`` booking rows, straight off one cursor.
+
+    Rows are never collected, so memory use does not grow with the export.
+    """
+    chunk_size = chunk_size or current_app.config.get('EXPORT_CHUNK_SIZE', 1000)
+    sql = """
+        SELECT
+            b.id AS booking_id,
+            b.booking_date,
+            b.payment_status,
+            b.num_participants,
+            b.customer_name,
+            b.customer_email,
+            u.username AS booked_by_username,
+            t.id AS tour_id,
+            t.name AS tour_name,
+            t.date AS tour_date,
+            t.price,
+            b.amount_paid,
+            b.mpesa_receipt,
+            b.phone_number_paid
+        FROM bookings b
+        JOIN tours t ON b.tour_id = t.id
+        LEFT JOIN users u ON b.user_id = u.id
+    """
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY b.booking_date, b.id'
+    cursor = db.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+def csv_cell(value):
+    """Quotes text a spreadsheet would run as a formula (names and emails are customer input)."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def iter_csv(chunks):
+    """Encodes row chunks as CSV text, one string per chunk (header first)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(tuple(csv_cell(row[column]) for column in EXPORT_COLUMNS) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue() # No rows: just the header
+
+def iter_ndjson(chunks):
+    """Encodes row chunks as newline-delimited JSON objects."""
+    for rows in chunks:
+        yield ''.join(json.dumps({column: row[column] for column in EXPORT_COLUMNS}) + '\n' for row in rows)
+
+def iter_export(db, fmt, where, params):
+    """Yields the export as encoded bytes chunks."""
+    encode = iter_csv if fmt == 'csv' else iter_ndjson
+    for text in encode(export_rows(db, where, params)):
+        yield text.encode('utf8')
+
+def gzip_stream(chunks, level=6):
+    """Compresses a stream of bytes chunks into a gzip stream on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits=31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@click.command('export-bookings')
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), default='-', help="File to write; '-' for stdout.")
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--payment-status', type=click.Choice(PAYMENT_STATUSES))
+@click.option('--tour-id', type=int)
+@click.option('--date-from', type=click.DateTime(formats=['%Y-%m-%d']), help='First booking date to include.')
+@click.option('--date-to', type=click.DateTime(formats=['%Y-%m-%d']), help='Last booking date to include.')
+def export_bookings_command(fmt, output, compress, payment_status, tour_id, date_from, date_to):
+    """Stream bookings with their tour and payment details as CSV or NDJSON."""
+    args = MultiDict({
+        key: value for key, value in (
+            ('payment_status', payment_status), ('tour_id', tour_id),
+            ('date_from', date_from and date_from.strftime('%Y-%m-%d')),
+            ('date_to', date_to and date_to.strftime('%Y-%m-%d')),
+        ) if value is not None
+    })
+    where, params, _ = booking_filters(args)
+    chunks = iter_export(get_db(), fmt, where, params)
+    if compress:
+        chunks = gzip_stream(chunks)
+
+    out = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+def init_app(app):
+    """Register the bookings export command with the Flask app."""
+    app.cli.add_command(export_bookings_command)
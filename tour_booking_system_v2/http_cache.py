@@ -0,0 +1,81 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import Response, current_app, g, make_response, request, session
+
+_build_id = None
+
+
+def build_id():
+    """Returns a token that changes whenever a template is redeployed.
+
+    It is part of every ETag so a new release never matches a page a client
+    cached from the old templates. All workers of one deploy agree on it.
+    """
+    global _build_id
+    if _build_id is None:
+        newest = 0.0
+        for directory, _, filenames in os.walk(os.path.join(current_app.root_path, 'templates')):
+            for filename in filenames:
+                newest = max(newest, os.path.getmtime(os.path.join(directory, filename)))
+        _build_id = str(int(newest))
+    return _build_id
+
+def make_etag(*parts):
+    """Hashes ``parts`` together with the URL, the logged-in user and the template build."""
+    user = g.get('user')
+    viewer = (user['id'], user['username'], user['is_admin']) if user else None
+    key = repr((build_id(), request.full_path, viewer, parts))
+    return hashlib.sha1(key.encode('utf8')).hexdigest()[:24]
+
+def _apply_cache_control(response, anonymous):
+    response.vary.add('Cookie')
+    if anonymous:
+        # A CDN may store the page but must revalidate it (cheaply, via the ETag)
+        max_age = current_app.config.get('HTTP_CACHE_MAX_AGE', 0)
+        response.cache_control.public = True
+        if max_age:
+            response.cache_control.max_age = max_age
+        else:
+            response.cache_control.no_cache = True
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+def conditional(render, *parts, last_modified=None):
+    """Serves ``render()`` with a weak ETag, or a bodiless 304 if the client's copy is current.
+
+    ``parts`` must capture everything the page shows besides the user and
+    URL (catalog version, row values...); they are checked before
+    ``render`` runs, so a 304 costs no template work. ``last_modified`` (a
+    Unix timestamp) is only sent to anonymous visitors, since If-Modified-Since
+    cannot tell that the same page now belongs to a different user.
+    """
+    if session.get('_flashes'):
+        # Flashed messages are shown once; never let this copy be reused
+        response = make_response(render())
+        response.cache_control.private = True
+        response.cache_control.no_store = True
+        return response
+
+    anonymous = g.get('user') is None
+    etag = make_etag(*parts)
+    if last_modified is not None and anonymous:
+        last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+    else:
+        last_modified = None
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        not_modified = last_modified <= request.if_modified_since
+    else:
+        not_modified = False
+
+    response = Response(status=304) if not_modified else make_response(render())
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    _apply_cache_control(response, anonymous)
+    return response
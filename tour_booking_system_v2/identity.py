@@ -0,0 +1,68 @@
+import threading
+
+from flask import current_app, g, request, session
+
+from .cache import MISSING, TTLCache
+from .database import get_db
+
+# Endpoints that never look at g.user: Flask's static files and the Daraja webhook
+SKIP_ENDPOINTS = frozenset({'static', 'mpesa_callback'})
+
+_cache = None
+_stats_lock = threading.Lock()
+_stats = {'skipped': 0}
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        config = current_app.config
+        _cache = TTLCache(
+            maxsize=config.get('IDENTITY_CACHE_SIZE', 1024),
+            ttl=config.get('IDENTITY_CACHE_TTL', 30),
+        )
+    return _cache
+
+def lookup_user(user_id):
+    """Returns {'id', 'username', 'email', 'is_admin'} for a user, or None if it no longer exists.
+
+    Results (including "not found") are cached per process for
+    IDENTITY_CACHE_TTL seconds, which bounds how long another gunicorn
+    worker can keep serving a stale principal after an admin change.
+    """
+    cache = _get_cache()
+    user = cache.get(user_id)
+    if user is MISSING:
+        row = get_db().execute(
+            'SELECT id, username, email, is_admin FROM users WHERE id = ?', (user_id,)
+        ).fetchone()
+        user = dict(row) if row is not None else None
+        cache.set(user_id, user)
+    return user
+
+def invalidate_user(user_id):
+    """Drops a cached principal after its row changes (admin flag, deletion)."""
+    _get_cache().delete(user_id)
+
+def load_logged_in_user():
+    """before_request hook: sets g.user from the session's user_id."""
+    user_id = session.get('user_id')
+    if request.endpoint in SKIP_ENDPOINTS:
+        g.user = None
+        if user_id is not None:
+            with _stats_lock:
+                _stats['skipped'] += 1
+        return
+    g.user = lookup_user(user_id) if user_id is not None else None
+
+def identity_stats():
+    """Returns cache counters; ``queries_saved`` counts lookups that did not hit SQLite."""
+    stats = _get_cache().stats()
+    with _stats_lock:
+        stats['skipped'] = _stats['skipped']
+    stats['queries_saved'] = stats['hits'] + stats['skipped']
+    return stats
+
+def init_app(app):
+    """Load the logged-in user before every request."""
+    app.before_request(load_logged_in_user)
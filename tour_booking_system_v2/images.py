@@ -0,0 +1,220 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app
+
+from .database import get_db
+
+MIME_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+EXIF_ORIENTATION = 0x0112
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _image_dir(app):
+    return os.path.join(app.root_path, 'static', 'images')
+
+def _variant_dir(app):
+    return os.path.join(_image_dir(app), 'variants')
+
+def variant_formats():
+    """Returns the derivative formats this Pillow build can encode, best first."""
+    from PIL import Image, features
+    formats = []
+    if 'AVIF' in Image.SAVE:
+        formats.append('avif')
+    if features.check('webp'):
+        formats.append('webp')
+    formats.append('jpeg') # Always kept as the <img> fallback
+    return formats
+
+def strip_exif(original, source_path):
+    """Rewrites an uploaded image without its EXIF block (camera serials, GPS position).
+
+    ``original`` must be loaded. The copy is written next to the file and
+    swapped in with os.replace, since the image is already being served. A
+    JPEG keeps its own quantisation tables and chroma subsampling, so the
+    master the variants come from is not degraded, and keeps just the
+    Orientation tag so it still displays upright.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(source_path), prefix='.exif-', suffix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copymode(source_path, temp_path) # mkstemp creates it readable by us alone
+        if original.format == 'JPEG':
+            save_args = {'quality': 'keep', 'subsampling': 'keep'}
+            if original.info.get('icc_profile'):
+                save_args['icc_profile'] = original.info['icc_profile']
+            orientation = original.getexif().get(EXIF_ORIENTATION, 1)
+            if orientation != 1:
+                from PIL import Image
+                exif = Image.Exif()
+                exif[EXIF_ORIENTATION] = orientation
+                save_args['exif'] = exif.tobytes()
+            original.save(temp_path, format='JPEG', **save_args)
+        else:
+            from PIL import ImageOps
+            save_args = {'lossless': True} if original.format == 'WEBP' else {}
+            # Saving without exif=... writes no EXIF block
+            ImageOps.exif_transpose(original).save(temp_path, format=original.format, **save_args)
+        os.replace(temp_path, source_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def render_variants(source_path, out_dir, widths, quality):
+    """Writes resized, EXIF-free derivatives of one image. Runs in a worker process.
+
+    The original is also rewritten without its EXIF block (see strip_exif).
+    Returns a list of (format, width, height, filename).
+    """
+    from PIL import Image, ImageOps
+
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    formats = variant_formats()
+
+    with Image.open(source_path) as original:
+        original.load()
+        if set(original.getexif()) - {EXIF_ORIENTATION}:
+            strip_exif(original, source_path)
+        image = ImageOps.exif_transpose(original) # Bake in the camera's rotation for the variants
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+    variants = []
+    source_width = image.width
+    # Never upscale; always produce at least the smallest width
+    targets = sorted({min(w, source_width) for w in widths})
+    for width in targets:
+        height = max(1, round(image.height * width / source_width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        for fmt in formats:
+            frame = resized.convert('RGBA' if has_alpha and fmt != 'jpeg' else 'RGB')
+            filename = f'{stem}_{width}w.{"jpg" if fmt == "jpeg" else fmt}'
+            save_args = {'quality': quality}
+            if fmt == 'jpeg':
+                save_args.update(optimize=True, progressive=True)
+            elif fmt == 'webp':
+                save_args['method'] = 4
+            frame.save(os.path.join(out_dir, filename), format=fmt.upper(), **save_args)
+            variants.append((fmt, width, height, filename))
+    return variants
+
+
+def _get_executor(app):
+    """Returns this worker's process pool, recreated after a fork."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=app.config.get('IMAGE_WORKERS', 2))
+            _executor_pid = os.getpid()
+        return _executor
+
+def shutdown_executor():
+    """Waits for queued renders (and their done callbacks) to finish."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=True)
+        _executor = None
+
+def _store_variants(app, memory_id, image_filename, variants):
+    with app.app_context():
+        db = get_db()
+        current = db.execute('SELECT image_filename FROM memories WHERE id = ?', (memory_id,)).fetchone()
+        if current is None or current['image_filename'] != image_filename:
+            # The memory was deleted or given a new image while we were rendering
+            remove_variant_files(app, [v[3] for v in variants])
+            return
+        old_files = [row['filename'] for row in db.execute(
+            'SELECT filename FROM memory_images WHERE memory_id = ?', (memory_id,)
+        )]
+        db.execute('DELETE FROM memory_images WHERE memory_id = ?', (memory_id,))
+        db.executemany(
+            'INSERT INTO memory_images (memory_id, format, width, height, filename) VALUES (?, ?, ?, ?, ?)',
+            [(memory_id,) + tuple(v) for v in variants]
+        )
+        db.commit()
+        remove_variant_files(app, [f for f in old_files if f not in {v[3] for v in variants}])
+        app.logger.info(f"Stored {len(variants)} image variants for memory {memory_id}.")
+
+def schedule_variants(memory_id, image_filename):
+    """Renders derivatives for a memory's image in the process pool.
+
+    Returns immediately; the variant rows are written when rendering finishes.
+    """
+    app = current_app._get_current_object()
+    future = _get_executor(app).submit(
+        render_variants,
+        os.path.join(_image_dir(app), image_filename),
+        _variant_dir(app),
+        app.config.get('IMAGE_VARIANT_WIDTHS', (320, 640, 1024)),
+        app.config.get('IMAGE_QUALITY', 80),
+    )
+
+    def done(future):
+        try:
+            _store_variants(app, memory_id, image_filename, future.result())
+        except Exception as e:
+            app.logger.error(f"Error generating image variants for memory {memory_id}: {e}", exc_info=True)
+
+    future.add_done_callback(done)
+    return future
+
+def remove_variant_files(app, filenames):
+    for filename in filenames:
+        path = os.path.join(_variant_dir(app), filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+def delete_variants(db, memory_id):
+    """Deletes a memory's variant rows (in the caller's transaction) and files."""
+    filenames = [row['filename'] for row in db.execute(
+        'SELECT filename FROM memory_images WHERE memory_id = ?', (memory_id,)
+    )]
+    db.execute('DELETE FROM memory_images WHERE memory_id = ?', (memory_id,))
+    remove_variant_files(current_app, filenames)
+
+def variants_for(db, memory_ids):
+    """Returns {memory_id: {format: [(width, filename), ...]}} for the given memories."""
+    result = {}
+    if not memory_ids:
+        return result
+    placeholders = ','.join('?' * len(memory_ids))
+    rows = db.execute(
+        f'SELECT memory_id, format, width, filename FROM memory_images '
+        f'WHERE memory_id IN ({placeholders}) ORDER BY memory_id, width',
+        tuple(memory_ids)
+    )
+    for row in rows:
+        result.setdefault(row['memory_id'], {}).setdefault(row['format'], []).append((row['width'], row['filename']))
+    return result
+
+
+@click.command('build-image-variants')
+@click.option('--all', 'rebuild_all', is_flag=True, help='Rebuild variants for every memory, not just missing ones.')
+def build_image_variants_command(rebuild_all):
+    """Generate thumbnails and WebP/AVIF variants for memory images."""
+    db = get_db()
+    query = 'SELECT id, image_filename FROM memories'
+    if not rebuild_all:
+        query += ' WHERE id NOT IN (SELECT memory_id FROM memory_images)'
+    app = current_app._get_current_object()
+    futures = []
+    for memory in db.execute(query).fetchall():
+        if os.path.exists(os.path.join(_image_dir(app), memory['image_filename'])):
+            futures.append(schedule_variants(memory['id'], memory['image_filename']))
+        else:
+            click.echo(f"Skipping memory {memory['id']}: {memory['image_filename']} not found.")
+    shutdown_executor() # Errors are logged by each render's done callback
+    click.echo(f'Generated variants for {len(futures)} memories.')
+
+def init_app(app):
+    """Register image pipeline commands with the Flask app."""
+    app.cli.add_command(build_image_variants_command)
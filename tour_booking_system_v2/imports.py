@@ -0,0 +1,231 @@
+import codecs
+import csv
+import json
+import math
+import os
+from datetime import datetime
+
+import click
+from flask import current_app
+
+from .database import get_db
+from .storage import dialect_of
+
+TOUR_STATUSES = ('available', 'coming_soon', 'done')
+IMPORT_FORMATS = ('csv', 'json', 'ndjson')
+
+UPSERT_TOUR = (
+    'INSERT INTO tours (name, description, price, date, max_participants, status, current_participants) '
+    'VALUES (?, ?, ?, ?, ?, ?, 0) '
+    'ON CONFLICT (name, date) DO UPDATE SET '
+    'description = excluded.description, price = excluded.price, '
+    'max_participants = excluded.max_participants, status = excluded.status'
+)
+UPSERT_TOUR_MYSQL = (
+    'INSERT INTO tours (name, description, price, date, max_participants, status, current_participants) '
+    'VALUES (?, ?, ?, ?, ?, ?, 0) '
+    'ON DUPLICATE KEY UPDATE '
+    'description = VALUES(description), price = VALUES(price), '
+    'max_participants = VALUES(max_participants), status = VALUES(status)'
+)
+UPSERTS = {'sqlite': UPSERT_TOUR, 'mysql': UPSERT_TOUR_MYSQL}
+
+
+class UnreadableFile(ValueError):
+    """The rest of the file cannot be read, so none of it is imported."""
+
+
+class ImportResult:
+    """Counts and row-level errors from one import run."""
+
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = [] # [(row number, message)], capped at max_errors
+        self.file_error = None # Set when the file could not be read to the end
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((row_number, message))
+
+    def reject_file(self, row_number, message):
+        self.file_error = message
+        self.inserted = self.updated = 0
+        self.add_error(row_number, message)
+
+    def summary(self):
+        if self.file_error:
+            return f'{self.file_error} Nothing was imported.'
+        return (f'{self.rows} rows read: {self.inserted} tours added, {self.updated} updated, '
+                f'{self.error_count} rows rejected.')
+
+
+def detect_format(filename):
+    """Guesses the import format from a file name's extension, or None."""
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    return {'jsonl': 'ndjson'}.get(extension, extension) if extension in IMPORT_FORMATS + ('jsonl',) else None
+
+def read_records(stream, fmt):
+    """Yields (row number, dict) from a binary stream, one record at a time.
+
+    CSV and NDJSON are read incrementally; a JSON document must be an array
+    and is parsed whole. A file that stops being readable (not UTF-8, broken
+    CSV) ends with an UnreadableFile record for the row it failed on.
+    """
+    text = codecs.getreader('utf-8-sig')(stream)
+    number = 1 if fmt == 'csv' else 0 # The last row read; row 1 of a CSV is its header
+    try:
+        if fmt == 'csv':
+            # Data rows are numbered as a spreadsheet shows them
+            for number, record in enumerate(csv.DictReader(text), start=2):
+                yield number, record
+        elif fmt == 'ndjson':
+            for number, line in enumerate(text, start=1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as e:
+                        yield number, ValueError(f'Invalid JSON: {e}')
+        else:
+            try:
+                records = json.load(text)
+            except UnicodeDecodeError:
+                raise
+            except ValueError as e:
+                yield 1, ValueError(f'Invalid JSON: {e}')
+                return
+            if not isinstance(records, list):
+                yield 1, ValueError('A JSON import must be an array of tour objects.')
+                return
+            yield from enumerate(records, start=1)
+    except UnicodeDecodeError:
+        yield number + 1, UnreadableFile('The file is not UTF-8 text; save or export it as UTF-8 and upload it again.')
+    except csv.Error as e:
+        yield number + 1, UnreadableFile(f'The file is not valid CSV: {e}.')
+
+def validate_tour(record):
+    """Returns the UPSERT_TOUR parameters for a record, or raises ValueError."""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError('Expected an object with tour fields.')
+
+    def field(key):
+        value = record.get(key)
+        return value.strip() if isinstance(value, str) else value
+
+    name = field('name')
+    if not name:
+        raise ValueError('name is required.')
+    try:
+        price = float(field('price'))
+        if not math.isfinite(price): # float() accepts 'nan' and 'inf'
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError(f"price {field('price')!r} is not a number.")
+    date = field('date')
+    try:
+        datetime.strptime(date or '', '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ValueError(f'date {date!r} is not YYYY-MM-DD.')
+    try:
+        max_participants = int(field('max_participants'))
+    except (TypeError, ValueError):
+        raise ValueError(f"max_participants {field('max_participants')!r} is not a whole number.")
+    if price <= 0 or max_participants <= 0:
+        raise ValueError('price and max_participants must be positive.')
+    status = field('status') or 'available'
+    if status not in TOUR_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(TOUR_STATUSES)}.")
+    return (name, field('description') or '', price, date, max_participants, status)
+
+def import_tours(db, stream, fmt, dry_run=False):
+    """Validates and upserts tours from ``stream`` in a single transaction.
+
+    Records are validated as they are read and fed to executemany, so the
+    file is never held in memory (JSON arrays aside). Invalid rows are
+    reported and skipped; the rest are imported, unless the file turns out
+    to be unreadable part way, in which case nothing is. Returns an
+    ImportResult.
+    """
+    config = current_app.config
+    result = ImportResult(config.get('IMPORT_MAX_ERRORS', 100))
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Seats already sold or held per departure: an update may not drop below them
+        booked = {
+            (row['name'], row['date']): row['booked'] for row in db.execute(
+                'SELECT /* full scan */ name, date, current_participants + held_participants AS booked FROM tours'
+            )
+        }
+        seen = {}
+
+        def valid_rows():
+            for number, record in read_records(stream, fmt):
+                if isinstance(record, UnreadableFile):
+                    result.reject_file(number, str(record))
+                    return
+                result.rows += 1
+                try:
+                    params = validate_tour(record)
+                except ValueError as e:
+                    result.add_error(number, str(e))
+                    continue
+                key = (params[0], params[3])
+                if key in seen:
+                    result.add_error(number, f'Duplicate of row {seen[key]} ({key[0]} on {key[1]}).')
+                    continue
+                if key in booked and params[4] < booked[key]:
+                    result.add_error(number, f'max_participants {params[4]} is below the {booked[key]} seats already booked.')
+                    continue
+                seen[key] = number
+                if key in booked:
+                    result.updated += 1
+                else:
+                    result.inserted += 1
+                yield params
+
+        if dry_run:
+            for _ in valid_rows():
+                pass
+            db.rollback()
+        else:
+            db.executemany(UPSERTS[dialect_of(db)], valid_rows())
+            if result.file_error:
+                db.rollback()
+            else:
+                db.commit()
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return result
+
+
+@click.command('import-tours')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), help='Defaults to the file extension.')
+@click.option('--dry-run', is_flag=True, help='Validate every row without writing anything.')
+def import_tours_command(path, fmt, dry_run):
+    """Add or update tours in bulk from a CSV, JSON or NDJSON file."""
+    fmt = fmt or detect_format(path)
+    if fmt is None:
+        raise click.UsageError('Cannot tell the format from the file name; pass --format.')
+    with open(path, 'rb') as f:
+        result = import_tours(get_db(), f, fmt, dry_run=dry_run)
+    for number, message in result.errors:
+        click.echo(f'Row {number}: {message}', err=True)
+    if result.error_count > len(result.errors):
+        click.echo(f'... and {result.error_count - len(result.errors)} more errors.', err=True)
+    click.echo(('Dry run: ' if dry_run else '') + result.summary())
+    if result.error_count:
+        raise click.exceptions.Exit(1)
+
+def init_app(app):
+    """Register the tour import command with the Flask app."""
+    app.cli.add_command(import_tours_command)
@@ -0,0 +1,202 @@
+import time
+
+import click
+from flask import current_app
+
+from .database import get_db
+
+
+class SeatsUnavailable(Exception):
+    """Raised when a tour cannot take the requested party size."""
+
+    def __init__(self, remaining):
+        super().__init__(f'Only {remaining} seats remaining.')
+        self.remaining = remaining
+
+
+def _release_expired(db, now, tour_id=None):
+    """Hands expired holds back to their tours. Must run inside a write transaction."""
+    tour_filter = ' AND tour_id = ?' if tour_id is not None else ''
+    params = (now,) if tour_id is None else (now, tour_id)
+    db.execute(
+        'UPDATE tours SET held_participants = held_participants - ('
+        "    SELECT COALESCE(SUM(h.seats), 0) FROM seat_holds h "
+        "    WHERE h.tour_id = tours.id AND h.status = 'held' AND h.expires_at <= ?"
+        ') WHERE id IN ('
+        "    SELECT tour_id FROM seat_holds WHERE status = 'held' AND expires_at <= ?" + tour_filter +
+        ')',
+        (now,) + params
+    )
+    return db.execute(
+        "UPDATE seat_holds SET status = 'released' WHERE status = 'held' AND expires_at <= ?" + tour_filter,
+        params
+    ).rowcount
+
+def hold_seats(db, tour_id, user_id, customer_name, customer_email, num_participants, ttl=None):
+    """Reserves seats and inserts the pending booking in a single write transaction.
+
+    The capacity check and the increment are one conditional UPDATE under
+    BEGIN IMMEDIATE, so concurrent buyers can never oversell a tour. Returns
+    the new booking id, or raises SeatsUnavailable.
+    """
+    if ttl is None:
+        ttl = current_app.config.get('SEAT_HOLD_TTL', 900)
+    now = int(time.time())
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        _release_expired(db, now, tour_id)
+        claimed = db.execute(
+            'UPDATE tours SET held_participants = held_participants + ? '
+            "WHERE id = ? AND status = 'available' "
+            'AND current_participants + held_participants + ? <= max_participants',
+            (num_participants, tour_id, num_participants)
+        ).rowcount
+        if not claimed:
+            row = db.execute(
+                'SELECT max_participants - current_participants - held_participants AS remaining '
+                'FROM tours WHERE id = ?', (tour_id,)
+            ).fetchone()
+            db.rollback()
+            raise SeatsUnavailable(max(row['remaining'], 0) if row else 0)
+
+        cursor = db.execute(
+            'INSERT INTO bookings (tour_id, user_id, customer_name, customer_email, num_participants, payment_status) VALUES (?, ?, ?, ?, ?, ?)',
+            (tour_id, user_id, customer_name, customer_email, num_participants, 'pending')
+        )
+        booking_id = cursor.lastrowid
+        db.execute(
+            'INSERT INTO seat_holds (tour_id, booking_id, seats, expires_at) VALUES (?, ?, ?, ?)',
+            (tour_id, booking_id, num_participants, now + ttl)
+        )
+        db.commit()
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return booking_id
+
+def renew_hold(db, booking_id, ttl=None):
+    """Makes sure an unpaid booking holds its seats before a payment is requested.
+
+    A booking can outlive its hold: the hold expires after SEAT_HOLD_TTL,
+    long before the sweeper expires the booking, and a failed payment
+    releases it. An active hold is extended; otherwise the seats are
+    claimed again with the same capacity check as hold_seats. A failed
+    booking goes back to pending. Raises SeatsUnavailable if the tour
+    has sold the seats in the meantime.
+    """
+    if ttl is None:
+        ttl = current_app.config.get('SEAT_HOLD_TTL', 900)
+    now = int(time.time())
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        booking = db.execute(
+            'SELECT tour_id, num_participants FROM bookings WHERE id = ?', (booking_id,)
+        ).fetchone()
+        _release_expired(db, now, booking['tour_id'])
+        extended = db.execute(
+            "UPDATE seat_holds SET expires_at = ? WHERE booking_id = ? AND status = 'held'",
+            (now + ttl, booking_id)
+        ).rowcount
+        if not extended:
+            claimed = db.execute(
+                'UPDATE tours SET held_participants = held_participants + ? '
+                "WHERE id = ? AND status = 'available' "
+                'AND current_participants + held_participants + ? <= max_participants',
+                (booking['num_participants'], booking['tour_id'], booking['num_participants'])
+            ).rowcount
+            if not claimed:
+                row = db.execute(
+                    'SELECT max_participants - current_participants - held_participants AS remaining '
+                    'FROM tours WHERE id = ?', (booking['tour_id'],)
+                ).fetchone()
+                db.rollback()
+                raise SeatsUnavailable(max(row['remaining'], 0) if row else 0)
+            # seat_holds.booking_id is unique, so a released hold row is reused
+            if not db.execute(
+                "UPDATE seat_holds SET status = 'held', seats = ?, expires_at = ? WHERE booking_id = ?",
+                (booking['num_participants'], now + ttl, booking_id)
+            ).rowcount:
+                db.execute(
+                    'INSERT INTO seat_holds (tour_id, booking_id, seats, expires_at) VALUES (?, ?, ?, ?)',
+                    (booking['tour_id'], booking_id, booking['num_participants'], now + ttl)
+                )
+        db.execute(
+            "UPDATE bookings SET payment_status = 'pending' WHERE id = ? AND payment_status = 'failed'",
+            (booking_id,)
+        )
+        db.commit()
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+
+def convert_hold(db, booking_id, tour_id, num_participants):
+    """Turns a booking's hold into sold seats. Runs inside the caller's payment transaction.
+
+    A payment that arrives after its hold lapsed only gets seats the tour
+    still has free. Returns False when it has none left, so the caller can
+    mark the payment for a refund instead of overselling the tour.
+    """
+    converted = db.execute(
+        "UPDATE seat_holds SET status = 'converted' WHERE booking_id = ? AND status = 'held'",
+        (booking_id,)
+    ).rowcount
+    if converted:
+        db.execute(
+            'UPDATE tours SET held_participants = held_participants - ?, '
+            'current_participants = current_participants + ? WHERE id = ?',
+            (num_participants, num_participants, tour_id)
+        )
+        return True
+
+    current_app.logger.warning(f"Booking {booking_id} paid without an active seat hold; claiming seats directly.")
+    return bool(db.execute(
+        'UPDATE tours SET current_participants = current_participants + ? '
+        'WHERE id = ? AND current_participants + held_participants + ? <= max_participants',
+        (num_participants, tour_id, num_participants)
+    ).rowcount)
+
+def release_hold(db, booking_id):
+    """Gives a booking's held seats back. Runs inside the caller's transaction."""
+    hold = db.execute(
+        "SELECT tour_id, seats FROM seat_holds WHERE booking_id = ? AND status = 'held'",
+        (booking_id,)
+    ).fetchone()
+    if hold is None:
+        return False
+    released = db.execute(
+        "UPDATE seat_holds SET status = 'released' WHERE booking_id = ? AND status = 'held'",
+        (booking_id,)
+    ).rowcount
+    if released:
+        db.execute(
+            'UPDATE tours SET held_participants = held_participants - ? WHERE id = ?',
+            (hold['seats'], hold['tour_id'])
+        )
+    return bool(released)
+
+def release_expired_holds(db):
+    """Releases every expired hold across all tours. Returns the number released."""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        released = _release_expired(db, int(time.time()))
+        db.commit()
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return released
+
+
+@click.command('release-holds')
+def release_holds_command():
+    """Release seat holds whose TTL has passed."""
+    released = release_expired_holds(get_db())
+    click.echo(f'Released {released} expired seat holds.')
+
+def init_app(app):
+    """Register seat inventory commands with the Flask app."""
+    app.cli.add_command(release_holds_command)
@@ -0,0 +1,214 @@
+import bisect
+import hmac
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, request
+
+from . import slow_queries
+from .database import pool_stats, set_connection_factory
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8' # Prometheus text exposition format
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name -> (help, label names, buckets)
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Time spent handling a request.', ('endpoint', 'method'), DURATION_BUCKETS),
+    'db_queries_per_request': ('SQL statements executed per request.', ('endpoint',), SQL_COUNT_BUCKETS),
+    'db_query_seconds_per_request': ('Time per request spent in SQLite.', ('endpoint',), SQL_SECONDS_BUCKETS),
+    'upstream_request_duration_seconds': ('Outbound HTTP calls, e.g. to Daraja.', ('service', 'operation'), DURATION_BUCKETS),
+}
+# name -> (help, label names)
+COUNTERS = {
+    'http_requests_total': ('Requests handled, by response status.', ('endpoint', 'method', 'status')),
+    'upstream_requests_total': ('Outbound HTTP calls, by status (or "error" if no response).', ('service', 'operation', 'status')),
+}
+
+_sql = threading.local()
+
+
+class Histogram:
+    """Per-bucket counts plus a running sum, as Prometheus histograms expect."""
+
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Per-process counters and histograms. Every update is one dict lookup under a lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name in HISTOGRAMS}
+        self._counters = {name: {} for name in COUNTERS}
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            series = self._histograms[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(HISTOGRAMS[name][2])
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            series = self._counters[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def render(self, gauges=()):
+        """Returns every series in the Prometheus text format.
+
+        ``gauges`` is an iterable of (name, help, value) added as unlabelled gauges.
+        """
+        with self._lock:
+            histograms = {
+                name: [(labels, list(h.counts), h.sum) for labels, h in series.items()]
+                for name, series in self._histograms.items()
+            }
+            counters = {name: list(series.items()) for name, series in self._counters.items()}
+
+        lines = []
+        for name, series in histograms.items():
+            help_text, label_names, buckets = HISTOGRAMS[name]
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for labels, counts, total in sorted(series):
+                base = _format_labels(label_names, labels)
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{base},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{base}}} {total:.6f}')
+                lines.append(f'{name}_count{{{base}}} {cumulative}')
+        for name, series in counters.items():
+            help_text, label_names = COUNTERS[name]
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for labels, value in sorted(series):
+                lines.append(f'{name}{{{_format_labels(label_names, labels)}}} {value}')
+        for name, help_text, value in gauges:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(names, values):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+registry = MetricsRegistry()
+PROCESS_STARTED = time.time()
+
+
+# --- SQL Instrumentation ---
+def _add_sql(conn, method, args, seconds):
+    _sql.queries = getattr(_sql, 'queries', 0) + 1
+    _sql.seconds = getattr(_sql, 'seconds', 0.0) + seconds
+    if slow_queries.threshold is not None and seconds >= slow_queries.threshold:
+        slow_queries.record(conn, method, args, seconds)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """A connection that adds each statement's count and time to the current thread's request totals.
+
+    The time covers running the statement up to its first row, which for
+    the app's queries is nearly all of it; rows fetched later are not timed.
+    Statements over SLOW_QUERY_THRESHOLD_MS also go to the slow query log.
+    """
+
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _add_sql(self, 'execute', args, time.perf_counter() - started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _add_sql(self, 'executemany', args, time.perf_counter() - started)
+
+    def executescript(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executescript(*args)
+        finally:
+            _add_sql(self, 'executescript', args, time.perf_counter() - started)
+
+
+# --- Request Instrumentation ---
+def start_request():
+    """before_request hook: starts the clock and zeroes this thread's SQL totals."""
+    _sql.queries = 0
+    _sql.seconds = 0.0
+    g.metrics_started = time.perf_counter()
+
+def finish_request(response):
+    """after_request hook: records latency, status and SQL totals for the matched endpoint."""
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        # Route names rather than URLs, so label cardinality stays bounded
+        endpoint = request.endpoint or 'unmatched'
+        registry.observe('http_request_duration_seconds', (endpoint, request.method), time.perf_counter() - started)
+        registry.inc('http_requests_total', (endpoint, request.method, str(response.status_code)))
+        registry.observe('db_queries_per_request', (endpoint,), _sql.queries)
+        registry.observe('db_query_seconds_per_request', (endpoint,), _sql.seconds)
+    return response
+
+def observe_upstream(service, operation, status, seconds):
+    """Records one outbound HTTP call; ``status`` is the HTTP status or 'error'."""
+    registry.observe('upstream_request_duration_seconds', (service, operation), seconds)
+    registry.inc('upstream_requests_total', (service, operation, str(status)))
+
+
+# --- Exposition ---
+def token_matches():
+    """True if the request carries ``Authorization: Bearer <METRICS_TOKEN>``."""
+    token = current_app.config.get('METRICS_TOKEN')
+    header = request.headers.get('Authorization', '')
+    if not token or not header.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(header[len('Bearer '):].encode(), token.encode())
+
+def render_metrics():
+    """Returns this worker's metrics, plus connection pool gauges, for /metrics.
+
+    Every gunicorn worker keeps its own series; a scrape sees the worker
+    that answered it, identified by the ``process_id`` gauge.
+    """
+    pool = pool_stats()
+    gauges = [
+        ('process_id', 'PID of the worker that answered this scrape.', os.getpid()),
+        ('process_start_time_seconds', 'Start time of the worker since the Unix epoch.', f'{PROCESS_STARTED:.3f}'),
+        ('db_pool_in_use', 'Pooled database connections checked out.', pool['in_use']),
+        ('db_pool_opened', 'Pooled database connections open.', pool['opened']),
+        ('db_pool_waits', 'Checkouts that had to wait for a free connection.', pool['waits']),
+        ('db_pool_timeouts', 'Checkouts that gave up after DB_POOL_TIMEOUT.', pool['timeouts']),
+    ]
+    return registry.render(gauges)
+
+def init_app(app):
+    """Instrument requests (METRICS_ENABLED) and pooled connections (that, or the slow query log).
+
+    Call before other init_app functions that add before_request hooks, so
+    their time and queries are counted too.
+    """
+    slow_queries.init_app(app)
+    if app.config.get('METRICS_ENABLED', True) or slow_queries.threshold is not None:
+        set_connection_factory(app, InstrumentedConnection)
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,47 @@
+-- Baseline: the original users, tours, bookings and memories tables.
+-- Databases created before migrations existed are stamped at this version.
+
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    is_admin INTEGER DEFAULT 0
+);
+
+CREATE TABLE tours (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    price REAL NOT NULL,
+    date TEXT NOT NULL,
+    max_participants INTEGER NOT NULL,
+    current_participants INTEGER DEFAULT 0,
+    status TEXT DEFAULT 'available'
+);
+
+CREATE TABLE bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tour_id INTEGER NOT NULL,
+    user_id INTEGER,
+    customer_name TEXT NOT NULL,
+    customer_email TEXT NOT NULL,
+    num_participants INTEGER NOT NULL,
+    booking_date TEXT DEFAULT CURRENT_TIMESTAMP,
+    payment_status TEXT DEFAULT 'pending', -- 'pending', 'paid', 'failed', 'refunded'
+    mpesa_receipt TEXT,                   -- NEW: Stores the M-Pesa transaction ID (e.g., RJ67R923H)
+    amount_paid REAL,                     -- NEW: Stores the actual amount paid via M-Pesa
+    phone_number_paid TEXT,               -- NEW: Stores the phone number that initiated the payment
+    FOREIGN KEY (tour_id) REFERENCES tours (id),
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE TABLE memories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    description TEXT,
+    image_filename TEXT NOT NULL,
+    tour_id INTEGER,
+    memory_date TEXT NOT NULL,
+    FOREIGN KEY (tour_id) REFERENCES tours (id)
+);
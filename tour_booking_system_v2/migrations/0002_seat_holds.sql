@@ -0,0 +1,17 @@
+-- Atomic seat holds for pending bookings (inventory.py).
+
+ALTER TABLE tours ADD COLUMN held_participants INTEGER DEFAULT 0; -- Seats reserved by unpaid bookings (see seat_holds)
+
+CREATE TABLE seat_holds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tour_id INTEGER NOT NULL,
+    booking_id INTEGER NOT NULL UNIQUE,
+    seats INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL, -- Unix timestamp after which the seats go back on sale
+    status TEXT DEFAULT 'held',  -- 'held', 'converted', 'released'
+    FOREIGN KEY (tour_id) REFERENCES tours (id),
+    FOREIGN KEY (booking_id) REFERENCES bookings (id)
+);
+
+CREATE INDEX idx_seat_holds_status_expires ON seat_holds (status, expires_at);
+CREATE INDEX idx_seat_holds_tour_status_expires ON seat_holds (tour_id, status, expires_at);
@@ -0,0 +1,15 @@
+-- Webhook payloads are persisted here and applied by the callback workers
+CREATE TABLE inbound_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,          -- e.g. 'mpesa_stk'
+    payload TEXT NOT NULL,         -- Raw JSON body as received
+    status TEXT DEFAULT 'queued',  -- 'queued', 'processing', 'done', 'failed'
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    received_at REAL NOT NULL,     -- Unix timestamps (seconds)
+    available_at REAL NOT NULL,    -- Not retried before this time (backoff)
+    claimed_at REAL,
+    processed_at REAL
+);
+
+CREATE INDEX idx_inbound_events_status_available ON inbound_events (status, available_at);
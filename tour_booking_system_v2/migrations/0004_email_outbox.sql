@@ -0,0 +1,16 @@
+-- Emails are written here in the same transaction as the change they announce
+CREATE TABLE email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    html TEXT NOT NULL,
+    status TEXT DEFAULT 'pending', -- 'pending', 'sending', 'sent', 'failed'
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,      -- Unix timestamps (seconds)
+    next_attempt_at REAL NOT NULL, -- Not retried before this time (backoff)
+    claimed_at REAL,
+    sent_at REAL
+);
+
+CREATE INDEX idx_email_outbox_status_next ON email_outbox (status, next_attempt_at);
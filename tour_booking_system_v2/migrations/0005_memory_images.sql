@@ -0,0 +1,12 @@
+-- Resized, EXIF-free derivatives of each memory's image (see images.py)
+CREATE TABLE memory_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    memory_id INTEGER NOT NULL,
+    format TEXT NOT NULL,   -- 'jpeg', 'webp', 'avif'
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    filename TEXT NOT NULL, -- Relative to static/images/variants/
+    FOREIGN KEY (memory_id) REFERENCES memories (id)
+);
+
+CREATE INDEX idx_memory_images_memory ON memory_images (memory_id, width);
@@ -0,0 +1,7 @@
+-- Keyset pagination indexes: each listing seeks on (filter column, sort key, id)
+CREATE INDEX idx_bookings_date ON bookings (booking_date, id);
+CREATE INDEX idx_bookings_user_date ON bookings (user_id, booking_date, id);
+CREATE INDEX idx_bookings_status_date ON bookings (payment_status, booking_date, id);
+CREATE INDEX idx_bookings_tour_date ON bookings (tour_id, booking_date, id);
+CREATE INDEX idx_memories_date ON memories (memory_date, id);
+CREATE INDEX idx_memories_tour_date ON memories (tour_id, memory_date, id);
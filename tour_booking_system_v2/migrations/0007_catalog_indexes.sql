@@ -0,0 +1,5 @@
+-- Indexes for the catalog and admin queries that `flask check-query-plans`
+-- found doing full table scans plus a temp B-tree sort.
+CREATE INDEX idx_tours_status_date ON tours (status, date); -- /tours, /coming_soon, /done_tours
+CREATE INDEX idx_tours_date ON tours (date);                -- Admin tour list
+CREATE INDEX idx_tours_name ON tours (name);                -- Tour pickers (covering: id is the rowid)
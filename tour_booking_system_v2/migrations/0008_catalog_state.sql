@@ -0,0 +1,32 @@
+-- Version counter for the catalog page cache (see catalog.py). Every change
+-- that shows up on /tours, /coming_soon, /done_tours or /memories bumps it,
+-- whichever code path (admin form, payment callback, CLI) made the change.
+CREATE TABLE catalog_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+
+-- Seeded from the clock so a re-created database never reuses cache keys
+INSERT INTO catalog_state (id, version) VALUES (1, CAST(strftime('%s', 'now') AS INTEGER) * 1000);
+
+CREATE TRIGGER tours_catalog_insert AFTER INSERT ON tours
+BEGIN UPDATE catalog_state SET version = version + 1; END;
+CREATE TRIGGER tours_catalog_delete AFTER DELETE ON tours
+BEGIN UPDATE catalog_state SET version = version + 1; END;
+-- held_participants is left out: seat holds come and go with every checkout
+-- and the public pages only show sold seats
+CREATE TRIGGER tours_catalog_update
+AFTER UPDATE OF name, description, price, date, max_participants, current_participants, status ON tours
+BEGIN UPDATE catalog_state SET version = version + 1; END;
+
+CREATE TRIGGER memories_catalog_insert AFTER INSERT ON memories
+BEGIN UPDATE catalog_state SET version = version + 1; END;
+CREATE TRIGGER memories_catalog_delete AFTER DELETE ON memories
+BEGIN UPDATE catalog_state SET version = version + 1; END;
+CREATE TRIGGER memories_catalog_update AFTER UPDATE ON memories
+BEGIN UPDATE catalog_state SET version = version + 1; END;
+
+CREATE TRIGGER memory_images_catalog_insert AFTER INSERT ON memory_images
+BEGIN UPDATE catalog_state SET version = version + 1; END;
+CREATE TRIGGER memory_images_catalog_delete AFTER DELETE ON memory_images
+BEGIN UPDATE catalog_state SET version = version + 1; END;
@@ -0,0 +1,30 @@
+-- Records when the catalog last changed, for Last-Modified on the catalog pages
+ALTER TABLE catalog_state ADD COLUMN updated_at INTEGER NOT NULL DEFAULT 0; -- Unix timestamp (seconds)
+UPDATE catalog_state SET updated_at = CAST(strftime('%s', 'now') AS INTEGER);
+
+DROP TRIGGER tours_catalog_insert;
+DROP TRIGGER tours_catalog_delete;
+DROP TRIGGER tours_catalog_update;
+DROP TRIGGER memories_catalog_insert;
+DROP TRIGGER memories_catalog_delete;
+DROP TRIGGER memories_catalog_update;
+DROP TRIGGER memory_images_catalog_insert;
+DROP TRIGGER memory_images_catalog_delete;
+
+CREATE TRIGGER tours_catalog_insert AFTER INSERT ON tours
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER tours_catalog_delete AFTER DELETE ON tours
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER tours_catalog_update
+AFTER UPDATE OF name, description, price, date, max_participants, current_participants, status ON tours
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER memories_catalog_insert AFTER INSERT ON memories
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER memories_catalog_delete AFTER DELETE ON memories
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER memories_catalog_update AFTER UPDATE ON memories
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER memory_images_catalog_insert AFTER INSERT ON memory_images
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER memory_images_catalog_delete AFTER DELETE ON memory_images
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
@@ -0,0 +1,6 @@
+-- A departure is identified by its name and date; bulk imports upsert on it.
+-- It also serves the name-ordered tour pickers, so idx_tours_name goes.
+-- migrate_db refuses to run it while duplicate departures exist (see
+-- database.duplicate_departures) and lists them for an admin to resolve.
+CREATE UNIQUE INDEX idx_tours_name_date ON tours (name, date);
+DROP INDEX idx_tours_name;
@@ -0,0 +1,16 @@
+-- Cold storage for failed and expired bookings moved out by `flask sweep-bookings`.
+-- Rows keep their original id; archived_at is a Unix timestamp.
+CREATE TABLE bookings_archive (
+    id INTEGER PRIMARY KEY,
+    tour_id INTEGER NOT NULL,
+    user_id INTEGER,
+    customer_name TEXT NOT NULL,
+    customer_email TEXT NOT NULL,
+    num_participants INTEGER NOT NULL,
+    booking_date TEXT,
+    payment_status TEXT,
+    mpesa_receipt TEXT,
+    amount_paid REAL,
+    phone_number_paid TEXT,
+    archived_at REAL NOT NULL
+);
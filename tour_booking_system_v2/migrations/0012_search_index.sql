@@ -0,0 +1,40 @@
+-- Full-text search over tours and memories (see search.py). The FTS5 tables
+-- only index the text; the rows stay in tours/memories (external content)
+-- and triggers keep both in step. prefix='2 3' makes short prefixes cheap.
+CREATE VIRTUAL TABLE tours_fts USING fts5(
+    name, description, content='tours', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE VIRTUAL TABLE memories_fts USING fts5(
+    title, description, content='memories', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+-- ORDER BY rank: a hit in the name/title counts ten times one in the description
+INSERT INTO tours_fts (tours_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+INSERT INTO memories_fts (memories_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+
+CREATE TRIGGER tours_fts_insert AFTER INSERT ON tours BEGIN
+    INSERT INTO tours_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+END;
+CREATE TRIGGER tours_fts_delete AFTER DELETE ON tours BEGIN
+    INSERT INTO tours_fts (tours_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+END;
+CREATE TRIGGER tours_fts_update AFTER UPDATE OF name, description ON tours BEGIN
+    INSERT INTO tours_fts (tours_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO tours_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+END;
+
+CREATE TRIGGER memories_fts_insert AFTER INSERT ON memories BEGIN
+    INSERT INTO memories_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+CREATE TRIGGER memories_fts_delete AFTER DELETE ON memories BEGIN
+    INSERT INTO memories_fts (memories_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+END;
+CREATE TRIGGER memories_fts_update AFTER UPDATE OF title, description ON memories BEGIN
+    INSERT INTO memories_fts (memories_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    INSERT INTO memories_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+
+-- Index the rows that already exist
+INSERT INTO tours_fts (tours_fts) VALUES ('rebuild');
+INSERT INTO memories_fts (memories_fts) VALUES ('rebuild');
@@ -0,0 +1,49 @@
+-- Remaining seats per tour date for /api/availability (see availability.py).
+-- Triggers on tours keep it in step inside the same transaction as the
+-- seat hold, payment callback or admin edit that changed the seats.
+-- Keyed by (date, tour_id) without a rowid, so a date range is one
+-- contiguous read of the table itself.
+CREATE TABLE tour_availability (
+    date TEXT NOT NULL,
+    tour_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    seats_total INTEGER NOT NULL,
+    seats_left INTEGER NOT NULL, -- max_participants minus sold and held seats
+    version INTEGER NOT NULL, -- availability_state.version when the row last changed, for ETags
+    PRIMARY KEY (date, tour_id)
+) WITHOUT ROWID;
+
+-- Unlike catalog_state this also moves when seat holds come and go
+CREATE TABLE availability_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+
+-- Seeded from the clock so a re-created database never reuses ETags
+INSERT INTO availability_state (id, version) VALUES (1, CAST(strftime('%s', 'now') AS INTEGER) * 1000);
+
+INSERT INTO tour_availability (date, tour_id, status, seats_total, seats_left, version)
+SELECT date, id, COALESCE(status, 'available'), max_participants,
+       MAX(max_participants - COALESCE(current_participants, 0) - COALESCE(held_participants, 0), 0),
+       (SELECT version FROM availability_state)
+FROM tours;
+
+CREATE TRIGGER tours_availability_insert AFTER INSERT ON tours BEGIN
+    UPDATE availability_state SET version = version + 1;
+    INSERT INTO tour_availability (date, tour_id, status, seats_total, seats_left, version)
+    VALUES (new.date, new.id, COALESCE(new.status, 'available'), new.max_participants,
+            MAX(new.max_participants - COALESCE(new.current_participants, 0) - COALESCE(new.held_participants, 0), 0),
+            (SELECT version FROM availability_state));
+END;
+CREATE TRIGGER tours_availability_delete AFTER DELETE ON tours BEGIN
+    DELETE FROM tour_availability WHERE date = old.date AND tour_id = old.id;
+END;
+CREATE TRIGGER tours_availability_update
+AFTER UPDATE OF date, max_participants, current_participants, held_participants, status ON tours BEGIN
+    UPDATE availability_state SET version = version + 1;
+    DELETE FROM tour_availability WHERE date = old.date AND tour_id = old.id;
+    INSERT INTO tour_availability (date, tour_id, status, seats_total, seats_left, version)
+    VALUES (new.date, new.id, COALESCE(new.status, 'available'), new.max_participants,
+            MAX(new.max_participants - COALESCE(new.current_participants, 0) - COALESCE(new.held_participants, 0), 0),
+            (SELECT version FROM availability_state));
+END;
@@ -0,0 +1,12 @@
+-- Every STK push the app sent, keyed by the CheckoutRequestID Daraja
+-- returned. Daraja's callbacks carry that ID (and not the AccountReference),
+-- so this is how a callback finds its booking. A booking can have several
+-- pushes (the customer retried), and any of them may be the one paid.
+CREATE TABLE stk_pushes (
+    checkout_request_id TEXT PRIMARY KEY,
+    booking_id INTEGER NOT NULL,
+    requested_at INTEGER NOT NULL, -- Unix timestamp
+    FOREIGN KEY (booking_id) REFERENCES bookings (id)
+) WITHOUT ROWID;
+
+CREATE INDEX idx_stk_pushes_booking ON stk_pushes (booking_id);
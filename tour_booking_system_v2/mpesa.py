@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import time
+
+from flask import current_app
+
+from . import metrics
+
+try:
+    import fcntl # Only used to single-flight refreshes across gunicorn workers
+except ImportError: # pragma: no cover - Windows development machines
+    fcntl = None
+
+SANDBOX_BASE_URL = "https://sandbox.safaricom.co.ke"
+# For production: "https://api.safaricom.co.ke"; for load tests: `flask daraja-sim` (see daraja_sim.py)
+OAUTH_PATH = "/oauth/v1/generate?grant_type=client_credentials"
+STK_PUSH_PATH = "/mpesa/stkpush/v1/processrequest"
+
+
+def api_url(path):
+    """Returns the full URL of a Daraja endpoint on the configured MPESA_BASE_URL."""
+    return current_app.config.get('MPESA_BASE_URL', SANDBOX_BASE_URL).rstrip('/') + path
+
+def call(method, path, operation, **kwargs):
+    """Sends a request to a Daraja endpoint and records its latency and status for /metrics."""
+    import requests # Deferred until the first Daraja call to keep worker boot fast
+    kwargs.setdefault('timeout', current_app.config.get('MPESA_HTTP_TIMEOUT', 10))
+    status = 'error'
+    started = time.perf_counter()
+    try:
+        response = requests.request(method, api_url(path), **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        metrics.observe_upstream('daraja', operation, status, time.perf_counter() - started)
+
+
+class TokenCache:
+    """Caches the Daraja OAuth token until shortly before it expires.
+
+    Only one thread per process refreshes at a time; others wait on the lock
+    and then reuse the fresh token. When MPESA_TOKEN_CACHE_FILE is set, the
+    token is also shared with the other gunicorn workers through that file,
+    guarded by an flock where the platform has one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'shared_hits': 0, 'refreshes': 0, 'errors': 0}
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _fresh(self, expires_at):
+        margin = current_app.config.get('MPESA_TOKEN_REFRESH_MARGIN', 300)
+        return time.time() < expires_at - margin
+
+    def get(self, consumer_key, consumer_secret):
+        """Returns a valid access token, or None if Daraja could not be reached."""
+        token, expires_at = self._token, self._expires_at
+        if token and self._fresh(expires_at):
+            self._count('hits')
+            return token
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._token and self._fresh(self._expires_at):
+                self._count('hits')
+                return self._token
+            self._count('misses')
+
+            cache_file = current_app.config.get('MPESA_TOKEN_CACHE_FILE')
+            if not cache_file:
+                return self._refresh(consumer_key, consumer_secret)
+
+            with open(cache_file + '.lock', 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    shared = self._read_shared(cache_file)
+                    if shared and self._fresh(shared['expires_at']):
+                        self._token, self._expires_at = shared['access_token'], shared['expires_at']
+                        self._count('shared_hits')
+                        return self._token
+                    token = self._refresh(consumer_key, consumer_secret)
+                    if token:
+                        self._write_shared(cache_file)
+                    return token
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def invalidate(self):
+        """Drops the cached token, e.g. after Daraja rejects it with a 401."""
+        with self._lock:
+            self._token, self._expires_at = None, 0.0
+            cache_file = current_app.config.get('MPESA_TOKEN_CACHE_FILE')
+            if cache_file and os.path.exists(cache_file):
+                os.remove(cache_file)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['expires_in_seconds'] = max(0, int(self._expires_at - time.time()))
+        return stats
+
+    def _refresh(self, consumer_key, consumer_secret):
+        import requests
+        try:
+            response = call('GET', OAUTH_PATH, 'oauth', auth=(consumer_key, consumer_secret))
+            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._count('errors')
+            current_app.logger.error(f"Error getting M-Pesa access token: {e}")
+            return None
+        self._count('refreshes')
+        # Daraja sends expires_in as a string, normally "3599"
+        self._token = data['access_token']
+        self._expires_at = time.time() + int(data.get('expires_in', 3599))
+        return self._token
+
+    def _read_shared(self, cache_file):
+        try:
+            with open(cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_shared(self, cache_file):
+        tmp_path = f'{cache_file}.{os.getpid()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600) # The token is a credential
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'access_token': self._token, 'expires_at': self._expires_at}, f)
+        os.replace(tmp_path, cache_file)
+
+
+token_cache = TokenCache()
+
+
+def get_access_token(consumer_key, consumer_secret):
+    """Returns a cached Daraja OAuth token, refreshing it before it expires."""
+    return token_cache.get(consumer_key, consumer_secret)
+
+def token_stats():
+    """Returns hit/miss/refresh counters for this process's token cache."""
+    return token_cache.stats()
@@ -0,0 +1,151 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+
+
+class Page:
+    """One page of a keyset-paginated listing."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Returns the sort-key values in a cursor, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) and values else None
+
+def page_size():
+    """Returns the requested ?per_page, capped at PAGE_SIZE_MAX."""
+    size = request.args.get('per_page', type=int) or current_app.config.get('PAGE_SIZE', 25)
+    return max(1, min(size, current_app.config.get('PAGE_SIZE_MAX', 100)))
+
+def _cursors(key_length):
+    """Returns the (after, before) sort-key values in the request; at most one is set."""
+    after = decode_cursor(request.args.get('after'))
+    before = None if after else decode_cursor(request.args.get('before'))
+    if len(after or before or ()) not in (0, key_length):
+        return None, None
+    return after, before
+
+def page_args(key_length, **filters):
+    """Returns the query arguments a keyset page is actually rendered from, normalised.
+
+    Query strings that show the same page give equal dicts, so a cached
+    page can be keyed on them rather than on whatever a visitor appended.
+    ``filters`` are the listing's own, already parsed; None values are
+    left out. ``key_length`` is the number of keyset_page sort columns.
+    """
+    args = {key: value for key, value in filters.items() if value is not None}
+    size = page_size()
+    if size != current_app.config.get('PAGE_SIZE', 25):
+        args['per_page'] = size
+    after, before = _cursors(key_length)
+    if after:
+        args['after'] = encode_cursor(after)
+    elif before:
+        args['before'] = encode_cursor(before)
+    return args
+
+def keyset_page(db, sql, params, order_by, row_key, descending=True, where=None):
+    """Runs ``sql`` one page at a time, seeking on an indexed sort key instead of OFFSET.
+
+    ``order_by`` lists the SQL sort columns (the last one must be unique, e.g.
+    the primary key) and ``row_key`` extracts the same values from a row.
+    ``where`` is a list of extra conditions already bound in ``params``. The
+    page position comes from the ?after= / ?before= cursors in the request.
+    """
+    size = page_size()
+    where = list(where or [])
+    params = list(params)
+    after, before = _cursors(len(order_by))
+    cursor = after or before
+
+    # Walking backwards (?before=) flips both the comparison and the sort, then
+    # the page is reversed back into display order.
+    backwards = before is not None
+    reverse_sort = descending != backwards
+    if cursor is not None:
+        op = '<' if reverse_sort else '>'
+        where.append(f"({', '.join(order_by)}) {op} ({', '.join('?' * len(order_by))})")
+        params.extend(cursor)
+    direction = 'DESC' if reverse_sort else 'ASC'
+
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY ' + ', '.join(f'{column} {direction}' for column in order_by)
+    sql += ' LIMIT ?'
+    params.append(size + 1)
+
+    rows = db.execute(sql, params).fetchall()
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(list(row_key(rows[-1])))
+        if after is not None or (backwards and has_more):
+            prev_cursor = encode_cursor(list(row_key(rows[0])))
+    return Page(rows, next_cursor, prev_cursor)
+
+
+PAYMENT_STATUSES = ('pending', 'paid', 'failed', 'expired', 'refund_due', 'refunded')
+
+def booking_filters(args):
+    """Turns ?payment_status=&tour_id=&date_from=&date_to= into SQL conditions on ``b``.
+
+    Returns (where, params, filters) where ``filters`` holds the accepted
+    values for re-filling the filter form. Each condition leads with a
+    column that has a matching (column, booking_date, id) index.
+    """
+    where, params, filters = [], [], {}
+
+    payment_status = args.get('payment_status')
+    if payment_status in PAYMENT_STATUSES:
+        where.append('b.payment_status = ?')
+        params.append(payment_status)
+        filters['payment_status'] = payment_status
+
+    tour_id = args.get('tour_id', type=int)
+    if tour_id:
+        where.append('b.tour_id = ?')
+        params.append(tour_id)
+        filters['tour_id'] = tour_id
+
+    for key, condition, days in (('date_from', 'b.booking_date >= ?', 0), ('date_to', 'b.booking_date < ?', 1)):
+        value = args.get(key)
+        try:
+            day = datetime.strptime(value or '', '%Y-%m-%d')
+        except ValueError:
+            continue
+        where.append(condition)
+        # date_to includes the whole day; computed here so the SQL stays portable
+        params.append((day + timedelta(days=days)).strftime('%Y-%m-%d'))
+        filters[key] = value
+
+    return where, params, filters
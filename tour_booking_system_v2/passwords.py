@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+try:
+    import bcrypt # Verifies legacy $2a$/$2b$/$2y$ hashes so they can be upgraded; in requirements.txt
+except ImportError: # pragma: no cover - a trimmed install only loses those legacy logins
+    bcrypt = None
+
+BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_slots = None # Bounds hashes running plus waiting, so a login burst cannot queue without limit
+_stats_lock = threading.Lock()
+_stats = {'hashes': 0, 'checks': 0, 'rehashed': 0, 'rejected_busy': 0, 'legacy_unverifiable': 0, 'seconds_total': 0.0}
+
+
+class HashingBusy(Exception):
+    """Raised when no hashing slot freed up within PASSWORD_HASH_TIMEOUT."""
+
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _get_executor(app):
+    """Returns this worker's hashing threads, recreated after a fork.
+
+    Threads are enough: hashlib's scrypt/PBKDF2 (and bcrypt) release the GIL,
+    so hashes run in parallel with requests without a process pool.
+    """
+    global _executor, _executor_pid, _slots
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            _slots = threading.BoundedSemaphore(workers + app.config.get('PASSWORD_HASH_QUEUE', 32))
+            _executor_pid = os.getpid()
+        return _executor
+
+def _run(fn, *args):
+    """Runs ``fn`` on the hashing pool and waits for it; raises HashingBusy if saturated."""
+    app = current_app._get_current_object()
+    executor = _get_executor(app)
+    timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 10)
+    slots = _slots
+    if not slots.acquire(timeout=timeout):
+        _count('rejected_busy')
+        raise HashingBusy('Too many password checks in progress.')
+    started = time.perf_counter()
+    try:
+        return executor.submit(fn, *args).result()
+    finally:
+        slots.release()
+        _count('seconds_total', time.perf_counter() - started)
+
+def _method_prefix(method):
+    """The 'scrypt:32768:8:1' style prefix that generate_password_hash(..., method) writes.
+
+    Filled in from werkzeug's defaults (security._hash_internal) rather than
+    by hashing, so checking a login never runs an extra hash off the pool.
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        args = [2 ** 15, 8, 1]
+    elif name == 'pbkdf2' and len(args) < 2:
+        args = (args or ['sha256']) + [DEFAULT_PBKDF2_ITERATIONS]
+    return ':'.join([name] + [str(arg) for arg in args])
+
+def needs_rehash(stored):
+    """True if ``stored`` was not made with the configured PASSWORD_HASH_METHOD."""
+    method = current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+    return stored.split('$', 1)[0] != _method_prefix(method)
+
+def _verify(stored, password):
+    # Runs on a pool thread, outside the app context
+    try:
+        if stored.startswith(BCRYPT_PREFIXES):
+            return bcrypt.checkpw(password.encode('utf8'), stored.encode('utf8'))
+        return check_password_hash(stored, password)
+    except ValueError: # Unknown hash method, or a malformed bcrypt salt, in the stored value
+        return False
+
+def hash_password(password):
+    """Hashes a new password with PASSWORD_HASH_METHOD on the hashing pool."""
+    method = current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+    _count('hashes')
+    return _run(generate_password_hash, password, method)
+
+def check_password(stored, password):
+    """Verifies ``password`` on the hashing pool. Returns (ok, new_hash).
+
+    ``new_hash`` is set when the password was right but ``stored`` uses an
+    older method (e.g. a legacy bcrypt row or a weaker scrypt cost); the
+    caller should save it, which upgrades the account transparently.
+    """
+    _count('checks')
+    if stored.startswith(BCRYPT_PREFIXES) and bcrypt is None:
+        _count('legacy_unverifiable')
+        current_app.logger.warning('A bcrypt password hash cannot be checked: install the bcrypt package.')
+        return False, None
+    if not _run(_verify, stored, password):
+        return False, None
+    if not needs_rehash(stored):
+        return True, None
+    _count('rehashed')
+    return True, hash_password(password)
+
+def hashing_stats():
+    """Returns hash/check counters for this process; busy rejections mean the pool is too small."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['seconds_total'] = round(stats['seconds_total'], 3)
+    stats['workers'] = current_app.config.get('PASSWORD_HASH_WORKERS', 2)
+    stats['bcrypt_available'] = bcrypt is not None
+    return stats
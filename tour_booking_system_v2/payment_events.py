@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+
+from .background import BackgroundWorker
+from .database import get_db
+
+MAX_IDS_PER_QUERY = 500 # Keeps each IN (...) list under SQLite's bound-parameter limit
+
+_lock = threading.Lock()
+_waiters = {} # Booking id -> set of Waiters
+_count = 0
+_stats = {'subscribed': 0, 'rejected_full': 0, 'delivered': 0, 'timed_out': 0, 'polls': 0}
+
+
+class Waiter:
+    """One browser waiting for a booking to leave 'pending'."""
+
+    __slots__ = ('booking_id', 'status', 'event')
+
+    def __init__(self, booking_id):
+        self.booking_id = booking_id
+        self.status = None
+        self.event = threading.Event()
+
+
+def subscribe(booking_id, limit):
+    """Registers a waiter for ``booking_id``, or returns None if ``limit`` waiters are already held."""
+    global _count
+    with _lock:
+        if _count >= limit:
+            _stats['rejected_full'] += 1
+            return None
+        waiter = Waiter(booking_id)
+        _waiters.setdefault(booking_id, set()).add(waiter)
+        _count += 1
+        _stats['subscribed'] += 1
+    return waiter
+
+def unsubscribe(waiter):
+    global _count
+    with _lock:
+        waiters = _waiters.get(waiter.booking_id)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.discard(waiter)
+        if not waiters:
+            del _waiters[waiter.booking_id]
+        _count -= 1
+
+def notify(booking_id, status):
+    """Wakes every waiter on ``booking_id`` with its new payment status."""
+    with _lock:
+        waiters = list(_waiters.get(booking_id, ()))
+    for waiter in waiters:
+        waiter.status = status
+        waiter.event.set()
+
+def check_now():
+    """Asks the poller to look at watched bookings now (called after a callback commits)."""
+    status_poller.wake()
+
+def _poll_statuses(app):
+    # One indexed lookup per interval covers every waiter in this process,
+    # including bookings whose callback was applied by another worker.
+    with _lock:
+        ids = list(_waiters)
+        _stats['polls'] += 1
+    for start in range(0, len(ids), MAX_IDS_PER_QUERY):
+        chunk = ids[start:start + MAX_IDS_PER_QUERY]
+        marks = ', '.join('?' * len(chunk))
+        rows = get_db().execute(
+            f"SELECT id, payment_status FROM bookings WHERE id IN ({marks}) AND payment_status != 'pending'", chunk
+        ).fetchall()
+        for row in rows:
+            notify(row['id'], row['payment_status'])
+    return False # Sleep PAYMENT_STREAM_POLL_INTERVAL, or until check_now()
+
+status_poller = BackgroundWorker('payment-status-poller', _poll_statuses)
+
+
+def awaiting_callback(status, pushed_at, window):
+    """True while a pending booking's latest STK push (``pushed_at``) is young enough to get a callback.
+
+    Only then is a stream worth a thread: before the push nothing can
+    change, and long after it the customer has given up on the prompt.
+    """
+    return status == 'pending' and pushed_at is not None and time.time() - pushed_at < window
+
+def busy_event(retry_ms):
+    """Sent instead of a stream when this process holds PAYMENT_STREAM_MAX_WAITERS browsers already."""
+    return f'retry: {retry_ms * 2}\n\n' + _event('busy', {})
+
+def _event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+def stream(waiter, timeout, keepalive, retry_ms):
+    """Yields SSE messages until the booking leaves 'pending' or ``timeout`` seconds pass.
+
+    Runs after the request context is gone and holds no database
+    connection, so a waiting browser costs one thread and an Event.
+    """
+    try:
+        yield f'retry: {retry_ms}\n\n'
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with _lock:
+                    _stats['timed_out'] += 1
+                # The browser reconnects after ``retry_ms`` and waits again
+                yield _event('timeout', {'booking_id': waiter.booking_id})
+                return
+            if waiter.event.wait(min(keepalive, remaining)):
+                with _lock:
+                    _stats['delivered'] += 1
+                yield _event('status', {'booking_id': waiter.booking_id, 'payment_status': waiter.status})
+                return
+            yield ': keepalive\n\n' # Stops proxies closing an idle connection
+    finally:
+        unsubscribe(waiter) # Also runs when the browser disconnects
+
+def status_event(booking_id, status, retry_ms):
+    """A complete stream for a booking that is not (or no longer) worth waiting on."""
+    return f'retry: {retry_ms}\n\n' + _event('status', {'booking_id': booking_id, 'payment_status': status})
+
+def stream_stats():
+    """Returns how many browsers this process is holding and what became of the others."""
+    with _lock:
+        stats = dict(_stats)
+        stats['waiting'] = _count
+        stats['bookings_watched'] = len(_waiters)
+    return stats
+
+def init_app(app):
+    """Configure the status poller that backs /booking_details/<id>/events."""
+    status_poller.interval = app.config.get('PAYMENT_STREAM_POLL_INTERVAL', 2.0)
+    status_poller.threads = 1 if app.config.get('PAYMENT_STREAM_MAX_WAITERS', 500) > 0 else 0
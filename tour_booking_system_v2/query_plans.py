@@ -0,0 +1,121 @@
+import ast
+import os
+import re
+import sqlite3
+
+import click
+from flask import current_app
+
+from .database import get_db, require_sqlite
+
+DML = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+# "SCAN bookings" or "SCAN b" is a full table scan; "SCAN b USING [COVERING] INDEX ..." is not
+TABLE_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW|sqlite_)\S+(?: AS \S+)?$')
+EXECUTE_METHODS = {'execute', 'executemany'}
+# Queries that read a whole table on purpose carry this comment in their SQL
+FULL_SCAN_MARKER = '/* full scan */'
+
+
+def _literal(node):
+    """Returns the string value of a constant node, or None for dynamic SQL."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+def _keyset_sql(call):
+    """Rebuilds the page-seek SQL of a keyset_page(db, sql, params, order_by=...) call.
+
+    Only the seek is checked: the first page walks the same index without
+    the lower bound, which SQLite reports as a (LIMITed) scan.
+    """
+    sql = _literal(call.args[1]) if len(call.args) > 1 else None
+    keywords = {kw.arg: kw.value for kw in call.keywords}
+    order_by = keywords.get('order_by')
+    if sql is None or not isinstance(order_by, ast.Tuple):
+        return []
+    columns = [_literal(element) for element in order_by.elts]
+    if None in columns:
+        return []
+    descending = keywords.get('descending')
+    ascending = isinstance(descending, ast.Constant) and descending.value is False
+    direction, op = ('ASC', '>') if ascending else ('DESC', '<')
+    order = ', '.join(f'{column} {direction}' for column in columns)
+    seek = f"({', '.join(columns)}) {op} ({', '.join('?' * len(columns))})"
+    return [f'{sql} WHERE {seek} ORDER BY {order} LIMIT ?']
+
+def collect_queries(root):
+    """Finds the SQL passed to .execute()/.executemany()/keyset_page() in every module.
+
+    Returns (queries, dynamic) where ``queries`` is a list of
+    (location, sql) and ``dynamic`` counts calls whose SQL is built at
+    runtime and so cannot be checked statically.
+    """
+    queries, dynamic = [], 0
+    for filename in sorted(os.listdir(root)):
+        if not filename.endswith('.py'):
+            continue
+        path = os.path.join(root, filename)
+        with open(path, encoding='utf8') as f:
+            tree = ast.parse(f.read(), filename)
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call) or not node.args:
+                continue
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+            location = f'{filename}:{node.lineno}'
+            if name in EXECUTE_METHODS:
+                sql = _literal(node.args[0])
+                if sql is None:
+                    dynamic += 1
+                elif DML.match(sql):
+                    queries.append((location, sql))
+            elif name == 'keyset_page':
+                expanded = _keyset_sql(node)
+                if not expanded:
+                    dynamic += 1
+                queries.extend((location, sql) for sql in expanded)
+    return queries, dynamic
+
+def explain(db, sql):
+    """Returns the EXPLAIN QUERY PLAN detail lines for ``sql`` with NULL parameters."""
+    params = (None,) * sql.count('?')
+    return [row[3] for row in db.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+def find_table_scans(db, root=None):
+    """Returns (scans, unplanned, checked, dynamic).
+
+    ``scans`` is [(location, sql, plan)] for every full table scan and
+    ``unplanned`` is [(location, sql, error)] for queries SQLite could not
+    plan against the app database (e.g. the catalog cache's own file).
+    """
+    queries, dynamic = collect_queries(root or current_app.root_path)
+    scans, unplanned = [], []
+    for location, sql in queries:
+        try:
+            plan = explain(db, sql)
+        except sqlite3.Error as e:
+            unplanned.append((location, sql, str(e)))
+            continue
+        if FULL_SCAN_MARKER not in sql and any(TABLE_SCAN.match(detail) for detail in plan):
+            scans.append((location, sql, plan))
+    return scans, unplanned, len(queries) - len(unplanned), dynamic
+
+
+@click.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any query in the app plans a full table scan."""
+    require_sqlite(get_db()) # Reads SQLite's EXPLAIN QUERY PLAN
+    scans, unplanned, checked, dynamic = find_table_scans(get_db())
+    for location, sql, error in unplanned:
+        click.echo(f"{location}: not checked ({error}): {' '.join(sql.split())}")
+    for location, sql, plan in scans:
+        click.echo(f"{location}: {' '.join(sql.split())}")
+        for detail in plan:
+            click.echo(f'    {detail}')
+    click.echo(f'Checked {checked} queries ({dynamic} built at runtime were skipped); {len(scans)} table scans.')
+    if scans:
+        raise click.exceptions.Exit(1)
+
+def init_app(app):
+    """Register the query plan check with the Flask app."""
+    app.cli.add_command(check_query_plans_command)
@@ -0,0 +1,216 @@
+import glob
+import os
+import textwrap
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app, render_template
+from werkzeug.utils import secure_filename
+
+from .database import get_db
+
+RECEIPT_QUERY = (
+    'SELECT b.id, b.tour_id, b.user_id, b.num_participants, b.booking_date, b.payment_status, '
+    'b.customer_name, b.customer_email, b.mpesa_receipt, b.amount_paid, b.phone_number_paid, '
+    't.name AS tour_name, t.date AS tour_date, t.price AS tour_price '
+    'FROM bookings b JOIN tours t ON b.tour_id = t.id WHERE b.id = ?'
+)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_in_flight = {} # Receipt path -> future, so concurrent requests share one render
+
+
+# --- Rendering (runs in the process pool) ---
+def _pdf_string(text):
+    text = text.encode('cp1252', 'replace').decode('latin-1') # Standard fonts use WinAnsiEncoding
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+def text_pdf(title, lines):
+    """Builds a one-page A4 PDF of a title and plain text lines with no third-party library."""
+    commands = ['BT', '/F2 18 Tf', '56 780 Td', _pdf_string(title) + ' Tj', '/F1 11 Tf', '16 TL', 'T*']
+    for line in lines:
+        for part in textwrap.wrap(line, 90) or ['']:
+            commands += ['T*', _pdf_string(part) + ' Tj']
+    commands.append('ET')
+    stream = '\n'.join(commands).encode('latin-1')
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+        b'/Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> /Contents 6 0 R >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream',
+    ]
+    pdf = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(pdf)
+    pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b'%010d 00000 n \n' % offset
+    pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+def render_receipt(html, title, lines, path):
+    """Writes the receipt PDF to ``path`` and removes older receipts for the same booking.
+
+    Uses WeasyPrint on the HTML template when it is installed, otherwise
+    a plain text PDF of ``lines``. Runs in a pool process.
+    """
+    try:
+        from weasyprint import HTML # Heavy import, paid once per pool process
+    except ImportError:
+        data = text_pdf(title, lines)
+    else:
+        data = HTML(string=html).write_pdf()
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path) # Readers never see a half-written file
+
+    booking_prefix = os.path.basename(path).split('-', 1)[0]
+    for old in glob.glob(os.path.join(os.path.dirname(path), f'{booking_prefix}-*.pdf')):
+        if old != path:
+            os.remove(old)
+    return path
+
+
+# --- Scheduling ---
+def _receipt_dir(app):
+    return app.config.get('RECEIPT_DIR') or os.path.join(app.instance_path, 'receipts')
+
+def receipt_path(app, booking):
+    """Cache file for a booking; the M-Pesa receipt number is part of the key."""
+    receipt = secure_filename(booking['mpesa_receipt'] or '') or 'none'
+    return os.path.join(_receipt_dir(app), f"{booking['id']}-{receipt}.pdf")
+
+def _get_executor(app):
+    """Returns this worker's process pool, recreated after a fork."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=app.config.get('RECEIPT_WORKERS', 2))
+            _executor_pid = os.getpid()
+            _in_flight.clear()
+        return _executor
+
+def shutdown_executor():
+    """Waits for queued renders to finish."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    # Outside the lock: the renders' done callbacks take it
+    if executor is not None and _executor_pid == os.getpid():
+        executor.shutdown(wait=True)
+
+def _receipt_document(booking):
+    """Returns (html, title, lines) for a paid booking row."""
+    generated_at = datetime.now()
+    amount = booking['amount_paid'] if booking['amount_paid'] is not None else booking['tour_price'] * booking['num_participants']
+    html = render_template(
+        'pdf_receipt_template.html', booking=booking, final_amount_display=amount, generated_at=generated_at
+    )
+    lines = [
+        f"For Tour Booking ID: #{booking['id']}",
+        f"Date Generated: {generated_at:%Y-%m-%d %H:%M:%S}",
+        '',
+        'Customer Details',
+        f"Customer Name: {booking['customer_name']}",
+        f"Customer Email: {booking['customer_email']}",
+    ]
+    if booking['phone_number_paid']:
+        lines.append(f"Phone Number (Paid From): {booking['phone_number_paid']}")
+    lines += [
+        '',
+        'Booking Details',
+        f"Tour Name: {booking['tour_name']}",
+        f"Tour Date: {booking['tour_date']}",
+        f"Number of Participants: {booking['num_participants']}",
+        f"Booking Date: {booking['booking_date']}",
+        f"Payment Status: {booking['payment_status'].capitalize()}",
+        '',
+        'Payment Summary',
+        f"Tour Fee (x{booking['num_participants']} participants), unit price KES {booking['tour_price']:.2f}",
+        f"M-Pesa Receipt Number: {booking['mpesa_receipt'] or 'N/A'}",
+        f"Total Amount Paid: KES {amount:.2f}",
+        '',
+        'Thank you for your booking! We look forward to seeing you on the tour.',
+    ]
+    return html, 'Payment Receipt', lines
+
+def schedule_receipt(booking, force=False):
+    """Renders a paid booking's receipt in the process pool unless it is already cached.
+
+    Returns a future resolving to the file path, or None if the cached
+    file is current. Renders of the same file already under way are shared.
+    """
+    app = current_app._get_current_object()
+    path = receipt_path(app, booking)
+    if not force and os.path.exists(path):
+        return None
+    executor = _get_executor(app)
+    with _executor_lock:
+        future = _in_flight.get(path)
+        if future is not None:
+            return future
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        future = executor.submit(render_receipt, *_receipt_document(booking), path)
+        _in_flight[path] = future
+
+    def done(future):
+        with _executor_lock:
+            _in_flight.pop(path, None)
+        try:
+            future.result()
+        except Exception as e:
+            app.logger.error(f"Error rendering receipt for booking {booking['id']}: {e}", exc_info=True)
+
+    future.add_done_callback(done)
+    return future
+
+def schedule_receipt_for(booking_id):
+    """Queues a receipt for a booking that has just been paid (called after commit)."""
+    booking = get_db().execute(RECEIPT_QUERY, (booking_id,)).fetchone()
+    if booking is not None and booking['payment_status'] == 'paid':
+        schedule_receipt(booking)
+
+def receipt_file(booking):
+    """Returns the cached receipt's path, rendering it first (and waiting) if needed."""
+    future = schedule_receipt(booking)
+    if future is not None:
+        future.result(timeout=current_app.config.get('RECEIPT_RENDER_TIMEOUT', 30))
+    return receipt_path(current_app, booking)
+
+
+@click.command('build-receipts')
+@click.argument('tour_id', type=int)
+@click.option('--missing-only', is_flag=True, help='Skip bookings whose receipt is already cached.')
+def build_receipts_command(tour_id, missing_only):
+    """Regenerate PDF receipts for every paid booking on a tour, in parallel."""
+    bookings = get_db().execute(
+        RECEIPT_QUERY.replace('WHERE b.id = ?', "WHERE b.tour_id = ? AND b.payment_status = 'paid'"), (tour_id,)
+    ).fetchall()
+    futures = [f for f in (schedule_receipt(booking, force=not missing_only) for booking in bookings) if f is not None]
+    failed = 0
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            failed += 1 # Logged by the done callback
+    shutdown_executor()
+    click.echo(f'Rendered {len(futures) - failed} receipts for tour {tour_id} ({len(bookings) - len(futures)} already cached, {failed} failed).')
+    if failed:
+        raise click.exceptions.Exit(1)
+
+def init_app(app):
+    """Register the receipt batch command with the Flask app."""
+    app.cli.add_command(build_receipts_command)
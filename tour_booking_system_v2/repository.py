@@ -0,0 +1,212 @@
+from .pagination import keyset_page
+
+# The queries behind app.py's routes. Each takes the request's connection
+# (get_db()) and leaves committing to the caller, so a route can combine
+# several in one transaction. The SQL is written once, in SQLite's dialect
+# with ? placeholders; storage.translate adapts it for other backends.
+
+
+# --- Users ---
+def username_taken(db, username):
+    return db.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone() is not None
+
+def email_taken(db, email):
+    return db.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone() is not None
+
+def create_user(db, username, email, password_hash, is_admin=0):
+    db.execute(
+        'INSERT INTO users (username, email, password, is_admin) VALUES (?, ?, ?, ?)',
+        (username, email, password_hash, is_admin)
+    )
+
+def find_user_by_username(db, username):
+    return db.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+
+def set_password_hash(db, user_id, password_hash):
+    db.execute('UPDATE users SET password = ? WHERE id = ?', (password_hash, user_id))
+
+def toggle_admin(db, user_id):
+    """Flips a user's admin flag. Returns the new flag, or None if the user does not exist."""
+    user = db.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
+    if user is None:
+        return None
+    new_status = 1 if user['is_admin'] == 0 else 0
+    db.execute('UPDATE users SET is_admin = ? WHERE id = ?', (new_status, user_id))
+    return new_status
+
+def delete_user(db, user_id):
+    db.execute('DELETE FROM users WHERE id = ?', (user_id,))
+
+def users_page(db):
+    return keyset_page(
+        db,
+        "SELECT id, username, email, is_admin FROM users",
+        (),
+        order_by=('id',),
+        row_key=lambda row: (row['id'],),
+        descending=False
+    )
+
+
+# --- Tours ---
+def get_tour(db, tour_id):
+    return db.execute('SELECT * FROM tours WHERE id = ?', (tour_id,)).fetchone()
+
+def all_tours(db):
+    return db.execute("SELECT * FROM tours ORDER BY date DESC").fetchall()
+
+def tour_choices(db):
+    """(id, name) of every tour, for the admin filters and pickers."""
+    return db.execute("SELECT id, name FROM tours ORDER BY name ASC").fetchall()
+
+def create_tour(db, name, description, price, date, max_participants, status):
+    db.execute(
+        'INSERT INTO tours (name, description, price, date, max_participants, status, current_participants) VALUES (?, ?, ?, ?, ?, ?, 0)',
+        (name, description, price, date, max_participants, status)
+    )
+
+def booked_seats(db, tour_id):
+    """Seats sold plus seats held by unpaid bookings, or None if the tour does not exist."""
+    row = db.execute('SELECT current_participants + held_participants AS booked FROM tours WHERE id = ?', (tour_id,)).fetchone()
+    return row['booked'] if row else None
+
+def update_tour(db, tour_id, name, description, price, date, max_participants, status):
+    db.execute(
+        'UPDATE tours SET name = ?, description = ?, price = ?, date = ?, max_participants = ?, status = ? WHERE id = ?',
+        (name, description, price, date, max_participants, status, tour_id)
+    )
+
+def delete_tour(db, tour_id):
+    db.execute('DELETE FROM tours WHERE id = ?', (tour_id,))
+
+
+# --- Bookings ---
+def user_booking(db, booking_id, user_id):
+    """A booking with its tour, if it belongs to ``user_id``."""
+    return db.execute(
+        'SELECT b.id, b.num_participants, b.payment_status, b.booking_date, '
+        'b.customer_name, b.customer_email, '
+        'b.mpesa_receipt, b.amount_paid, b.phone_number_paid, ' # Include M-Pesa specific fields
+        't.name AS tour_name, t.description, t.price, t.date AS tour_date '
+        'FROM bookings b JOIN tours t ON b.tour_id = t.id '
+        'WHERE b.id = ? AND b.user_id = ?',
+        (booking_id, user_id)
+    ).fetchone()
+
+def user_booking_status(db, booking_id, user_id):
+    return db.execute(
+        'SELECT payment_status FROM bookings WHERE id = ? AND user_id = ?', (booking_id, user_id)
+    ).fetchone()
+
+def booking_for_payment(db, booking_id, user_id):
+    """What the STK push needs: amount inputs, tour name and current status."""
+    return db.execute(
+        'SELECT b.id, b.tour_id, b.num_participants, b.payment_status, t.price, t.name AS tour_name '
+        'FROM bookings b JOIN tours t ON b.tour_id = t.id WHERE b.id = ? AND b.user_id = ?',
+        (booking_id, user_id)
+    ).fetchone()
+
+def record_stk_push(db, checkout_request_id, booking_id, requested_at):
+    """Remembers which booking an STK push was for; its callback only carries the CheckoutRequestID."""
+    db.execute(
+        'INSERT INTO stk_pushes (checkout_request_id, booking_id, requested_at) VALUES (?, ?, ?)',
+        (checkout_request_id, booking_id, requested_at)
+    )
+
+def last_stk_push_at(db, booking_id):
+    """Unix time of the booking's latest STK push, or None if it was never sent one."""
+    return db.execute(
+        'SELECT MAX(requested_at) FROM stk_pushes WHERE booking_id = ?', (booking_id,)
+    ).fetchone()[0]
+
+def user_bookings_page(db, user_id, payment_status=None):
+    where, params = ['b.user_id = ?'], [user_id]
+    if payment_status:
+        where.append('b.payment_status = ?')
+        params.append(payment_status)
+    return keyset_page(
+        db,
+        'SELECT b.id, b.num_participants, b.booking_date, b.payment_status, '
+        't.name AS tour_name, t.price AS tour_price, t.date AS tour_date '
+        'FROM bookings b JOIN tours t ON b.tour_id = t.id',
+        params,
+        order_by=('b.booking_date', 'b.id'),
+        row_key=lambda row: (row['booking_date'], row['id']),
+        where=where
+    )
+
+def bookings_page(db, where, params):
+    """The admin bookings listing; ``where``/``params`` come from pagination.booking_filters."""
+    return keyset_page(
+        db,
+        """
+        SELECT
+            b.id AS booking_id,
+            b.customer_name,
+            b.customer_email,
+            b.num_participants,
+            b.booking_date,
+            b.payment_status,
+            b.mpesa_receipt,       -- NEW: M-Pesa transaction ID
+            b.amount_paid,         -- NEW: Actual amount paid via M-Pesa
+            b.phone_number_paid,   -- NEW: Phone number that made the payment
+            t.name AS tour_name,
+            t.date AS tour_date,
+            u.username AS booked_by_username
+        FROM bookings b
+        JOIN tours t ON b.tour_id = t.id
+        LEFT JOIN users u ON b.user_id = u.id
+        """,
+        params,
+        order_by=('b.booking_date', 'b.id'),
+        row_key=lambda row: (row['booking_date'], row['booking_id']),
+        where=where
+    )
+
+def dashboard_counts(db):
+    """The admin dashboard totals, in one round trip."""
+    return db.execute(
+        'SELECT (SELECT COUNT(id) FROM tours) AS total_tours, '
+        '(SELECT COUNT(id) FROM users) AS total_users, '
+        '(SELECT COUNT(id) FROM bookings) AS total_bookings, '
+        "(SELECT COUNT(id) FROM bookings WHERE payment_status = 'paid') AS paid_bookings, "
+        "(SELECT COUNT(id) FROM bookings WHERE payment_status = 'pending') AS pending_bookings"
+    ).fetchone()
+
+
+# --- Memories ---
+MEMORY_ORDER = ('m.memory_date', 'm.id') # memories_page sort key, newest first
+
+def memories_page(db, tour_id=None):
+    where, params = [], []
+    if tour_id:
+        where.append('m.tour_id = ?')
+        params.append(tour_id)
+    return keyset_page(
+        db,
+        "SELECT m.*, t.name AS tour_name FROM memories m LEFT JOIN tours t ON m.tour_id = t.id",
+        params,
+        order_by=MEMORY_ORDER,
+        row_key=lambda row: (row['memory_date'], row['id']),
+        where=where
+    )
+
+def create_memory(db, title, description, image_filename, tour_id, memory_date):
+    """Inserts a memory and returns its id."""
+    return db.execute(
+        'INSERT INTO memories (title, description, image_filename, tour_id, memory_date) VALUES (?, ?, ?, ?, ?)',
+        (title, description, image_filename, tour_id, memory_date)
+    ).lastrowid
+
+def update_memory(db, memory_id, title, description, image_filename, tour_id, memory_date):
+    db.execute(
+        'UPDATE memories SET title = ?, description = ?, image_filename = ?, tour_id = ?, memory_date = ? WHERE id = ?',
+        (title, description, image_filename, tour_id, memory_date, memory_id)
+    )
+
+def memory_image(db, memory_id):
+    row = db.execute('SELECT image_filename FROM memories WHERE id = ?', (memory_id,)).fetchone()
+    return row['image_filename'] if row else None
+
+def delete_memory(db, memory_id):
+    db.execute('DELETE FROM memories WHERE id = ?', (memory_id,))
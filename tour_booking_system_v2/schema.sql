@@ -2,6 +2,17 @@ DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS tours;
 DROP TABLE IF EXISTS bookings;
 DROP TABLE IF EXISTS memories;
+DROP TABLE IF EXISTS seat_holds;
+DROP TABLE IF EXISTS inbound_events;
+DROP TABLE IF EXISTS email_outbox;
+DROP TABLE IF EXISTS memory_images;
+DROP TABLE IF EXISTS catalog_state;
+DROP TABLE IF EXISTS bookings_archive;
+DROP TABLE IF EXISTS tours_fts;
+DROP TABLE IF EXISTS memories_fts;
+DROP TABLE IF EXISTS tour_availability;
+DROP TABLE IF EXISTS availability_state;
+DROP TABLE IF EXISTS stk_pushes;
 
 CREATE TABLE users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -19,6 +30,7 @@ CREATE TABLE tours (
     date TEXT NOT NULL,
     max_participants INTEGER NOT NULL,
     current_participants INTEGER DEFAULT 0,
+    held_participants INTEGER DEFAULT 0, -- Seats reserved by unpaid bookings (see seat_holds)
     status TEXT DEFAULT 'available'
 );
 
@@ -30,7 +42,7 @@ CREATE TABLE bookings (
     customer_email TEXT NOT NULL,
     num_participants INTEGER NOT NULL,
     booking_date TEXT DEFAULT CURRENT_TIMESTAMP,
-    payment_status TEXT DEFAULT 'pending', -- 'pending', 'paid', 'failed', 'refunded'
+    payment_status TEXT DEFAULT 'pending', -- 'pending', 'paid', 'failed', 'expired', 'refund_due', 'refunded'
     mpesa_receipt TEXT,                   -- NEW: Stores the M-Pesa transaction ID (e.g., RJ67R923H)
     amount_paid REAL,                     -- NEW: Stores the actual amount paid via M-Pesa
     phone_number_paid TEXT,               -- NEW: Stores the phone number that initiated the payment
@@ -48,6 +60,225 @@ CREATE TABLE memories (
     FOREIGN KEY (tour_id) REFERENCES tours (id)
 );
 
+CREATE TABLE seat_holds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tour_id INTEGER NOT NULL,
+    booking_id INTEGER NOT NULL UNIQUE,
+    seats INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL, -- Unix timestamp after which the seats go back on sale
+    status TEXT DEFAULT 'held',  -- 'held', 'converted', 'released'
+    FOREIGN KEY (tour_id) REFERENCES tours (id),
+    FOREIGN KEY (booking_id) REFERENCES bookings (id)
+);
+
+CREATE INDEX idx_seat_holds_status_expires ON seat_holds (status, expires_at);
+CREATE INDEX idx_seat_holds_tour_status_expires ON seat_holds (tour_id, status, expires_at);
+
+-- Webhook payloads are persisted here and applied by the callback workers
+CREATE TABLE inbound_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,          -- e.g. 'mpesa_stk'
+    payload TEXT NOT NULL,         -- Raw JSON body as received
+    status TEXT DEFAULT 'queued',  -- 'queued', 'processing', 'done', 'failed'
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    received_at REAL NOT NULL,     -- Unix timestamps (seconds)
+    available_at REAL NOT NULL,    -- Not retried before this time (backoff)
+    claimed_at REAL,
+    processed_at REAL
+);
+
+CREATE INDEX idx_inbound_events_status_available ON inbound_events (status, available_at);
+
+-- Emails are written here in the same transaction as the change they announce
+CREATE TABLE email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    html TEXT NOT NULL,
+    status TEXT DEFAULT 'pending', -- 'pending', 'sending', 'sent', 'failed'
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,      -- Unix timestamps (seconds)
+    next_attempt_at REAL NOT NULL, -- Not retried before this time (backoff)
+    claimed_at REAL,
+    sent_at REAL
+);
+
+CREATE INDEX idx_email_outbox_status_next ON email_outbox (status, next_attempt_at);
+
+-- Indexes for the catalog and admin queries that `flask check-query-plans`
+-- found doing full table scans plus a temp B-tree sort.
+CREATE INDEX idx_tours_status_date ON tours (status, date); -- /tours, /coming_soon, /done_tours
+CREATE INDEX idx_tours_date ON tours (date);                -- Admin tour list
+CREATE UNIQUE INDEX idx_tours_name_date ON tours (name, date); -- Upsert key for bulk imports; also serves tour pickers
+
+-- Keyset pagination indexes: each listing seeks on (filter column, sort key, id)
+CREATE INDEX idx_bookings_date ON bookings (booking_date, id);
+CREATE INDEX idx_bookings_user_date ON bookings (user_id, booking_date, id);
+CREATE INDEX idx_bookings_status_date ON bookings (payment_status, booking_date, id);
+CREATE INDEX idx_bookings_tour_date ON bookings (tour_id, booking_date, id);
+CREATE INDEX idx_memories_date ON memories (memory_date, id);
+CREATE INDEX idx_memories_tour_date ON memories (tour_id, memory_date, id);
+
+-- Cold storage for failed and expired bookings moved out by `flask sweep-bookings`.
+-- Rows keep their original id; archived_at is a Unix timestamp.
+CREATE TABLE bookings_archive (
+    id INTEGER PRIMARY KEY,
+    tour_id INTEGER NOT NULL,
+    user_id INTEGER,
+    customer_name TEXT NOT NULL,
+    customer_email TEXT NOT NULL,
+    num_participants INTEGER NOT NULL,
+    booking_date TEXT,
+    payment_status TEXT,
+    mpesa_receipt TEXT,
+    amount_paid REAL,
+    phone_number_paid TEXT,
+    archived_at REAL NOT NULL
+);
+
+-- Resized, EXIF-free derivatives of each memory's image (see images.py)
+CREATE TABLE memory_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    memory_id INTEGER NOT NULL,
+    format TEXT NOT NULL,   -- 'jpeg', 'webp', 'avif'
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    filename TEXT NOT NULL, -- Relative to static/images/variants/
+    FOREIGN KEY (memory_id) REFERENCES memories (id)
+);
+
+CREATE INDEX idx_memory_images_memory ON memory_images (memory_id, width);
+
+-- Version counter for the catalog page cache (see catalog.py). Every change
+-- that shows up on /tours, /coming_soon, /done_tours or /memories bumps it,
+-- whichever code path (admin form, payment callback, CLI) made the change.
+CREATE TABLE catalog_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL DEFAULT 0 -- Unix timestamp (seconds) of the last change, for Last-Modified
+);
+
+-- Seeded from the clock so a re-created database never reuses cache keys
+INSERT INTO catalog_state (id, version, updated_at) VALUES (1, CAST(strftime('%s', 'now') AS INTEGER) * 1000, CAST(strftime('%s', 'now') AS INTEGER));
+
+CREATE TRIGGER tours_catalog_insert AFTER INSERT ON tours
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER tours_catalog_delete AFTER DELETE ON tours
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+-- held_participants is left out: seat holds come and go with every checkout
+-- and the public pages only show sold seats
+CREATE TRIGGER tours_catalog_update
+AFTER UPDATE OF name, description, price, date, max_participants, current_participants, status ON tours
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+
+CREATE TRIGGER memories_catalog_insert AFTER INSERT ON memories
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER memories_catalog_delete AFTER DELETE ON memories
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER memories_catalog_update AFTER UPDATE ON memories
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+
+CREATE TRIGGER memory_images_catalog_insert AFTER INSERT ON memory_images
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+CREATE TRIGGER memory_images_catalog_delete AFTER DELETE ON memory_images
+BEGIN UPDATE catalog_state SET version = version + 1, updated_at = CAST(strftime('%s', 'now') AS INTEGER); END;
+
+-- Full-text search over tours and memories (see search.py). The FTS5 tables
+-- only index the text; the rows stay in tours/memories (external content)
+-- and triggers keep both in step. prefix='2 3' makes short prefixes cheap.
+CREATE VIRTUAL TABLE tours_fts USING fts5(
+    name, description, content='tours', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE VIRTUAL TABLE memories_fts USING fts5(
+    title, description, content='memories', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+-- ORDER BY rank: a hit in the name/title counts ten times one in the description
+INSERT INTO tours_fts (tours_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+INSERT INTO memories_fts (memories_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+
+CREATE TRIGGER tours_fts_insert AFTER INSERT ON tours BEGIN
+    INSERT INTO tours_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+END;
+CREATE TRIGGER tours_fts_delete AFTER DELETE ON tours BEGIN
+    INSERT INTO tours_fts (tours_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+END;
+CREATE TRIGGER tours_fts_update AFTER UPDATE OF name, description ON tours BEGIN
+    INSERT INTO tours_fts (tours_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO tours_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+END;
+
+CREATE TRIGGER memories_fts_insert AFTER INSERT ON memories BEGIN
+    INSERT INTO memories_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+CREATE TRIGGER memories_fts_delete AFTER DELETE ON memories BEGIN
+    INSERT INTO memories_fts (memories_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+END;
+CREATE TRIGGER memories_fts_update AFTER UPDATE OF title, description ON memories BEGIN
+    INSERT INTO memories_fts (memories_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    INSERT INTO memories_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+
+-- Remaining seats per tour date for /api/availability (see availability.py).
+-- Triggers on tours keep it in step inside the same transaction as the
+-- seat hold, payment callback or admin edit that changed the seats.
+-- Keyed by (date, tour_id) without a rowid, so a date range is one
+-- contiguous read of the table itself.
+CREATE TABLE tour_availability (
+    date TEXT NOT NULL,
+    tour_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    seats_total INTEGER NOT NULL,
+    seats_left INTEGER NOT NULL, -- max_participants minus sold and held seats
+    version INTEGER NOT NULL, -- availability_state.version when the row last changed, for ETags
+    PRIMARY KEY (date, tour_id)
+) WITHOUT ROWID;
+
+-- Unlike catalog_state this also moves when seat holds come and go
+CREATE TABLE availability_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+
+-- Seeded from the clock so a re-created database never reuses ETags
+INSERT INTO availability_state (id, version) VALUES (1, CAST(strftime('%s', 'now') AS INTEGER) * 1000);
+
+CREATE TRIGGER tours_availability_insert AFTER INSERT ON tours BEGIN
+    UPDATE availability_state SET version = version + 1;
+    INSERT INTO tour_availability (date, tour_id, status, seats_total, seats_left, version)
+    VALUES (new.date, new.id, COALESCE(new.status, 'available'), new.max_participants,
+            MAX(new.max_participants - COALESCE(new.current_participants, 0) - COALESCE(new.held_participants, 0), 0),
+            (SELECT version FROM availability_state));
+END;
+CREATE TRIGGER tours_availability_delete AFTER DELETE ON tours BEGIN
+    DELETE FROM tour_availability WHERE date = old.date AND tour_id = old.id;
+END;
+CREATE TRIGGER tours_availability_update
+AFTER UPDATE OF date, max_participants, current_participants, held_participants, status ON tours BEGIN
+    UPDATE availability_state SET version = version + 1;
+    DELETE FROM tour_availability WHERE date = old.date AND tour_id = old.id;
+    INSERT INTO tour_availability (date, tour_id, status, seats_total, seats_left, version)
+    VALUES (new.date, new.id, COALESCE(new.status, 'available'), new.max_participants,
+            MAX(new.max_participants - COALESCE(new.current_participants, 0) - COALESCE(new.held_participants, 0), 0),
+            (SELECT version FROM availability_state));
+END;
+
+-- Every STK push the app sent, keyed by the CheckoutRequestID Daraja
+-- returned. Daraja's callbacks carry that ID (and not the AccountReference),
+-- so this is how a callback finds its booking. A booking can have several
+-- pushes (the customer retried), and any of them may be the one paid.
+CREATE TABLE stk_pushes (
+    checkout_request_id TEXT PRIMARY KEY,
+    booking_id INTEGER NOT NULL,
+    requested_at INTEGER NOT NULL, -- Unix timestamp
+    FOREIGN KEY (booking_id) REFERENCES bookings (id)
+) WITHOUT ROWID;
+
+CREATE INDEX idx_stk_pushes_booking ON stk_pushes (booking_id);
+
 -- Insert some sample data
 INSERT INTO users (username, email, password, is_admin) VALUES
 ('admin', 'admin@example.com', 'scrypt:32768:8:1$NyZQ2qyuxKpLJBFN$b8acf4b044d9c04e4dd441b64218cb66711c0e7b25b411ea2cae7a6cfcd8f47ecf199698ce317ccacb8ea7257150e1ade56d7c9ef03461c0e1609a969f3a811b', 1), -- Hashed password for 'admin254d'
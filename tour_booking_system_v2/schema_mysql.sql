@@ -0,0 +1,273 @@
+-- schema.sql for MySQL 8.0 (DATABASE_URL=mysql+mysqlconnector://...).
+-- Run by `flask init-db`, or by the mysql container on first start (see
+-- docker-compose.yml). Keep it in step with schema.sql; the differences are:
+--   * Dates stay strings (VARCHAR), so the app compares and pages them
+--     exactly as it does on SQLite.
+--   * No FOREIGN KEY constraints: SQLite never enforced them (foreign_keys
+--     is off), and the app deletes tours and users without cascading.
+--   * Triggers have no UPDATE OF <columns>; they compare OLD and NEW instead.
+--   * No FTS5 tables: search.py falls back to LIKE on this backend.
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS tours;
+DROP TABLE IF EXISTS bookings;
+DROP TABLE IF EXISTS memories;
+DROP TABLE IF EXISTS seat_holds;
+DROP TABLE IF EXISTS inbound_events;
+DROP TABLE IF EXISTS email_outbox;
+DROP TABLE IF EXISTS memory_images;
+DROP TABLE IF EXISTS catalog_state;
+DROP TABLE IF EXISTS bookings_archive;
+DROP TABLE IF EXISTS tour_availability;
+DROP TABLE IF EXISTS availability_state;
+DROP TABLE IF EXISTS stk_pushes;
+
+CREATE TABLE users (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    username VARCHAR(191) NOT NULL UNIQUE,
+    email VARCHAR(191) NOT NULL UNIQUE,
+    password VARCHAR(255) NOT NULL,
+    is_admin INT DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE tours (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(191) NOT NULL,
+    description TEXT,
+    price DOUBLE NOT NULL,
+    date VARCHAR(32) NOT NULL,
+    max_participants INT NOT NULL,
+    current_participants INT DEFAULT 0,
+    held_participants INT DEFAULT 0, -- Seats reserved by unpaid bookings (see seat_holds)
+    status VARCHAR(32) DEFAULT 'available'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE bookings (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    tour_id INT NOT NULL,
+    user_id INT,
+    customer_name VARCHAR(255) NOT NULL,
+    customer_email VARCHAR(255) NOT NULL,
+    num_participants INT NOT NULL,
+    booking_date VARCHAR(32) DEFAULT (DATE_FORMAT(UTC_TIMESTAMP(), '%Y-%m-%d %H:%i:%s')), -- CURRENT_TIMESTAMP as SQLite writes it
+    payment_status VARCHAR(32) DEFAULT 'pending', -- 'pending', 'paid', 'failed', 'expired', 'refund_due', 'refunded'
+    mpesa_receipt VARCHAR(64),
+    amount_paid DOUBLE,
+    phone_number_paid VARCHAR(32)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE memories (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    description TEXT,
+    image_filename VARCHAR(255) NOT NULL,
+    tour_id INT,
+    memory_date VARCHAR(32) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE seat_holds (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    tour_id INT NOT NULL,
+    booking_id INT NOT NULL UNIQUE,
+    seats INT NOT NULL,
+    expires_at BIGINT NOT NULL, -- Unix timestamp after which the seats go back on sale
+    status VARCHAR(16) DEFAULT 'held' -- 'held', 'converted', 'released'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE INDEX idx_seat_holds_status_expires ON seat_holds (status, expires_at);
+CREATE INDEX idx_seat_holds_tour_status_expires ON seat_holds (tour_id, status, expires_at);
+
+-- Webhook payloads are persisted here and applied by the callback workers
+CREATE TABLE inbound_events (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    source VARCHAR(64) NOT NULL,
+    payload MEDIUMTEXT NOT NULL,
+    status VARCHAR(16) DEFAULT 'queued', -- 'queued', 'processing', 'done', 'failed'
+    attempts INT DEFAULT 0,
+    last_error TEXT,
+    received_at DOUBLE NOT NULL, -- Unix timestamps (seconds)
+    available_at DOUBLE NOT NULL,
+    claimed_at DOUBLE,
+    processed_at DOUBLE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE INDEX idx_inbound_events_status_available ON inbound_events (status, available_at);
+
+-- Emails are written here in the same transaction as the change they announce
+CREATE TABLE email_outbox (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    recipient VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    html MEDIUMTEXT NOT NULL,
+    status VARCHAR(16) DEFAULT 'pending', -- 'pending', 'sending', 'sent', 'failed'
+    attempts INT DEFAULT 0,
+    last_error TEXT,
+    created_at DOUBLE NOT NULL, -- Unix timestamps (seconds)
+    next_attempt_at DOUBLE NOT NULL,
+    claimed_at DOUBLE,
+    sent_at DOUBLE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE INDEX idx_email_outbox_status_next ON email_outbox (status, next_attempt_at);
+
+CREATE INDEX idx_tours_status_date ON tours (status, date);
+CREATE INDEX idx_tours_date ON tours (date);
+CREATE UNIQUE INDEX idx_tours_name_date ON tours (name, date); -- Upsert key for bulk imports (ON DUPLICATE KEY)
+
+CREATE INDEX idx_bookings_date ON bookings (booking_date, id);
+CREATE INDEX idx_bookings_user_date ON bookings (user_id, booking_date, id);
+CREATE INDEX idx_bookings_status_date ON bookings (payment_status, booking_date, id);
+CREATE INDEX idx_bookings_tour_date ON bookings (tour_id, booking_date, id);
+CREATE INDEX idx_memories_date ON memories (memory_date, id);
+CREATE INDEX idx_memories_tour_date ON memories (tour_id, memory_date, id);
+
+CREATE TABLE bookings_archive (
+    id INT PRIMARY KEY,
+    tour_id INT NOT NULL,
+    user_id INT,
+    customer_name VARCHAR(255) NOT NULL,
+    customer_email VARCHAR(255) NOT NULL,
+    num_participants INT NOT NULL,
+    booking_date VARCHAR(32),
+    payment_status VARCHAR(32),
+    mpesa_receipt VARCHAR(64),
+    amount_paid DOUBLE,
+    phone_number_paid VARCHAR(32),
+    archived_at DOUBLE NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE memory_images (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    memory_id INT NOT NULL,
+    format VARCHAR(16) NOT NULL, -- 'jpeg', 'webp', 'avif'
+    width INT NOT NULL,
+    height INT NOT NULL,
+    filename VARCHAR(255) NOT NULL -- Relative to static/images/variants/
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE INDEX idx_memory_images_memory ON memory_images (memory_id, width);
+
+-- Version counter for the catalog page cache (see catalog.py)
+CREATE TABLE catalog_state (
+    id INT PRIMARY KEY CHECK (id = 1),
+    version BIGINT NOT NULL,
+    updated_at BIGINT NOT NULL DEFAULT 0 -- Unix timestamp (seconds) of the last change, for Last-Modified
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT INTO catalog_state (id, version, updated_at) VALUES (1, UNIX_TIMESTAMP() * 1000, UNIX_TIMESTAMP());
+
+-- Remaining seats per tour date for /api/availability (see availability.py).
+-- InnoDB clusters rows by primary key, so a date range is one contiguous read.
+CREATE TABLE tour_availability (
+    date VARCHAR(32) NOT NULL,
+    tour_id INT NOT NULL,
+    status VARCHAR(32) NOT NULL,
+    seats_total INT NOT NULL,
+    seats_left INT NOT NULL, -- max_participants minus sold and held seats
+    version BIGINT NOT NULL, -- availability_state.version when the row last changed, for ETags
+    PRIMARY KEY (date, tour_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE availability_state (
+    id INT PRIMARY KEY CHECK (id = 1),
+    version BIGINT NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT INTO availability_state (id, version) VALUES (1, UNIX_TIMESTAMP() * 1000);
+
+-- STK pushes by Daraja's CheckoutRequestID, which is what callbacks carry
+CREATE TABLE stk_pushes (
+    checkout_request_id VARCHAR(64) PRIMARY KEY,
+    booking_id INT NOT NULL,
+    requested_at BIGINT NOT NULL -- Unix timestamp
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE INDEX idx_stk_pushes_booking ON stk_pushes (booking_id);
+
+DELIMITER //
+
+CREATE TRIGGER tours_catalog_insert AFTER INSERT ON tours FOR EACH ROW
+BEGIN
+    UPDATE catalog_state SET version = version + 1, updated_at = UNIX_TIMESTAMP() WHERE id = 1;
+END//
+CREATE TRIGGER tours_catalog_delete AFTER DELETE ON tours FOR EACH ROW
+BEGIN
+    UPDATE catalog_state SET version = version + 1, updated_at = UNIX_TIMESTAMP() WHERE id = 1;
+END//
+-- held_participants is left out: seat holds come and go with every checkout
+CREATE TRIGGER tours_catalog_update AFTER UPDATE ON tours FOR EACH ROW
+BEGIN
+    IF NOT (OLD.name <=> NEW.name AND OLD.description <=> NEW.description AND OLD.price <=> NEW.price
+            AND OLD.date <=> NEW.date AND OLD.max_participants <=> NEW.max_participants
+            AND OLD.current_participants <=> NEW.current_participants AND OLD.status <=> NEW.status) THEN
+        UPDATE catalog_state SET version = version + 1, updated_at = UNIX_TIMESTAMP() WHERE id = 1;
+    END IF;
+END//
+
+CREATE TRIGGER memories_catalog_insert AFTER INSERT ON memories FOR EACH ROW
+BEGIN
+    UPDATE catalog_state SET version = version + 1, updated_at = UNIX_TIMESTAMP() WHERE id = 1;
+END//
+CREATE TRIGGER memories_catalog_delete AFTER DELETE ON memories FOR EACH ROW
+BEGIN
+    UPDATE catalog_state SET version = version + 1, updated_at = UNIX_TIMESTAMP() WHERE id = 1;
+END//
+CREATE TRIGGER memories_catalog_update AFTER UPDATE ON memories FOR EACH ROW
+BEGIN
+    UPDATE catalog_state SET version = version + 1, updated_at = UNIX_TIMESTAMP() WHERE id = 1;
+END//
+
+CREATE TRIGGER memory_images_catalog_insert AFTER INSERT ON memory_images FOR EACH ROW
+BEGIN
+    UPDATE catalog_state SET version = version + 1, updated_at = UNIX_TIMESTAMP() WHERE id = 1;
+END//
+CREATE TRIGGER memory_images_catalog_delete AFTER DELETE ON memory_images FOR EACH ROW
+BEGIN
+    UPDATE catalog_state SET version = version + 1, updated_at = UNIX_TIMESTAMP() WHERE id = 1;
+END//
+
+CREATE TRIGGER tours_availability_insert AFTER INSERT ON tours FOR EACH ROW
+BEGIN
+    UPDATE availability_state SET version = version + 1 WHERE id = 1;
+    INSERT INTO tour_availability (date, tour_id, status, seats_total, seats_left, version)
+    VALUES (NEW.date, NEW.id, COALESCE(NEW.status, 'available'), NEW.max_participants,
+            GREATEST(NEW.max_participants - COALESCE(NEW.current_participants, 0) - COALESCE(NEW.held_participants, 0), 0),
+            (SELECT version FROM availability_state WHERE id = 1));
+END//
+CREATE TRIGGER tours_availability_delete AFTER DELETE ON tours FOR EACH ROW
+BEGIN
+    DELETE FROM tour_availability WHERE date = OLD.date AND tour_id = OLD.id;
+END//
+CREATE TRIGGER tours_availability_update AFTER UPDATE ON tours FOR EACH ROW
+BEGIN
+    IF NOT (OLD.date <=> NEW.date AND OLD.max_participants <=> NEW.max_participants
+            AND OLD.current_participants <=> NEW.current_participants
+            AND OLD.held_participants <=> NEW.held_participants AND OLD.status <=> NEW.status) THEN
+        UPDATE availability_state SET version = version + 1 WHERE id = 1;
+        DELETE FROM tour_availability WHERE date = OLD.date AND tour_id = OLD.id;
+        INSERT INTO tour_availability (date, tour_id, status, seats_total, seats_left, version)
+        VALUES (NEW.date, NEW.id, COALESCE(NEW.status, 'available'), NEW.max_participants,
+                GREATEST(NEW.max_participants - COALESCE(NEW.current_participants, 0) - COALESCE(NEW.held_participants, 0), 0),
+                (SELECT version FROM availability_state WHERE id = 1));
+    END IF;
+END//
+
+DELIMITER ;
+
+-- Insert some sample data
+-- Hashed passwords for 'admin254d' and 'testpass'
+INSERT INTO users (username, email, password, is_admin) VALUES
+('admin', 'admin@example.com', 'scrypt:32768:8:1$NyZQ2qyuxKpLJBFN$b8acf4b044d9c04e4dd441b64218cb66711c0e7b25b411ea2cae7a6cfcd8f47ecf199698ce317ccacb8ea7257150e1ade56d7c9ef03461c0e1609a969f3a811b', 1),
+('testuser', 'test@example.com', '$2b$12$s0S/U.r3fW1D5lR7r.Q.mOu/dD3oV0XpQ.gV2N.q.w.Q/z.f.x.y', 0);
+
+INSERT INTO tours (name, description, price, date, max_participants, status) VALUES
+('City Historical Walk', 'Explore the city''s rich history and landmarks.', 25.00, '2025-08-10', 20, 'available'),
+('Mountain Hiking Adventure', 'A challenging hike through scenic mountain trails.', 50.00, '2025-08-15', 15, 'available'),
+('Coastal Cycling Tour', 'Bike along the beautiful coastline with stunning views.', 35.00, '2025-08-20', 10, 'available'),
+('Foodie Tour', 'Discover local culinary delights and hidden gems.', 40.00, '2025-08-25', 12, 'available'),
+('Desert Safari (Coming Soon)', 'An exhilarating ride through the dunes.', 75.00, '2025-09-01', 8, 'coming_soon'),
+('Old Town Exploration (Done)', 'A nostalgic journey through the ancient streets.', 30.00, '2024-05-10', 25, 'done');
+
+INSERT INTO memories (title, description, image_filename, tour_id, memory_date) VALUES
+('Hiking Trail Views', 'Breathtaking vistas from the mountain hike.', 'mountain_hike.jpg', 2, '2024-06-15'),
+('Cycling by the Sea', 'Sunny day on the coastal path.', 'coastal_cycling.jpg', 3, '2024-07-20'),
+('Delicious Street Food', 'Tasting local delicacies.', 'foodie_tour.jpg', 4, '2024-08-01');
@@ -0,0 +1,200 @@
+import re
+from datetime import datetime
+
+import click
+from flask import current_app
+from markupsafe import Markup, escape
+
+from .database import get_db
+from .imports import TOUR_STATUSES
+from .storage import dialect_of
+
+SEARCH_KINDS = ('tours', 'memories')
+MAX_TERMS = 8
+MARK_OPEN, MARK_CLOSE = '\x02', '\x03' # Stand-ins for <mark> until the text has been escaped
+
+_TERM = re.compile(r'\w+')
+
+# ``{where}`` carries the filters. CROSS JOIN keeps the FTS index
+# as the outer loop: left to itself the planner may walk tours by status and
+# run the MATCH once per row.
+TOUR_FLOOR = (
+    'SELECT f.rowid FROM tours_fts f CROSS JOIN tours t ON t.id = f.rowid '
+    'WHERE tours_fts MATCH ?{where} ORDER BY f.rowid DESC LIMIT 1 OFFSET ?'
+)
+TOUR_SEARCH = (
+    'SELECT t.id, t.name, t.price, t.date, t.status, t.max_participants, t.current_participants, '
+    'highlight(tours_fts, 0, ?, ?) AS name_html, snippet(tours_fts, 1, ?, ?, ?, 16) AS snippet_html '
+    'FROM tours_fts f CROSS JOIN tours t ON t.id = f.rowid '
+    'WHERE tours_fts MATCH ? AND f.rowid >= ?{where} ORDER BY f.rank LIMIT ? OFFSET ?'
+)
+MEMORY_FLOOR = (
+    'SELECT f.rowid FROM memories_fts f CROSS JOIN memories m ON m.id = f.rowid '
+    'WHERE memories_fts MATCH ?{where} ORDER BY f.rowid DESC LIMIT 1 OFFSET ?'
+)
+MEMORY_SEARCH = (
+    'SELECT m.id, m.title, m.image_filename, m.tour_id, m.memory_date, t.name AS tour_name, '
+    'highlight(memories_fts, 0, ?, ?) AS title_html, snippet(memories_fts, 1, ?, ?, ?, 16) AS snippet_html '
+    'FROM memories_fts f CROSS JOIN memories m ON m.id = f.rowid LEFT JOIN tours t ON t.id = m.tour_id '
+    'WHERE memories_fts MATCH ? AND f.rowid >= ?{where} ORDER BY f.rank LIMIT ? OFFSET ?'
+)
+QUERIES = {'tours': (TOUR_FLOOR, TOUR_SEARCH), 'memories': (MEMORY_FLOOR, MEMORY_SEARCH)}
+HTML_COLUMNS = {'tours': ('name_html', 'snippet_html'), 'memories': ('title_html', 'snippet_html')}
+
+# Backends without FTS5 (see storage.py) match every word with LIKE, newest
+# first, and mark the matches in Python. {terms} is one condition per word.
+TOUR_LIKE_SEARCH = (
+    'SELECT t.id, t.name, t.price, t.date, t.status, t.max_participants, t.current_participants, '
+    't.name AS name_html, t.description AS snippet_html FROM tours t '
+    'WHERE {terms}{where} ORDER BY t.id DESC LIMIT ? OFFSET ?'
+)
+MEMORY_LIKE_SEARCH = (
+    'SELECT m.id, m.title, m.image_filename, m.tour_id, m.memory_date, t.name AS tour_name, '
+    'm.title AS title_html, m.description AS snippet_html '
+    'FROM memories m LEFT JOIN tours t ON t.id = m.tour_id '
+    'WHERE {terms}{where} ORDER BY m.id DESC LIMIT ? OFFSET ?'
+)
+LIKE_QUERIES = {
+    'tours': (TOUR_LIKE_SEARCH, '(t.name LIKE ? OR t.description LIKE ?)'),
+    'memories': (MEMORY_LIKE_SEARCH, '(m.title LIKE ? OR m.description LIKE ?)'),
+}
+SNIPPET_WORDS = 16
+
+
+def fts_query(text):
+    """Turns what a customer typed into a safe FTS5 expression, or None if it has no words.
+
+    Every word becomes a quoted prefix term (``"safar"*``), so FTS5 syntax in
+    the input is never interpreted and results show up while typing.
+    """
+    terms = _TERM.findall((text or '').lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_filters(args, kind):
+    """Turns ?status=&tour_id=&date_from=&date_to= into SQL conditions for ``kind``.
+
+    Returns (where, params, filters) like pagination.booking_filters.
+    Dates filter the tour date or the memory date.
+    """
+    where, params, filters = [], [], {}
+    if kind == 'tours':
+        status = args.get('status')
+        if status in TOUR_STATUSES:
+            where.append('t.status = ?')
+            params.append(status)
+            filters['status'] = status
+        date_column = 't.date'
+    else:
+        tour_id = args.get('tour_id', type=int)
+        if tour_id:
+            where.append('m.tour_id = ?')
+            params.append(tour_id)
+            filters['tour_id'] = tour_id
+        date_column = 'm.memory_date'
+
+    for key, op in (('date_from', '>='), ('date_to', '<=')):
+        value = args.get(key)
+        try:
+            datetime.strptime(value or '', '%Y-%m-%d')
+        except ValueError:
+            continue
+        where.append(f'{date_column} {op} ?')
+        params.append(value)
+        filters[key] = value
+    return where, params, filters
+
+def _marked(text):
+    """Escapes FTS5 highlight output, then turns the match markers into <mark> tags."""
+    return Markup(str(escape(text or '')).replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>'))
+
+def _highlight(text, terms, snippet=False):
+    """Adds the markers FTS5's highlight()/snippet() would have, for the LIKE fallback."""
+    pattern = re.compile('|'.join(re.escape(term) + r'\w*' for term in terms), re.IGNORECASE)
+    text = text or ''
+    if snippet:
+        words = text.split()
+        first = next((i for i, word in enumerate(words) if pattern.search(word)), 0)
+        start = max(0, min(first - SNIPPET_WORDS // 4, len(words) - SNIPPET_WORDS))
+        text = ('…' if start else '') + ' '.join(words[start:start + SNIPPET_WORDS])
+        if start + SNIPPET_WORDS < len(words):
+            text += '…'
+    return pattern.sub(lambda m: MARK_OPEN + m.group() + MARK_CLOSE, text)
+
+def _search_like(db, kind, terms, where, params, offset, limit):
+    """The LIKE fallback for search(): every word must appear in the name/title or description."""
+    sql, condition = LIKE_QUERIES[kind]
+    like_params = []
+    for term in terms:
+        like_params += [f'%{term}%', f'%{term}%']
+    rows = db.execute(
+        sql.format(terms=' AND '.join([condition] * len(terms)), where=''.join(f' AND {c}' for c in where)),
+        like_params + params + [limit, offset]
+    ).fetchall()
+    title, snippet = HTML_COLUMNS[kind]
+    results = []
+    for row in rows:
+        result = dict(row)
+        result[title] = _highlight(result[title], terms)
+        result[snippet] = _highlight(result[snippet], terms, snippet=True)
+        results.append(result)
+    return results # Same shape as the FTS5 rows, markers included
+
+def search(db, kind, text, args, page=1, per_page=20):
+    """Runs a ranked full-text search over tours or memories.
+
+    Returns (rows, has_more, filters). Rows are dicts; their ``*_html``
+    values are escaped Markup with the matched words in <mark>.
+
+    Only the newest SEARCH_RANK_WINDOW matches are ranked. A word found in
+    most of the catalog would otherwise make SQLite score every matching
+    row on each keystroke; the window keeps that to a bounded few
+    milliseconds, and recent tours are the ones customers look for.
+
+    Backends without FTS5 fall back to LIKE matching, newest first.
+    """
+    where, params, filters = search_filters(args, kind)
+    match = fts_query(text)
+    if match is None:
+        return [], False, filters
+    floor_sql, search_sql = QUERIES[kind]
+    extra = ''.join(f' AND {condition}' for condition in where)
+    window = current_app.config.get('SEARCH_RANK_WINDOW', 1000)
+    offset = (page - 1) * per_page
+    if offset >= window:
+        return [], False, filters
+    limit = min(per_page + 1, window - offset)
+
+    if dialect_of(db) != 'sqlite':
+        rows = _search_like(db, kind, _TERM.findall(text.lower())[:MAX_TERMS], where, params, offset, limit)
+    else:
+        floor = db.execute(floor_sql.format(where=extra), [match] + params + [window - 1]).fetchone()
+        rows = db.execute(
+            search_sql.format(where=extra),
+            [MARK_OPEN, MARK_CLOSE, MARK_OPEN, MARK_CLOSE, '…', match, floor[0] if floor else 0]
+            + params + [limit, offset]
+        ).fetchall()
+    has_more = len(rows) > per_page and offset + per_page < window
+    results = []
+    for row in rows[:per_page]:
+        result = dict(row)
+        for column in HTML_COLUMNS[kind]:
+            result[column] = _marked(result[column])
+        results.append(result)
+    return results, has_more, filters
+
+
+@click.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Re-index every tour and memory and merge the FTS5 index segments."""
+    db = get_db()
+    for table in ('tours_fts', 'memories_fts'):
+        db.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+        db.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+    db.commit()
+    click.echo('Rebuilt the tour and memory search indexes.')
+
+def init_app(app):
+    """Register the search index command with the Flask app."""
+    app.cli.add_command(rebuild_search_index_command)
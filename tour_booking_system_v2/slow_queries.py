@@ -0,0 +1,124 @@
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from flask import has_request_context, request
+
+threshold = None # Seconds; None = recorder off. Checked by metrics.InstrumentedConnection
+_log = deque(maxlen=200)
+_plans = {} # Normalized SQL -> plan lines, so a hot slow query is explained once
+_lock = threading.Lock()
+_logger = None
+
+PLAN_CACHE_SIZE = 256
+MAX_SQL_LENGTH = 2000 # executescript() can pass a whole schema
+
+
+_STRING_OR_COMMENT = re.compile(r"'(?:[^']|'')*'|--[^\n]*") # Scanned together so quotes in comments are ignored
+_NUMBER_LITERAL = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Collapses whitespace and replaces literals with ``?`` so equal queries group together."""
+    sql = _STRING_OR_COMMENT.sub(lambda m: '' if m.group().startswith('--') else '?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return sql if len(sql) <= MAX_SQL_LENGTH else sql[:MAX_SQL_LENGTH] + '...'
+
+def param_shape(params):
+    """Describes bind parameters by type only (never their values, which may be personal data)."""
+    if params is None:
+        return ''
+    if isinstance(params, dict):
+        return ', '.join(f':{name}={type(value).__name__}' for name, value in params.items())
+    try:
+        return ', '.join(type(value).__name__ for value in params)
+    except TypeError:
+        return type(params).__name__
+
+def explain(conn, sql, params):
+    """Returns EXPLAIN QUERY PLAN as indented lines, without going through the instrumented execute."""
+    try:
+        rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, params or ()).fetchall()
+    except sqlite3.Error as e:
+        return [f'(no plan: {e})']
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines or ['(no plan)']
+
+def record(conn, method, args, seconds):
+    """Adds one slow statement to the ring buffer and the log."""
+    sql = args[0] if args else ''
+    params = args[1] if len(args) > 1 else None
+    normalized = normalize_sql(sql)
+    if has_request_context():
+        route = f'{request.method} {request.endpoint or request.path}'
+    else:
+        route = f'thread {threading.current_thread().name}'
+
+    with _lock:
+        plan = _plans.get(normalized)
+    if plan is None:
+        if method == 'execute':
+            plan = explain(conn, sql, params)
+        else:
+            plan = [f'(not explained: {method})']
+        with _lock:
+            if len(_plans) >= PLAN_CACHE_SIZE:
+                _plans.clear()
+            _plans[normalized] = plan
+
+    entry = {
+        'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'ms': round(seconds * 1000, 2),
+        'sql': normalized,
+        'params': param_shape(params) if method == 'execute' else method,
+        'route': route,
+        'plan': plan,
+    }
+    with _lock:
+        _log.append(entry)
+    if _logger is not None:
+        _logger.warning(f"Slow query ({entry['ms']}ms, {route}): {normalized} [{entry['params']}] plan: {' | '.join(plan)}")
+
+def entries():
+    """Returns the recorded slow statements, newest first."""
+    with _lock:
+        return list(reversed(_log))
+
+def summary():
+    """Groups the ring buffer by normalized SQL: count, total and worst time, routes, latest plan."""
+    groups = {}
+    for entry in entries():
+        group = groups.get(entry['sql'])
+        if group is None:
+            group = groups[entry['sql']] = {
+                'sql': entry['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'routes': set(), 'plan': entry['plan'],
+            }
+        group['count'] += 1
+        group['total_ms'] += entry['ms']
+        group['max_ms'] = max(group['max_ms'], entry['ms'])
+        group['routes'].add(entry['route'])
+    return sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)
+
+def clear():
+    """Empties the ring buffer and forgets cached plans (e.g. after adding an index)."""
+    with _lock:
+        _log.clear()
+        _plans.clear()
+
+def init_app(app):
+    """Configure the recorder from SLOW_QUERY_THRESHOLD_MS and SLOW_QUERY_LOG_SIZE."""
+    global threshold, _log, _logger
+    threshold_ms = app.config.get('SLOW_QUERY_THRESHOLD_MS', 0)
+    threshold = threshold_ms / 1000 if threshold_ms > 0 else None
+    with _lock:
+        _log = deque(_log, maxlen=app.config.get('SLOW_QUERY_LOG_SIZE', 200))
+    _logger = app.logger
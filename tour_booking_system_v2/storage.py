@@ -0,0 +1,304 @@
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Backend-neutral exception names. SQLite raises these itself; the
+# SQLAlchemy backend re-raises driver errors as them, so call sites catch
+# one family whichever database is configured.
+DatabaseError = sqlite3.Error
+IntegrityError = sqlite3.IntegrityError
+OperationalError = sqlite3.OperationalError
+
+# Statements whose SQLite spelling means something else (or nothing) elsewhere
+STATEMENTS = {
+    'mysql': {'BEGIN IMMEDIATE': 'START TRANSACTION'}, # InnoDB row locks do what SQLite's write lock did
+}
+
+# A quoted string (left alone) or a ? placeholder
+_PLACEHOLDER = re.compile(r"'(?:[^']|'')*'|\?")
+
+
+class PoolTimeout(OperationalError):
+    """Raised when no pooled connection became free within DB_POOL_TIMEOUT."""
+
+
+def dialect_of(db):
+    """Returns the SQL dialect ('sqlite', 'mysql', ...) a connection speaks."""
+    return getattr(db, 'dialect', 'sqlite')
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql, dialect, paramstyle, escape_percent):
+    """Rewrites SQL written for sqlite3 (qmark placeholders) for another driver.
+
+    Cached, since the app sends the same few hundred statements over and over.
+    """
+    sql = STATEMENTS.get(dialect, {}).get(sql.strip(), sql)
+    if paramstyle == 'qmark':
+        return sql
+    if escape_percent == 'all':
+        sql = sql.replace('%', '%%')
+    elif escape_percent == 'format':
+        sql = sql.replace('%s', '%%s') # mysql-connector only treats %s as a placeholder
+    return _PLACEHOLDER.sub(lambda m: '%s' if m.group() == '?' else m.group(), sql)
+
+
+class Row(tuple):
+    """A result row readable by position or by column name, like sqlite3.Row."""
+
+    def __new__(cls, values, index):
+        row = super().__new__(cls, values)
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._index)
+
+
+class Cursor:
+    """Wraps a DB-API cursor so rows come back as Row."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        description = cursor.description
+        self._index = {column[0]: i for i, column in enumerate(description)} if description else {}
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def fetchone(self):
+        values = self._cursor.fetchone()
+        return None if values is None else Row(values, self._index)
+
+    def fetchmany(self, size=None):
+        rows = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        return [Row(values, self._index) for values in rows]
+
+    def fetchall(self):
+        return [Row(values, self._index) for values in self._cursor.fetchall()]
+
+    def __iter__(self):
+        while True:
+            values = self._cursor.fetchone()
+            if values is None:
+                return
+            yield Row(values, self._index)
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    """The subset of sqlite3.Connection the app uses, over a pooled SQLAlchemy connection.
+
+    Statements are written once, in SQLite's dialect with ? placeholders,
+    and rewritten for the driver on the way out (see translate).
+    """
+
+    def __init__(self, raw, pool):
+        self._raw = raw
+        self._pool = pool
+        self.dialect = pool.dialect
+
+    def _run(self, method, sql, params):
+        cursor = self._raw.cursor()
+        try:
+            if params is None:
+                # Drivers only interpret % when given parameters (DATE_FORMAT in schema_mysql.sql)
+                getattr(cursor, method)(self._pool.translate(sql, escape_percent=None))
+            else:
+                getattr(cursor, method)(self._pool.translate(sql), params)
+        except self._pool.driver_error as e:
+            cursor.close()
+            raise self._pool.neutral_error(e) from e
+        return Cursor(cursor)
+
+    def execute(self, sql, params=()):
+        return self._run('execute', sql, tuple(params) if params else None)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run('executemany', sql, (tuple(params) for params in seq_of_params))
+
+    def executescript(self, script):
+        # Only the SQLite driver has this; init_db splits scripts for other backends
+        return self._raw.driver_connection.executescript(script)
+
+    def commit(self):
+        try:
+            self._raw.commit()
+        except self._pool.driver_error as e:
+            raise self._pool.neutral_error(e) from e
+
+    def rollback(self):
+        self._raw.rollback()
+
+    @property
+    def in_transaction(self):
+        # mysql-connector and sqlite3 both track this; assume the worst for other drivers
+        return getattr(self._raw.driver_connection, 'in_transaction', True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def close(self):
+        self._raw.close() # Back to the SQLAlchemy pool, which rolls back anything left open
+
+
+class EnginePool:
+    """A per-process SQLAlchemy connection pool, used when DATABASE_URL is set.
+
+    It has the same acquire/release/stats interface as the SQLite
+    ConnectionPool in database.py. Connections are handed out raw (no ORM),
+    so every query still runs as written.
+    """
+
+    def __init__(self, url, size, max_overflow, timeout, recycle, pre_ping, isolation_level=None):
+        try:
+            from sqlalchemy import create_engine, make_url
+        except ImportError:
+            raise RuntimeError('DATABASE_URL needs SQLAlchemy (pip install -r requirements.txt).')
+
+        options = {}
+        if not isolation_level and make_url(url).get_backend_name() == 'mysql':
+            # Each statement sees the latest commits, as on SQLite; under InnoDB's
+            # default REPEATABLE READ the queue pollers would keep reading an old snapshot
+            isolation_level = 'READ COMMITTED'
+        if isolation_level:
+            options['isolation_level'] = isolation_level
+        self.database = url
+        self.pid = os.getpid()
+        self.engine = create_engine(
+            url,
+            pool_size=size,
+            max_overflow=max_overflow,
+            pool_timeout=timeout,
+            pool_recycle=recycle, # Seconds; replaces connections before the server or a proxy drops them
+            pool_pre_ping=pre_ping, # Tests each connection on checkout, so a restarted server costs no failed request
+            **options
+        )
+        dialect = self.engine.dialect
+        self.dialect = dialect.name
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        dbapi = dialect.dbapi
+        if dbapi.paramstyle not in ('qmark', 'format', 'pyformat'):
+            raise RuntimeError(f'The {dialect.driver} driver uses {dbapi.paramstyle} parameters, which are not supported.')
+        # sqlite3 errors (a sqlite:// URL) already are the neutral ones, so let them through
+        self.driver_error = () if issubclass(dbapi.Error, sqlite3.Error) else dbapi.Error
+        self._integrity_error = dbapi.IntegrityError
+        self._operational_error = dbapi.OperationalError
+        if dialect.driver == 'mysqlconnector':
+            escape = 'format'
+        elif dbapi.paramstyle in ('format', 'pyformat'):
+            escape = 'all'
+        else:
+            escape = None
+        self.translate = functools.partial(translate, dialect=self.dialect, paramstyle=dbapi.paramstyle, escape_percent=escape)
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._timeouts = 0
+
+    def neutral_error(self, error):
+        """Maps a driver exception onto DatabaseError / IntegrityError / OperationalError."""
+        if isinstance(error, self._integrity_error):
+            return IntegrityError(str(error))
+        if isinstance(error, self._operational_error):
+            return OperationalError(str(error))
+        return DatabaseError(str(error))
+
+    def acquire(self):
+        from sqlalchemy.exc import DBAPIError, TimeoutError as QueueTimeout
+        pool = self.engine.pool
+        started = time.monotonic()
+        # Every connection (overflow included) is out, so this checkout queues
+        full = hasattr(pool, 'checkedout') and pool.checkedout() >= self.size + self.max_overflow
+        try:
+            raw = self.engine.raw_connection()
+        except QueueTimeout:
+            with self._lock:
+                self._waits += 1
+                self._timeouts += 1
+            raise PoolTimeout(
+                f"No database connection available after {self.timeout}s "
+                f"(pool size {self.size} + overflow {self.max_overflow})."
+            )
+        except DBAPIError as e:
+            raise self.neutral_error(e.orig) from e
+        with self._lock:
+            self._checkouts += 1
+            if full:
+                self._waits += 1
+                self._wait_seconds += time.monotonic() - started
+        return Connection(raw, self)
+
+    def release(self, conn):
+        conn.close()
+
+    def detach(self):
+        """Forgets connections inherited from a parent process without closing its sockets."""
+        self.engine.dispose(close=False)
+
+    def stats(self):
+        pool = self.engine.pool
+        checked_in = pool.checkedin() if hasattr(pool, 'checkedin') else 0
+        checked_out = pool.checkedout() if hasattr(pool, 'checkedout') else 0
+        with self._lock:
+            return {
+                'backend': self.dialect,
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'opened': checked_in + checked_out,
+                'in_use': checked_out,
+                'idle': checked_in,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_seconds': round(self._wait_seconds, 6),
+                'timeouts': self._timeouts,
+            }
+
+
+def split_script(script):
+    """Splits a SQL script into statements, honouring mysql-client DELIMITER lines.
+
+    Lets one schema file both seed a MySQL container (docker-entrypoint-initdb.d)
+    and be run statement by statement by `flask init-db`.
+    """
+    statements, current, delimiter = [], [], ';'
+    for line in script.splitlines():
+        stripped = line.strip()
+        if stripped.upper().startswith('DELIMITER '):
+            delimiter = stripped.split(None, 1)[1]
+            continue
+        if not current and (not stripped or stripped.startswith('--')):
+            continue
+        current.append(line)
+        if stripped.endswith(delimiter):
+            statement = '\n'.join(current).rstrip()[:-len(delimiter)].strip()
+            if statement:
+                statements.append(statement)
+            current = []
+    if ''.join(current).strip():
+        statements.append('\n'.join(current).strip())
+    return statements
@@ -0,0 +1,167 @@
+import threading
+import time
+
+import click
+from flask import current_app
+
+from .background import BackgroundWorker
+from .database import get_db
+from .inventory import release_expired_holds
+
+ARCHIVED_STATUSES = ('failed', 'expired')
+MAX_BATCH_SIZE = 500 # Keeps each IN (...) list under SQLite's bound-parameter limit
+
+_stats_lock = threading.Lock()
+_stats = {'runs': 0, 'holds_released': 0, 'expired': 0, 'archived': 0, 'last_run_at': None, 'last_run_seconds': 0.0}
+
+
+def _utc_cutoff(age_seconds):
+    # booking_date is written by CURRENT_TIMESTAMP, i.e. UTC 'YYYY-MM-DD HH:MM:SS'
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - age_seconds))
+
+def _write_batch(db, work):
+    """Runs ``work(db)`` in its own short write transaction and returns its result."""
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        result = work(db)
+        db.commit()
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return result
+
+def expire_pending_batch(db, cutoff, batch_size):
+    """Marks up to ``batch_size`` pending bookings made before ``cutoff`` as expired.
+
+    Any seat hold they still have is released in the same transaction.
+    Returns the number of bookings expired.
+    """
+    def work(db):
+        ids = [row['id'] for row in db.execute(
+            "SELECT id FROM bookings WHERE payment_status = 'pending' AND booking_date < ? "
+            'ORDER BY booking_date, id LIMIT ?',
+            (cutoff, batch_size)
+        )]
+        if not ids:
+            return 0
+        marks = ', '.join('?' * len(ids))
+        held = db.execute(
+            f"SELECT tour_id, SUM(seats) AS seats FROM seat_holds WHERE status = 'held' AND booking_id IN ({marks}) GROUP BY tour_id",
+            ids
+        ).fetchall()
+        db.executemany(
+            'UPDATE tours SET held_participants = held_participants - ? WHERE id = ?',
+            [(row['seats'], row['tour_id']) for row in held]
+        )
+        db.execute(f"UPDATE seat_holds SET status = 'released' WHERE status = 'held' AND booking_id IN ({marks})", ids)
+        return db.execute(
+            f"UPDATE bookings SET payment_status = 'expired' WHERE payment_status = 'pending' AND id IN ({marks})", ids
+        ).rowcount
+
+    return _write_batch(db, work)
+
+def archive_batch(db, status, cutoff, batch_size):
+    """Moves up to ``batch_size`` ``status`` bookings made before ``cutoff`` to bookings_archive.
+
+    Their (released) seat hold rows are deleted with them. Returns the
+    number of bookings archived.
+    """
+    def work(db):
+        ids = [row['id'] for row in db.execute(
+            'SELECT id FROM bookings WHERE payment_status = ? AND booking_date < ? ORDER BY booking_date, id LIMIT ?',
+            (status, cutoff, batch_size)
+        )]
+        if not ids:
+            return 0
+        marks = ', '.join('?' * len(ids))
+        db.execute(
+            'INSERT INTO bookings_archive (id, tour_id, user_id, customer_name, customer_email, num_participants, '
+            'booking_date, payment_status, mpesa_receipt, amount_paid, phone_number_paid, archived_at) '
+            'SELECT id, tour_id, user_id, customer_name, customer_email, num_participants, '
+            f'booking_date, payment_status, mpesa_receipt, amount_paid, phone_number_paid, ? FROM bookings WHERE id IN ({marks})',
+            [time.time()] + ids
+        )
+        db.execute(f"DELETE FROM seat_holds WHERE status != 'held' AND booking_id IN ({marks})", ids)
+        db.execute(f'DELETE FROM stk_pushes WHERE booking_id IN ({marks})', ids)
+        return db.execute(f'DELETE FROM bookings WHERE id IN ({marks})', ids).rowcount
+
+    return _write_batch(db, work)
+
+def sweep(db, pending_ttl=None, archive_after_days=None, batch_size=None):
+    """Releases expired holds, expires stale pending bookings and archives old failed/expired ones.
+
+    Work is done in batches of ``batch_size`` rows, each its own short
+    transaction, so checkouts are never blocked for long. Returns counts.
+    """
+    config = current_app.config
+    pending_ttl = config.get('BOOKING_PENDING_TTL', 86400) if pending_ttl is None else pending_ttl
+    archive_after_days = config.get('BOOKING_ARCHIVE_AFTER_DAYS', 30) if archive_after_days is None else archive_after_days
+    batch_size = min(batch_size or config.get('SWEEP_BATCH_SIZE', 500), MAX_BATCH_SIZE)
+    started = time.perf_counter()
+
+    result = {'holds_released': release_expired_holds(db), 'expired': 0, 'archived': 0}
+    cutoff = _utc_cutoff(pending_ttl)
+    while True:
+        expired = expire_pending_batch(db, cutoff, batch_size)
+        result['expired'] += expired
+        if expired < batch_size:
+            break
+    if archive_after_days > 0:
+        cutoff = _utc_cutoff(archive_after_days * 86400)
+        for status in ARCHIVED_STATUSES:
+            while True:
+                archived = archive_batch(db, status, cutoff, batch_size)
+                result['archived'] += archived
+                if archived < batch_size:
+                    break
+
+    with _stats_lock:
+        _stats['runs'] += 1
+        for key in ('holds_released', 'expired', 'archived'):
+            _stats[key] += result[key]
+        _stats['last_run_at'] = time.time()
+        _stats['last_run_seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+def sweeper_stats():
+    """Returns this process's sweep totals and when it last ran."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _scheduled_sweep(app):
+    result = sweep(get_db())
+    if result['expired'] or result['archived']:
+        app.logger.info(
+            f"Booking sweep: {result['expired']} expired, {result['archived']} archived, "
+            f"{result['holds_released']} holds released."
+        )
+    return False # Sleep SWEEP_INTERVAL until the next run
+
+sweep_worker = BackgroundWorker('booking-sweeper', _scheduled_sweep)
+
+
+@click.command('sweep-bookings')
+@click.option('--pending-ttl', type=int, help='Seconds a booking may stay pending. Default: BOOKING_PENDING_TTL.')
+@click.option('--archive-after', 'archive_after_days', type=int, help='Days before failed/expired bookings are archived; 0 = never. Default: BOOKING_ARCHIVE_AFTER_DAYS.')
+@click.option('--batch-size', type=click.IntRange(1, MAX_BATCH_SIZE), help='Rows per transaction. Default: SWEEP_BATCH_SIZE.')
+def sweep_bookings_command(pending_ttl, archive_after_days, batch_size):
+    """Expire stale pending bookings and archive old failed ones (run from cron)."""
+    result = sweep(get_db(), pending_ttl, archive_after_days, batch_size)
+    click.echo(
+        f"Expired {result['expired']} pending bookings, archived {result['archived']}, "
+        f"released {result['holds_released']} seat holds."
+    )
+
+def init_app(app):
+    """Configure the optional in-process sweeper and register the sweep command."""
+    interval = app.config.get('SWEEP_INTERVAL', 0)
+    sweep_worker.threads = 1 if interval > 0 else 0
+    sweep_worker.interval = interval
+
+    @app.before_request
+    def start_sweep_worker():
+        sweep_worker.ensure_started(app)
+
+    app.cli.add_command(sweep_bookings_command)